@@ -2,33 +2,98 @@
 # 🔐 Secure Alberta NEPH Billing App
 # --------------------------------------
 
+from datetime import date
+
 import streamlit as st
 import pandas as pd
+import altair as alt
 import yaml
 import streamlit_authenticator as stauth
 
-from billing_functions import (
-    consult_03_08A,
-    consult_03_08CV,
-    repeat_visit_03_03F,
-    repeat_consultation_03_07B,
-    followup_virtual_visit_03_03FV,
-    prolonged_consult_addon_03_08I,
-    optimal_billing_strategy,
-    redistribute_unbilled_units
-)
+from billing_functions import optimal_billing_strategy
+from billing_breakdown import format_breakdown
+from clinic_optimizer import IncrementalPlanner
+from clinic_simulation import DEFAULT_VISIT_MODELS, DISTRIBUTIONS, VisitModel, simulate_clinics, summarize_simulation
+from scenario_sweep import sweep_clinics
+from dialysis_forecast import annual_revenue, forecast_dialysis
+from claims_store import ClaimsStore
+from claim_export import export_bytes
+from weekly_scheduler import schedule_week
+import billing_metrics
+
+# ---------------------------
+# ⚡ Cached Config & Pricing
+# ---------------------------
+# Every widget interaction reruns this script. The fee schedule is compiled
+# once per process when fee_schedule is imported; the config and all pricing
+# results are cached here so a rerun only recomputes what changed.
+
+@st.cache_data
+def load_config(path: str = 'config.yaml') -> dict:
+    # cache_data hands each caller its own copy, which matters because
+    # stauth.Authenticate rewrites the credentials dict it is given
+    with open(path) as file:
+        return yaml.safe_load(file)
+
+@st.cache_data(max_entries=1024)
+def quote_visit(hsc_code: str, duration: int, virtual: bool, time_of_day: str) -> dict:
+    return optimal_billing_strategy(hsc_code, duration_minutes=duration, virtual=virtual, time_of_day=time_of_day)
+
+def clinic_planner() -> IncrementalPlanner:
+    # One planner per session: each rerun applies only what changed in the
+    # inputs to the plan already solved, instead of solving it again
+    if "clinic_planner" not in st.session_state:
+        st.session_state["clinic_planner"] = IncrementalPlanner()
+    return st.session_state["clinic_planner"]
+
+@st.cache_data(max_entries=64)
+def revenue_surface(hours_range: tuple, new_range: tuple, repeat_range: tuple, follow_range: tuple,
+                    virtual: bool, apply_rrnp: bool, time_of_day: str) -> pd.DataFrame:
+    return sweep_clinics(
+        range(hours_range[0], hours_range[1] + 1),
+        range(new_range[0], new_range[1] + 1),
+        range(repeat_range[0], repeat_range[1] + 1),
+        range(follow_range[0], follow_range[1] + 1),
+        virtual=(virtual,),
+        apply_rrnp=(apply_rrnp,),
+        time_of_day=(time_of_day,),
+    )
+
+@st.cache_data(max_entries=16)
+def simulate_revenue(days: int, clinic_hours: int, new_consults: int, repeat_consults: int, follow_ups: int,
+                     models: tuple, virtual: bool, apply_rrnp: bool, time_of_day: str, seed: int):
+    simulated = simulate_clinics(days, new_consults, repeat_consults, follow_ups, models=dict(models),
+                                 virtual=virtual, apply_rrnp=apply_rrnp, time_of_day=time_of_day, seed=seed)
+    return simulated, summarize_simulation(simulated, clinic_hours=clinic_hours, virtual=virtual)
+
+@st.cache_data(max_entries=16)
+def weekly_schedule(sessions: pd.DataFrame, backlog: pd.DataFrame, apply_rrnp: bool):
+    return schedule_week(sessions, backlog, apply_rrnp=apply_rrnp)
+
+@st.cache_data(max_entries=16)
+def claim_export(claims: pd.DataFrame, format: str) -> bytes:
+    return export_bytes(claims, format)
+
+@st.cache_resource
+def claims_store() -> ClaimsStore:
+    return ClaimsStore()
+
+@st.cache_data(max_entries=16)
+def dialysis_revenue(census: pd.DataFrame, start, weeks: int, apply_rrnp: bool) -> pd.DataFrame:
+    return forecast_dialysis(census, start, weeks=weeks, apply_rrnp=apply_rrnp)
 
 # ---------------------------
 # 🔒 User Authentication
 # ---------------------------
 
-with open('config.yaml') as file:
-    config = yaml.safe_load(file)
+config = load_config()
 
 if 'credentials' not in config or 'usernames' not in config['credentials']:
     st.error("❌ 'usernames' key not found in config.yaml.")
     st.stop()
 
+# Built per run on purpose: the authenticator renders the cookie component
+# and holds this browser's cookies, so it cannot be shared across sessions.
 authenticator = stauth.Authenticate(
     config['credentials'],
     config['cookie']['name'],
@@ -49,173 +114,370 @@ else:
     st.success(f"Welcome, {name} 👋")
     authenticator.logout("Logout", location='sidebar')
 
+# ---------------------------------------
+# 🛠️ Diagnostics (hidden)
+# ---------------------------------------
+# Only with NEPHBILL_METRICS=1 and ?diagnostics=1 in the URL. Shows latency
+# of the instrumented pricing calls in this server process.
+
+if billing_metrics.ENABLED and st.query_params.get("diagnostics") == "1":
+    with st.sidebar.expander("🛠️ Pricing diagnostics"):
+        metrics = billing_metrics.snapshot()
+        st.dataframe(metrics.style.format({c: "{:.1f}" for c in metrics.columns if c.endswith(("_ms", "_us"))}),
+                     hide_index=True)
+        st.download_button("Prometheus metrics", billing_metrics.prometheus_text(), file_name="nephbill.prom")
+        if billing_metrics.METRICS_FILE:
+            st.caption(f"Written to {billing_metrics.write_prometheus()}")
+        if st.button("Reset metrics"):
+            billing_metrics.reset()
+
 # ---------------------------------
 # 🩺 Individual Billing Calculator
 # ---------------------------------
 
-st.title("🩺 Alberta NEPH Billing Calculator")
-
-visit_type = st.selectbox("Select Visit Type", ["New consult", "Repeat consult", "Follow up"])
-is_virtual = st.checkbox("Virtual Visit?", value=False)
-units = st.number_input("Total time spent (in 15-minute units)", min_value=1, max_value=8, value=1)
-duration = units * 15
-
-if visit_type == "New consult":
-    hsc_code = "03.08CV" if is_virtual else "03.08A"
-elif visit_type == "Repeat consult":
-    hsc_code = "03.07B"
-elif visit_type == "Follow up":
-    hsc_code = "03.03FV" if is_virtual else "03.03F"
-else:
-    hsc_code = None
-
-time_of_day_code = None
-if hsc_code == "03.07B":
-    time_of_day = st.selectbox(
-        "Time of Day (for after-hours SURC modifier)",
-        ["None", "EV (Evening)", "WK (Weekend)", "NTAM (Night AM)", "NTPM (Night PM)"]
-    )
-    time_of_day_code = None if time_of_day == "None" else time_of_day.split()[0]
-
-if st.button("Calculate Billing Amount"):
-    result = optimal_billing_strategy(
-        hsc_code, duration_minutes=duration, virtual=is_virtual, time_of_day=time_of_day_code
-    )
+@st.fragment
+def individual_calculator():
+    st.title("🩺 Alberta NEPH Billing Calculator")
+
+    visit_type = st.selectbox("Select Visit Type", ["New consult", "Repeat consult", "Follow up"])
+    is_virtual = st.checkbox("Virtual Visit?", value=False)
+    units = st.number_input("Total time spent (in 15-minute units)", min_value=1, max_value=8, value=1)
+    duration = units * 15
+
+    if visit_type == "New consult":
+        hsc_code = "03.08CV" if is_virtual else "03.08A"
+    elif visit_type == "Repeat consult":
+        hsc_code = "03.07B"
+    elif visit_type == "Follow up":
+        hsc_code = "03.03FV" if is_virtual else "03.03F"
+    else:
+        hsc_code = None
 
+    time_of_day_code = None
     if hsc_code == "03.07B":
-        base_fee = repeat_consultation_03_07B(
-            complexity=result["modifiers_applied"][0] if result["modifiers_applied"] else None,
-            virtual=is_virtual,
-            time_of_day=time_of_day_code
+        time_of_day = st.selectbox(
+            "Time of Day (for after-hours SURC modifier)",
+            ["None", "EV (Evening)", "WK (Weekend)", "NTAM (Night AM)", "NTPM (Night PM)"]
         )
-        addon_fee = sum([
-            prolonged_consult_addon_03_08I(int(code.split("(")[1].split()[0]), is_virtual)
-            for code in result["add_on_codes"] if "03.08I" in code
-        ])
-        result["total_fee"] = round(base_fee + addon_fee, 2)
+        time_of_day_code = None if time_of_day == "None" else time_of_day.split()[0]
+
+    if st.button("Calculate Billing Amount"):
+        result = quote_visit(hsc_code, duration, is_virtual, time_of_day_code)
 
-    st.success(f"💵 Total Billable Amount: ${result['total_fee']:.2f}")
-    st.write(f"📋 Visit Type: **{visit_type}** ({hsc_code})")
+        st.success(f"💵 Total Billable Amount: ${result['total_fee']:.2f}")
+        st.write(f"📋 Visit Type: **{visit_type}** ({hsc_code})")
 
-    if result["modifiers_applied"]:
-        st.markdown("🧾 **Modifiers Applied:**")
-        for mod in result["modifiers_applied"]:
-            st.markdown(f"- {mod}")
+        if result["modifiers_applied"]:
+            st.markdown("🧾 **Modifiers Applied:**")
+            for mod in result["modifiers_applied"]:
+                st.markdown(f"- {mod}")
 
-    if result["add_on_codes"]:
-        st.markdown("➕ **Add-on Codes:**")
-        for code in result["add_on_codes"]:
-            st.markdown(f"- {code}")
+        if result["add_on_codes"]:
+            st.markdown("➕ **Add-on Codes:**")
+            for code in result["add_on_codes"]:
+                st.markdown(f"- {code}")
 
 # ---------------------------------------
 # 📈 Optimization Section with RRNP
 # ---------------------------------------
 
-st.header("📈 Optimize Clinic Billing")
+SWEEP_AXES = {
+    "clinic_hours": "Clinic hours",
+    "new_consults": "New consults",
+    "repeat_consults": "Repeat consults",
+    "follow_ups": "Follow-ups",
+}
 
-clinic_duration_hours = st.number_input("Clinic duration (hours)", min_value=1, max_value=12, value=8)
-new_consults = st.number_input("Number of new consults", min_value=0, value=5)
-repeat_consults = st.number_input("Number of repeat consults", min_value=0, value=5)
-follow_ups = st.number_input("Number of follow-ups", min_value=0, value=10)
+@st.fragment
+def clinic_billing_optimizer():
+    st.header("📈 Optimize Clinic Billing")
 
-total_patients = new_consults + repeat_consults + follow_ups
-st.markdown(f"👥 **Total Patients:** {total_patients}")
+    clinic_duration_hours = st.number_input("Clinic duration (hours)", min_value=1, max_value=12, value=8)
+    new_consults = st.number_input("Number of new consults", min_value=0, value=5)
+    repeat_consults = st.number_input("Number of repeat consults", min_value=0, value=5)
+    follow_ups = st.number_input("Number of follow-ups", min_value=0, value=10)
 
-bulk_virtual = st.checkbox("Are all visits virtual?", value=False)
-apply_rrnp = st.checkbox("Apply RRNP Uplift (+19.98%)", value=False)
+    total_patients = new_consults + repeat_consults + follow_ups
+    st.markdown(f"👥 **Total Patients:** {total_patients}")
 
-time_of_day_bulk = st.selectbox(
-    "Time of Day for Repeat Consults (optional)",
-    ["None", "EV (Evening)", "WK (Weekend)", "NTAM (Night AM)", "NTPM (Night PM)"]
-)
-time_of_day_code = None if time_of_day_bulk == "None" else time_of_day_bulk.split()[0]
+    bulk_virtual = st.checkbox("Are all visits virtual?", value=False)
+    apply_rrnp = st.checkbox("Apply RRNP Uplift (+19.98%)", value=False)
 
-if st.button("Optimize Billing"):
-    if total_patients == 0:
-        st.error("Total patient count must be greater than 0.")
-    else:
-        total_minutes = clinic_duration_hours * 60
-        avg_time = total_minutes // total_patients
-        available_units = total_minutes // 15
-        breakdown = []
-
-        for _ in range(new_consults):
-            code = "03.08CV" if bulk_virtual else "03.08A"
-            r = optimal_billing_strategy(code, duration_minutes=avg_time, virtual=bulk_virtual)
-            fee = round(r["total_fee"] * 1.1998, 2) if apply_rrnp else r["total_fee"]
-            breakdown.append({
-                "Visit Type": "New Consult",
-                "HSC Code": code,
-                "Modifiers": ", ".join(r["modifiers_applied"]) or "-",
-                "Add-ons": ", ".join(r["add_on_codes"]) or "-",
-                "Fee ($)": fee
-            })
-
-        for _ in range(repeat_consults):
-            r = optimal_billing_strategy("03.07B", duration_minutes=avg_time, virtual=bulk_virtual, time_of_day=time_of_day_code)
-            base_fee = repeat_consultation_03_07B(
-                complexity=r["modifiers_applied"][0] if r["modifiers_applied"] else None,
-                virtual=bulk_virtual,
-                time_of_day=time_of_day_code
+    time_of_day_bulk = st.selectbox(
+        "Time of Day for Repeat Consults (optional)",
+        ["None", "EV (Evening)", "WK (Weekend)", "NTAM (Night AM)", "NTPM (Night PM)"]
+    )
+    time_of_day_code = None if time_of_day_bulk == "None" else time_of_day_bulk.split()[0]
+
+    save_clinic = st.checkbox("Save optimized clinic to claims store", value=False)
+    service_date = st.date_input("Clinic date") if save_clinic else None
+
+    if st.button("Optimize Billing"):
+        try:
+            planner = clinic_planner()
+            planner.update(
+                clinic_duration_hours, new_consults, repeat_consults, follow_ups,
+                bulk_virtual, apply_rrnp, time_of_day_code
             )
-            addon_fee = sum([
-                prolonged_consult_addon_03_08I(int(code.split("(")[1].split()[0]), bulk_virtual)
-                for code in r["add_on_codes"] if "03.08I" in code
-            ])
-            total_fee = round(base_fee + addon_fee, 2)
-            fee = round(total_fee * 1.1998, 2) if apply_rrnp else total_fee
-            breakdown.append({
-                "Visit Type": "Repeat Consult",
-                "HSC Code": "03.07B",
-                "Modifiers": ", ".join(r["modifiers_applied"]) or "-",
-                "Add-ons": ", ".join(r["add_on_codes"]) or "-",
-                "Fee ($)": fee
-            })
-
-        for _ in range(follow_ups):
-            code = "03.03FV" if bulk_virtual else "03.03F"
-            r = optimal_billing_strategy(code, duration_minutes=avg_time, virtual=bulk_virtual)
-            fee = round(r["total_fee"] * 1.1998, 2) if apply_rrnp else r["total_fee"]
-            breakdown.append({
-                "Visit Type": "Follow-up",
-                "HSC Code": code,
-                "Modifiers": ", ".join(r["modifiers_applied"]) or "-",
-                "Add-ons": ", ".join(r["add_on_codes"]) or "-",
-                "Fee ($)": fee
-            })
-
-        breakdown = redistribute_unbilled_units(breakdown, available_units)
-
-        total_revenue = sum(row["Fee ($)"] for row in breakdown)
-        addon_units = sum([
-            int(code.split("(")[1].split()[0])
-            for row in breakdown
-            for code in row["Add-ons"].split(", ")
-            if "03.08I" in code
-        ])
-        base_units = new_consults * 2 + repeat_consults + follow_ups
-        total_units_billed = base_units + addon_units
-        unbilled_units = available_units - total_units_billed
-        efficiency_pct = (total_units_billed / available_units) * 100
-
-        st.success(f"📊 Optimized Revenue: ${total_revenue:.2f}")
-        if apply_rrnp:
-            st.markdown("🔺 **RRNP Uplift Applied (19.98%)**")
-
-        st.markdown(f"- ⏱️ Avg. Time per Patient: **{avg_time} mins**")
-        st.markdown(f"- 🧾 New Consults: ${sum(row['Fee ($)'] for row in breakdown if row['Visit Type'] == 'New Consult'):.2f}")
-        st.markdown(f"- 🔁 Repeat Consults: ${sum(row['Fee ($)'] for row in breakdown if row['Visit Type'] == 'Repeat Consult'):.2f}")
-        st.markdown(f"- 📋 Follow-ups: ${sum(row['Fee ($)'] for row in breakdown if row['Visit Type'] == 'Follow-up'):.2f}")
-
-        st.subheader("📋 Detailed Billing Breakdown")
-        df = pd.DataFrame(breakdown)
-        st.dataframe(df.style.format({"Fee ($)": "{:.2f}"}))
-
-        st.markdown("---")
-        st.subheader("🧮 Billing Unit Summary")
-        st.markdown(f"- 📦 **Total Available Units**: {available_units}")
-        st.markdown(f"- 💳 **Total Billed Units**: {total_units_billed}")
-        st.markdown(f"&nbsp;&nbsp;&nbsp;&nbsp;🔹 Base Units: {base_units}")
-        st.markdown(f"&nbsp;&nbsp;&nbsp;&nbsp;🔹 Add-on Units (03.08I): {addon_units}")
-        st.markdown(f"- ⚠️ **Unbilled Units**: {unbilled_units}")
-        st.markdown(f"- 📈 **Efficiency**: {efficiency_pct:.1f}%")
+            breakdown, summary = planner.plan()
+        except ValueError as exc:
+            st.error(str(exc))
+        else:
+            by_type = summary["cents_by_visit_type"]
+
+            st.success(f"📊 Optimized Revenue: ${summary['total_cents'] / 100:.2f}")
+            if apply_rrnp:
+                st.markdown("🔺 **RRNP Uplift Applied (19.98%)**")
+
+            st.markdown(f"- ⏱️ Avg. Time per Patient: **{summary['avg_time']} mins**")
+            st.markdown(f"- 🧾 New Consults: ${by_type['New Consult'] / 100:.2f}")
+            st.markdown(f"- 🔁 Repeat Consults: ${by_type['Repeat Consult'] / 100:.2f}")
+            st.markdown(f"- 📋 Follow-ups: ${by_type['Follow-up'] / 100:.2f}")
+
+            st.subheader("📋 Detailed Billing Breakdown")
+            df = format_breakdown(breakdown)
+            st.dataframe(df.style.format({"Fee ($)": "{:.2f}"}))
+
+            claims = breakdown.assign(physician_id=username, service_date=service_date or date.today(),
+                                      time_of_day=time_of_day_code, virtual=bulk_virtual)
+            csv_col, fixed_col, parquet_col = st.columns(3)
+            csv_col.download_button("⬇️ CSV", claim_export(claims, "csv"), file_name="clinic_claims.csv",
+                                    mime="text/csv")
+            fixed_col.download_button("⬇️ Claim file", claim_export(claims, "fixed"), file_name="clinic_claims.txt",
+                                      mime="text/plain")
+            parquet_col.download_button("⬇️ Parquet", claim_export(claims, "parquet"),
+                                        file_name="clinic_claims.parquet", mime="application/octet-stream")
+
+            st.markdown("---")
+            st.subheader("🧮 Billing Unit Summary")
+            st.markdown(f"- 📦 **Total Available Units**: {summary['available_units']}")
+            st.markdown(f"- 💳 **Total Billed Units**: {summary['billed_units']}")
+            st.markdown(f"&nbsp;&nbsp;&nbsp;&nbsp;🔹 Base Units: {summary['base_units']}")
+            st.markdown(f"&nbsp;&nbsp;&nbsp;&nbsp;🔹 Add-on Units (03.08I): {summary['addon_units']}")
+            st.markdown(f"- ⚠️ **Unbilled Units**: {summary['unbilled_units']}")
+            st.markdown(f"- 📈 **Efficiency**: {summary['efficiency_pct']:.1f}%")
+
+            if save_clinic:
+                clinic_id = claims_store().save_clinic(
+                    username, service_date, breakdown, summary, clinic_duration_hours,
+                    virtual=bulk_virtual, apply_rrnp=apply_rrnp, time_of_day=time_of_day_code
+                )
+                st.info(f"💾 Saved as clinic #{clinic_id} ({len(breakdown)} claims)")
+
+    # ---------------------------------------
+    # 🧭 Scenario Explorer
+    # ---------------------------------------
+    # Lives in the same fragment because it follows the virtual, RRNP and
+    # time-of-day settings above.
+
+    st.header("🧭 Scenario Explorer")
+    st.caption("Optimized revenue across clinic lengths and patient mixes, using the virtual, RRNP and time-of-day settings above.")
+
+    hours_range = st.slider("Clinic hours", 1, 12, (4, 12))
+    new_range = st.slider("New consults", 0, 20, (0, 8))
+    repeat_range = st.slider("Repeat consults", 0, 20, (0, 8))
+    follow_range = st.slider("Follow-ups", 0, 30, (0, 16))
+
+    surface = revenue_surface(hours_range, new_range, repeat_range, follow_range,
+                              bulk_virtual, apply_rrnp, time_of_day_code)
+
+    x_axis = st.selectbox("Heatmap columns", list(SWEEP_AXES), index=3, format_func=SWEEP_AXES.get)
+    y_axis = st.selectbox("Heatmap rows", [a for a in SWEEP_AXES if a != x_axis], index=0, format_func=SWEEP_AXES.get)
+    metric = st.radio("Metric", ["revenue", "efficiency_pct"], horizontal=True,
+                      format_func=lambda m: "Revenue ($)" if m == "revenue" else "Efficiency (%)")
+
+    for axis in SWEEP_AXES:
+        if axis not in (x_axis, y_axis):
+            values = sorted(surface[axis].unique())
+            chosen = st.select_slider(f"{SWEEP_AXES[axis]} (fixed)", options=values, value=values[len(values) // 2])
+            surface = surface[surface[axis] == chosen]
+
+    heatmap = alt.Chart(surface).mark_rect().encode(
+        x=alt.X(f"{x_axis}:O", title=SWEEP_AXES[x_axis]),
+        y=alt.Y(f"{y_axis}:O", title=SWEEP_AXES[y_axis], sort="descending"),
+        color=alt.Color(f"{metric}:Q", title="Revenue ($)" if metric == "revenue" else "Efficiency (%)"),
+        tooltip=list(SWEEP_AXES) + [
+            alt.Tooltip("revenue:Q", format="$.2f"),
+            alt.Tooltip("efficiency_pct:Q", format=".1f"),
+            alt.Tooltip("even_split:N", title="Even split (base units do not fit)"),
+        ],
+    )
+    st.altair_chart(heatmap, use_container_width=True)
+
+    # ---------------------------------------
+    # 🎲 Revenue Simulation
+    # ---------------------------------------
+
+    st.header("🎲 Revenue Simulation")
+    st.caption("Simulated clinic days for the patient mix above, with random visit lengths and no-shows.")
+
+    models = {}
+    with st.expander("Visit length and no-show assumptions"):
+        distribution = st.selectbox("Visit length distribution", DISTRIBUTIONS)
+        for visit_type, default in DEFAULT_VISIT_MODELS.items():
+            mean_col, sd_col, no_show_col = st.columns(3)
+            mean = mean_col.number_input(f"{visit_type} mean (min)", min_value=1, value=int(default.mean))
+            sd = sd_col.number_input(f"{visit_type} SD (min)", min_value=0, value=int(default.sd))
+            no_show = no_show_col.number_input(f"{visit_type} no-show (%)", min_value=0.0, max_value=100.0,
+                                               value=default.no_show * 100, step=1.0)
+            models[visit_type] = VisitModel(distribution, mean, sd, no_show / 100, default.minimum)
+    days = st.select_slider("Simulated clinic days", options=[1_000, 10_000, 50_000, 100_000, 500_000], value=10_000)
+
+    if st.button("Run Simulation"):
+        try:
+            simulated, result = simulate_revenue(
+                days, clinic_duration_hours, new_consults, repeat_consults, follow_ups, tuple(models.items()),
+                bulk_virtual, apply_rrnp, time_of_day_code, 0
+            )
+        except ValueError as exc:
+            st.error(str(exc))
+        else:
+            percentiles = result["revenue_percentiles"]
+            p10_col, p50_col, p90_col = st.columns(3)
+            p10_col.metric("P10 revenue", f"${percentiles[10]:,.2f}")
+            p50_col.metric("Median revenue", f"${percentiles[50]:,.2f}")
+            p90_col.metric("P90 revenue", f"${percentiles[90]:,.2f}")
+            st.markdown(f"- 💵 Mean revenue: **${result['mean_revenue']:,.2f}** "
+                        f"({result['mean_seen']:.1f} of {total_patients} patients seen)")
+            st.markdown(f"- ⏰ Patient time runs past {clinic_duration_hours} h on "
+                        f"**{result['overrun_probability']:.1%}** of days")
+
+            st.subheader("🎯 Complexity Threshold Hit Rates")
+            st.dataframe(result["thresholds"].style.format({"hit_rate": "{:.1%}"}), hide_index=True)
+
+            st.altair_chart(alt.Chart(simulated).mark_bar().encode(
+                x=alt.X("revenue:Q", bin=alt.Bin(maxbins=40), title="Daily revenue ($)"),
+                y=alt.Y("count():Q", title="Days"),
+            ), use_container_width=True)
+
+# ---------------------------------------
+# 🗓️ Weekly Scheduler
+# ---------------------------------------
+
+DEFAULT_SESSIONS = pd.DataFrame({
+    "session_id": ["Mon", "Tue", "Wed", "Wed PM", "Thu", "Fri", "Sat"],
+    "hours": [8.0, 8.0, 8.0, 3.0, 8.0, 8.0, 4.0],
+    "time_of_day": [None, None, None, "EV", None, None, "WK"],
+    "virtual": [False, False, False, True, False, False, False],
+})
+
+@st.fragment
+def weekly_scheduler():
+    st.header("🗓️ Weekly Scheduler")
+    st.caption("Places a patient backlog into the week's sessions for maximum revenue. "
+               "Repeat consults earn the SURC amount of an after-hours session.")
+
+    sessions = st.data_editor(DEFAULT_SESSIONS, num_rows="dynamic", hide_index=True, column_config={
+        "hours": st.column_config.NumberColumn("Hours", min_value=0.25, max_value=16.0, step=0.25),
+        "time_of_day": st.column_config.SelectboxColumn("Time of day", options=["EV", "WK", "NTAM", "NTPM"]),
+        "virtual": st.column_config.CheckboxColumn("Virtual"),
+    })
+
+    backlog_file = st.file_uploader("Backlog CSV (patient_id, visit_type), longest-waiting first", type="csv")
+    if backlog_file is not None:
+        backlog = pd.read_csv(backlog_file)
+    else:
+        new_col, repeat_col, follow_col = st.columns(3)
+        counts = {
+            "New Consult": new_col.number_input("New consults waiting", min_value=0, value=40),
+            "Repeat Consult": repeat_col.number_input("Repeat consults waiting", min_value=0, value=60),
+            "Follow-up": follow_col.number_input("Follow-ups waiting", min_value=0, value=80),
+        }
+        visit_types = [visit_type for visit_type, count in counts.items() for _ in range(count)]
+        backlog = pd.DataFrame({"patient_id": range(1, len(visit_types) + 1), "visit_type": visit_types})
+    apply_rrnp = st.checkbox("Apply RRNP Uplift (+19.98%)", value=False, key="schedule_rrnp")
+
+    if st.button("Build Schedule"):
+        try:
+            schedule, summary, unscheduled = weekly_schedule(sessions.dropna(subset=["hours"]), backlog, apply_rrnp)
+        except (KeyError, ValueError) as exc:
+            st.error(str(exc))
+            return
+
+        st.success(f"📊 Scheduled Revenue: ${summary['revenue'].sum():,.2f} "
+                   f"({len(schedule)} patients, {len(unscheduled)} left waiting)")
+        st.dataframe(summary[["session_id", "time_of_day", "virtual", "patients", "billed_units", "unbilled_units",
+                              "revenue"]].style.format({"revenue": "${:,.2f}"}), hide_index=True)
+        if not schedule.empty:
+            st.subheader("📋 Scheduled Visits")
+            st.dataframe(schedule[["session_id", "patient_id"]].join(format_breakdown(schedule)), hide_index=True)
+
+# ---------------------------------------
+# 🩸 Dialysis (13.99OA) Revenue Forecast
+# ---------------------------------------
+
+@st.fragment
+def dialysis_forecaster():
+    st.header("🩸 Dialysis Revenue Forecast (13.99OA)")
+    st.caption("Census CSV with patient_id, date, event (admit, transfer, modality_change, "
+               "transfer_out, discharge, death), physician_id and modality (HD/PD).")
+
+    census_file = st.file_uploader("Dialysis census", type="csv")
+    if census_file is None:
+        return
+
+    start = st.date_input("Forecast start")
+    years = st.slider("Forecast length (years)", 1, 5, 2)
+    apply_rrnp = st.checkbox("Apply RRNP Uplift (+19.98%)", value=False, key="dialysis_rrnp")
+
+    try:
+        weekly = dialysis_revenue(pd.read_csv(census_file), start, years * 52, apply_rrnp)
+    except (KeyError, ValueError) as exc:
+        st.error(f"Could not read census: {exc}")
+        return
+
+    st.success(f"📊 Forecast 13.99OA Revenue: ${weekly['revenue'].sum():,.2f} "
+               f"over {years * 52} weeks ({int(weekly['claims'].sum())} claims)")
+
+    chart = alt.Chart(weekly).mark_area().encode(
+        x=alt.X("week_start:T", title="Week"),
+        y=alt.Y("revenue:Q", title="Revenue ($)", stack=True),
+        color=alt.Color("physician_id:N", title="Physician"),
+        tooltip=["week_start:T", "physician_id:N", "hd_patients:Q", "pd_patients:Q",
+                 alt.Tooltip("revenue:Q", format="$.2f")],
+    )
+    st.altair_chart(chart, use_container_width=True)
+
+    st.subheader("📅 Annual Revenue per Physician")
+    annual = annual_revenue(weekly)
+    st.dataframe(annual[["year", "physician_id", "claims", "revenue"]].style.format({"revenue": "${:,.2f}"}))
+
+# ---------------------------------------
+# 📚 Claims Reports
+# ---------------------------------------
+
+@st.fragment
+def claims_reports():
+    st.header("📚 Claims Reports")
+
+    mine_only = st.checkbox("Only my claims", value=True)
+    physician_id = username if mine_only else None
+    store = claims_store()
+
+    revenue = store.revenue_by_code_month(physician_id)
+    if revenue.empty:
+        st.caption("No saved clinics yet.")
+        return
+
+    st.subheader("💵 Revenue by Code and Month")
+    st.altair_chart(alt.Chart(revenue).mark_bar().encode(
+        x=alt.X("month:O", title="Month"),
+        y=alt.Y("revenue:Q", title="Revenue ($)"),
+        color=alt.Color("hsc_code:N", title="HSC Code"),
+        tooltip=["month", "hsc_code", "claims", alt.Tooltip("revenue:Q", format="$.2f")],
+    ), use_container_width=True)
+
+    st.subheader("⚠️ Unbilled Units by Month")
+    trend = store.unbilled_trend(physician_id)
+    st.dataframe(trend.style.format({"efficiency_pct": "{:.1f}%"}))
+
+    st.subheader("🔺 RRNP Uplift")
+    uplift = store.rrnp_uplift(physician_id)
+    st.markdown(f"Total uplift: **${uplift['uplift'].sum():,.2f}**")
+    st.dataframe(uplift[["month", "physician_id", "uplifted_claims", "uplift"]].style.format({"uplift": "${:,.2f}"}))
+
+individual_calculator()
+clinic_billing_optimizer()
+weekly_scheduler()
+dialysis_forecaster()
+claims_reports()
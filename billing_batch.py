@@ -0,0 +1,173 @@
+"""
+Vectorized batch pricing for NEPH encounters.
+
+Prices whole arrays of encounters in one pass by gathering from the
+compiled fee schedule, giving exactly the same numbers as calling
+`optimal_billing_strategy` once per encounter.
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from billing_metrics import instrument
+from fee_schedule import FEE_SCHEDULE, FeeSchedule
+
+
+class BatchTables(NamedTuple):
+    """
+    One fee schedule laid out for vectorized pricing. Per code: minutes at
+    which the complexity modifier kicks in (and the add-on clock starts), the
+    modifier itself, the add-on unit length and unit cap. The extra last row
+    of each stands for codes the strategy does not price.
+    """
+    codes: pd.Index                 # strategy codes, in fee_table order
+    surcharges: pd.Index            # SURC codes; fee_table's surc axis is 1 + position, 0 for none
+    thresholds: np.ndarray
+    complexity_names: np.ndarray
+    unit_minutes: np.ndarray
+    unit_caps: np.ndarray
+    fee_table: np.ndarray           # (code, complexity, units, virtual, surc) -> total fee
+
+
+def compile_batch_tables(schedule: FeeSchedule) -> BatchTables:
+    """
+    Lay a compiled fee schedule out as a dense array indexed by
+    (code, complexity, units, virtual, surc). The last code row stays at $0
+    for codes the strategy does not price.
+    """
+    services = [schedule.codes[code] for code in schedule.strategy_codes]
+    max_units = [schedule.addons[s.addon].max_units if s.addon else 0 for s in services]
+    surc_codes = (None,) + tuple(schedule.surcharges)
+
+    table = np.zeros((len(services) + 1, 2, max(max_units, default=0) + 1, 2, len(surc_codes)))
+    for c, service in enumerate(services):
+        for units in range(max_units[c] + 1):
+            for virtual in (False, True):
+                for s, surc in enumerate(surc_codes):
+                    table[c, 1, units, int(virtual), s] = schedule.lookup(
+                        service.code, service.strategy_complexity, virtual, surc, units
+                    )
+                    table[c, 0, 0, int(virtual), s] = schedule.lookup(service.code, None, virtual, surc)
+    table.setflags(write=False)
+
+    return BatchTables(
+        codes=pd.Index(schedule.strategy_codes),
+        surcharges=pd.Index(surc_codes[1:]),
+        thresholds=np.array([s.strategy_minutes for s in services] + [0], dtype=np.int64),
+        complexity_names=np.array([s.strategy_complexity for s in services] + [None], dtype=object),
+        unit_minutes=np.array(
+            [schedule.addons[s.addon].unit_minutes if s.addon else 1 for s in services] + [1], dtype=np.int64
+        ),
+        unit_caps=np.array(max_units + [0], dtype=np.int64),
+        fee_table=table,
+    )
+
+
+_compiled = {}    # id(schedule) -> (schedule, BatchTables)
+
+
+def batch_tables(schedule: FeeSchedule = None) -> BatchTables:
+    """Batch tables for a schedule (the current one by default), compiled once per schedule."""
+    schedule = schedule or FEE_SCHEDULE
+    entry = _compiled.get(id(schedule))
+    if entry is None or entry[0] is not schedule:
+        entry = _compiled[id(schedule)] = (schedule, compile_batch_tables(schedule))
+    return entry[1]
+
+
+# Index order of the current schedule's lookup table axes
+HSC_CODES = FEE_SCHEDULE.strategy_codes
+SURC_CODES = (None,) + tuple(FEE_SCHEDULE.surcharges)
+FEE_TABLE = batch_tables(FEE_SCHEDULE).fee_table
+MAX_ADDON_UNITS = FEE_TABLE.shape[2] - 1
+
+
+@instrument("optimal_billing_strategy_batch")
+def optimal_billing_strategy_batch(hsc_codes, durations, virtual=False, time_of_day=None,
+                                   schedule: FeeSchedule = None) -> dict:
+    """
+    Vectorized `optimal_billing_strategy` over many encounters.
+
+    Parameters:
+        hsc_codes (array-like of str): HSC code per encounter.
+        durations (array-like of int): Minutes spent per encounter.
+        virtual (bool or array-like of bool): Virtual flag, scalar or per encounter.
+        time_of_day (str or array-like of str): SURC code (EV/WK/NTAM/NTPM) or None,
+            scalar or per encounter. Only affects 03.07B.
+        schedule (FeeSchedule): Schedule to price with, defaults to the current one.
+
+    Returns:
+        dict of arrays with keys total_fee (float), complexity (str or None)
+        and addon_units (int, number of 03.08I units).
+
+    Raises:
+        ValueError: if any encounter would need more than 6 units of 03.08I,
+            matching `prolonged_consult_addon_03_08I`.
+    """
+    tables = batch_tables(schedule)
+    codes = np.asarray(hsc_codes, dtype=object).ravel()
+    n = codes.shape[0]
+
+    unknown = len(tables.codes)
+    code_idx = tables.codes.get_indexer(codes)
+    code_idx[code_idx < 0] = unknown
+
+    minutes = np.broadcast_to(np.asarray(durations), (n,))
+    virtual_idx = np.broadcast_to(np.asarray(virtual, dtype=bool), (n,)).astype(np.intp)
+
+    if time_of_day is None or isinstance(time_of_day, str):
+        surc_idx = np.full(n, tables.surcharges.get_indexer([time_of_day])[0] + 1, dtype=np.intp)
+    else:
+        surc_idx = tables.surcharges.get_indexer(np.asarray(time_of_day, dtype=object).ravel()) + 1
+
+    known = code_idx != unknown
+    threshold = tables.thresholds[code_idx]
+    has_complexity = known & (minutes >= threshold)
+    addon_units = np.where(
+        has_complexity, np.floor_divide(np.maximum(minutes - threshold, 0), tables.unit_minutes[code_idx]), 0
+    ).astype(np.int64)
+
+    too_long = addon_units > tables.unit_caps[code_idx]
+    if too_long.any():
+        rows = np.flatnonzero(too_long)
+        raise ValueError(f"Add-on units exceed the fee schedule cap (rows {rows[:10].tolist()})")
+
+    total_fee = tables.fee_table[code_idx, has_complexity.astype(np.intp), addon_units, virtual_idx, surc_idx]
+    complexity = np.where(has_complexity, tables.complexity_names[code_idx], None)
+
+    return {
+        "total_fee": total_fee,
+        "complexity": complexity,
+        "addon_units": addon_units,
+    }
+
+
+def price_encounters(encounters: pd.DataFrame) -> pd.DataFrame:
+    """
+    Price a DataFrame of encounters in one vectorized pass.
+
+    Parameters:
+        encounters (DataFrame): Needs columns hsc_code and duration_minutes;
+            virtual and time_of_day are optional.
+
+    Returns:
+        DataFrame: copy of the input with total_fee, complexity and
+        addon_units columns added.
+    """
+    virtual = encounters["virtual"].to_numpy(dtype=bool) if "virtual" in encounters else False
+    time_of_day = (
+        encounters["time_of_day"].astype(object).where(encounters["time_of_day"].notna(), None).to_numpy()
+        if "time_of_day" in encounters else None
+    )
+    result = optimal_billing_strategy_batch(
+        encounters["hsc_code"].to_numpy(dtype=object),
+        encounters["duration_minutes"].to_numpy(),
+        virtual=virtual,
+        time_of_day=time_of_day,
+    )
+    priced = encounters.copy()
+    for column, values in result.items():
+        priced[column] = values
+    return priced
@@ -0,0 +1,403 @@
+"""
+Reproducible benchmarks and fee-equivalence checks for the billing engine.
+
+Every run first checks the fast paths against benchmark_golden.json, a
+snapshot of today's fees in cents: the scalar and batch pricing of every
+strategy code over a grid of durations, virtual flags and SURC codes, the
+03.08I add-on, and even-split clinic totals. The columnar and claim-record
+redistributions are also checked against the row-by-row
+`redistribute_unbilled_units`, and a synthetic remittance is reconciled to
+check that every line gets exactly one status. Then each engine path is timed
+on seeded synthetic data at several scales, and the results are written as
+JSON so runs on different commits can be compared.
+
+Usage:
+    python billing_benchmark.py --output bench.json
+    python billing_benchmark.py --quick --compare bench.json
+    python billing_benchmark.py --write-golden    # only after an intended fee change
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from billing_batch import HSC_CODES, SURC_CODES, optimal_billing_strategy_batch, price_encounters
+from billing_breakdown import ADDON_CODE, BASE_UNITS, VISIT_TYPES, plan_clinic, redistribute_units, to_cents
+from billing_functions import (_addon_unit_count, optimal_billing_strategy, prolonged_consult_addon_03_08I,
+                               redistribute_unbilled_units)
+from claim_record import records_from_rows, redistribute_records
+from clinic_optimizer import optimize_clinic
+from fee_schedule import FEE_SCHEDULE
+from billing_rules import CONFLICT_RULES
+from reconciliation import STATUSES, billed_lines, reconcile
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_golden.json")
+
+GRID_STEP = 5
+GOLDEN_CLINICS = 200
+
+RECONCILE_CLAIMS = 2_000
+CONFLICT_ENCOUNTERS = 10_000
+
+REDISTRIBUTE_ROWS = (10, 100, 1_000, 10_000, 100_000)
+BATCH_ROWS = (1_000, 100_000, 1_000_000)
+CLINIC_PATIENTS = (10, 20, 40)
+
+# --quick keeps every benchmark but at small scales
+QUICK_REDISTRIBUTE_ROWS = (10, 100, 1_000)
+QUICK_BATCH_ROWS = (1_000, 10_000)
+QUICK_CLINIC_PATIENTS = (10, 20)
+
+
+# ---- synthetic data ----
+
+def max_minutes(code: str) -> int:
+    """Longest visit the code can bill before its add-on cap is exceeded."""
+    service = FEE_SCHEDULE.codes[code]
+    if not service.addon:
+        return service.strategy_minutes + 60
+    addon = FEE_SCHEDULE.addons[service.addon]
+    return service.strategy_minutes + (addon.max_units + 1) * addon.unit_minutes - 1
+
+
+def synthetic_encounters(n: int, seed: int = 0) -> pd.DataFrame:
+    """Encounters across every strategy code and its billable durations, ~30% virtual, some SURC."""
+    rng = np.random.default_rng(seed)
+    codes = rng.choice(HSC_CODES, n)
+    longest = pd.Series(codes).map({code: max_minutes(code) for code in HSC_CODES}).to_numpy()
+    return pd.DataFrame({
+        "hsc_code": codes,
+        "duration_minutes": (rng.random(n) * (longest + 1)).astype(np.int64),
+        "virtual": rng.random(n) < 0.3,
+        "time_of_day": rng.choice(np.array(SURC_CODES, dtype=object), n, p=[0.6, 0.1, 0.1, 0.1, 0.1]),
+    })
+
+
+def synthetic_clinics(n: int, seed: int = 0) -> list:
+    """
+    (clinic_hours, new, repeat, follow_ups, virtual, apply_rrnp, time_of_day)
+    clinics that both the even split and the optimizer can bill: base units
+    fit, and the average visit stays within every code's add-on cap.
+    """
+    rng = np.random.default_rng(seed)
+    clinics = []
+    while len(clinics) < n:
+        hours = int(rng.integers(2, 13))
+        new, repeat, follow = (int(c) for c in rng.integers(0, 12, 3))
+        virtual = bool(rng.random() < 0.3)
+        counts = {"03.08CV" if virtual else "03.08A": new, "03.07B": repeat, "03.03FV" if virtual else "03.03F": follow}
+        base = new * BASE_UNITS["New Consult"] + repeat * BASE_UNITS["Repeat Consult"] + follow * BASE_UNITS["Follow-up"]
+        if new + repeat + follow == 0 or base > hours * 4:
+            continue
+        if hours * 60 // (new + repeat + follow) > min(max_minutes(code) for code, count in counts.items() if count):
+            continue
+        clinics.append((hours, new, repeat, follow, virtual, bool(rng.random() < 0.3),
+                        rng.choice(np.array(SURC_CODES, dtype=object))))
+    return clinics
+
+
+def synthetic_breakdown_rows(n: int, seed: int = 0) -> tuple:
+    """
+    App-style breakdown rows (list of dicts) for `redistribute_unbilled_units`,
+    and enough available units that every eligible row can take more add-ons.
+    """
+    rng = np.random.default_rng(seed)
+    visit_types = rng.choice(VISIT_TYPES, n)
+    minutes = rng.integers(15, 76, n)
+    rows = []
+    for visit, duration in zip(visit_types, minutes):
+        code = {"New Consult": "03.08A", "Repeat Consult": "03.07B", "Follow-up": "03.03F"}[visit]
+        priced = optimal_billing_strategy(code, int(duration))
+        rows.append({
+            "Visit Type": str(visit),
+            "HSC Code": code,
+            "Modifiers": ", ".join(priced["modifiers_applied"]) or "-",
+            "Add-ons": ", ".join(priced["add_on_codes"]) or "-",
+            "Fee ($)": priced["total_fee"],
+        })
+    used = sum(BASE_UNITS[row["Visit Type"]] + _addon_unit_count(row["Add-ons"]) for row in rows)
+    return rows, used + int(rng.integers(0, 2 * n + 1))
+
+
+def synthetic_remittance(n: int, seed: int = 0) -> tuple:
+    """
+    Billed claims and a remittance for them with every status: most lines
+    paid as billed, some paid short or over, refused or not remitted yet,
+    and a few payments for claims that were never billed.
+    """
+    rng = np.random.default_rng(seed)
+    billed = synthetic_encounters(n, seed).assign(
+        physician_id=rng.choice(["P1", "P2", "P3"], n),
+        patient_id=rng.integers(1, n // 4 + 2, n).astype(str),
+        service_date=pd.Timestamp("2025-01-06") + pd.to_timedelta(rng.integers(0, 90, n), unit="D"),
+    ).drop_duplicates(["physician_id", "patient_id", "service_date", "hsc_code"])
+    lines = billed_lines(billed)
+    outcome = rng.choice(5, len(lines), p=[0.7, 0.1, 0.05, 0.1, 0.05])
+    paid = np.select([outcome == 1, outcome == 2, outcome == 3], [lines["expected_cents"] - 500,
+                                                                   lines["expected_cents"] + 500, 0],
+                     lines["expected_cents"])
+    remittance = lines.assign(paid_cents=paid)[outcome != 4]
+    unexpected = remittance.head(max(1, n // 100)).assign(patient_id="unbilled")
+    return billed, pd.concat([remittance, unexpected], ignore_index=True)
+
+
+def encounter_claim_lines(priced: pd.DataFrame, time_of_day=None) -> pd.DataFrame:
+    """
+    validate_claims input for priced encounters (price_encounters output or a
+    breakdown, whose SURC code is time_of_day): one visit line with its
+    complexity and SURC modifiers per encounter, plus a 03.08I line when it
+    bills add-on units.
+    """
+    encounter_id = np.arange(len(priced))
+    codes = priced["hsc_code"].astype(str)
+    surcharge = codes.isin([code for code, service in FEE_SCHEDULE.codes.items() if service.surcharge])
+    surc = priced["time_of_day"] if "time_of_day" in priced else pd.Series(time_of_day, index=priced.index)
+    modifiers = (priced["complexity"].fillna("").astype(str) + " "
+                 + surc.where(surcharge & surc.notna(), "").astype(str))
+    has_addon = priced["addon_units"].to_numpy() > 0
+    return pd.concat([
+        pd.DataFrame({"encounter_id": encounter_id, "hsc_code": codes.to_numpy(), "modifiers": modifiers.to_numpy()}),
+        pd.DataFrame({"encounter_id": encounter_id[has_addon], "hsc_code": ADDON_CODE, "modifiers": ""}),
+    ], ignore_index=True)
+
+
+def _rows_to_breakdown(rows: list) -> pd.DataFrame:
+    visit_types = [row["Visit Type"] for row in rows]
+    return pd.DataFrame({
+        "visit_type": pd.Categorical(visit_types, categories=VISIT_TYPES),
+        "hsc_code": [row["HSC Code"] for row in rows],
+        "complexity": [None if row["Modifiers"] == "-" else row["Modifiers"] for row in rows],
+        "minutes": np.zeros(len(rows), dtype=np.int64),
+        "base_units": np.array([BASE_UNITS[v] for v in visit_types], dtype=np.int64),
+        "addon_units": np.array([_addon_unit_count(row["Add-ons"]) for row in rows], dtype=np.int64),
+        "fee_cents": to_cents([row["Fee ($)"] for row in rows]),
+    })
+
+
+# ---- fee snapshot and equivalence ----
+
+def _strategy_grid():
+    for code in HSC_CODES:
+        for virtual in (False, True):
+            for tod in SURC_CODES:
+                for minutes in range(0, max_minutes(code) + 1, GRID_STEP):
+                    yield code, minutes, virtual, tod
+
+
+def fee_snapshot() -> dict:
+    """Today's fees in cents, from the scalar (reference) paths."""
+    strategy = [int(to_cents(optimal_billing_strategy(code, minutes, virtual, tod)["total_fee"]))
+                for code, minutes, virtual, tod in _strategy_grid()]
+    addon = FEE_SCHEDULE.addons["03.08I"]
+    addon_fees = [int(to_cents(prolonged_consult_addon_03_08I(calls, virtual)))
+                  for virtual in (False, True) for calls in range(1, addon.max_units + 1)]
+    clinics = [plan_clinic(*clinic)[1]["total_cents"] for clinic in synthetic_clinics(GOLDEN_CLINICS)]
+    return {
+        "grid": {"codes": list(HSC_CODES), "surc": list(SURC_CODES), "step_minutes": GRID_STEP},
+        "strategy_cents": strategy,
+        "addon_cents": addon_fees,
+        "clinic_total_cents": clinics,
+    }
+
+
+def _check(name: str, expected, actual) -> dict:
+    expected, actual = np.asarray(expected), np.asarray(actual)
+    mismatches = int((expected != actual).sum()) if expected.shape == actual.shape else len(expected)
+    return {"check": name, "cases": len(expected), "mismatches": mismatches, "ok": mismatches == 0}
+
+
+def check_equivalence(golden: dict, redistribute_sizes=REDISTRIBUTE_ROWS) -> list:
+    """Compare every fast path with the golden fees and the row-by-row reference."""
+    current = fee_snapshot()
+    cases = list(_strategy_grid())
+    codes, minutes, virtual, tod = (list(column) for column in zip(*cases))
+    batch = to_cents(optimal_billing_strategy_batch(codes, minutes, virtual, tod)["total_fee"])
+
+    results = [
+        _check("strategy_scalar_vs_golden", golden["strategy_cents"], current["strategy_cents"]),
+        _check("strategy_batch_vs_golden", golden["strategy_cents"], batch),
+        _check("addon_03_08I_vs_golden", golden["addon_cents"], current["addon_cents"]),
+        _check("plan_clinic_vs_golden", golden["clinic_total_cents"], current["clinic_total_cents"]),
+    ]
+
+    for n in redistribute_sizes:
+        rows, available = synthetic_breakdown_rows(n, seed=n)
+        columnar = redistribute_units(_rows_to_breakdown(rows), available)
+        records = redistribute_records(records_from_rows(rows), available)
+        # Last: the row version edits the rows in place
+        reference = redistribute_unbilled_units(rows, available)
+        results.append(_check(f"redistribute_columnar_vs_rows[{n}]",
+                              to_cents([row["Fee ($)"] for row in reference]), columnar["fee_cents"]))
+        results.append(_check(f"redistribute_records_vs_rows[{n}]",
+                              to_cents([row["Fee ($)"] for row in reference]), records["fee_cents"]))
+
+    # Every reconciled line has exactly one status
+    billed, remittance = synthetic_remittance(RECONCILE_CLAIMS)
+    _, report = reconcile(billed, remittance)
+    miscounted = int((report[list(STATUSES)].sum(axis=1) != report["lines"]).sum())
+    results.append({"check": "reconcile_status_counts_vs_lines", "cases": len(report),
+                    "mismatches": miscounted, "ok": miscounted == 0})
+
+    # The optimizer must never bill less than the even split it replaces
+    clinics = synthetic_clinics(GOLDEN_CLINICS)
+    optimized = [optimize_clinic(*clinic) for clinic in clinics]
+    below = int((np.array([summary["total_cents"] for _, summary in optimized])
+                 < np.array(golden["clinic_total_cents"])).sum())
+    results.append({"check": "optimize_clinic_not_below_even_split", "cases": len(clinics),
+                    "mismatches": below, "ok": below == 0})
+
+    # What the engine prices must pass the conflict rules it is validated against
+    for name, claims in (
+        ("batch", encounter_claim_lines(price_encounters(synthetic_encounters(CONFLICT_ENCOUNTERS)))),
+        ("clinics", pd.concat([encounter_claim_lines(breakdown, clinic[-1]).assign(clinic=i)
+                               for i, (clinic, (breakdown, _)) in enumerate(zip(clinics, optimized))])
+         .assign(encounter_id=lambda claims: claims["clinic"] * 1000 + claims["encounter_id"])),
+    ):
+        violations, _ = CONFLICT_RULES.validate_claims(claims)
+        encounters = claims["encounter_id"].nunique()
+        results.append({"check": f"conflict_rules_pass_priced_{name}", "cases": encounters,
+                        "mismatches": violations["encounter_id"].nunique(), "ok": violations.empty})
+    return results
+
+
+# ---- timing ----
+
+def _timeit(fn, repeat: int = 5) -> dict:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {"best_s": min(times), "median_s": statistics.median(times), "repeat": repeat}
+
+
+def _bench(results: list, name: str, fn, items: int, repeat: int = 5, **params):
+    timing = _timeit(fn, repeat)
+    timing["per_item_us"] = timing["best_s"] / items * 1e6
+    results.append({"name": name, "params": params, "items": items, **timing})
+    print(f"{name:<34} {json.dumps(params):<42} {timing['best_s'] * 1e3:10.3f} ms  "
+          f"{timing['per_item_us']:10.3f} us/item")
+
+
+def run_benchmarks(quick: bool = False) -> list:
+    results = []
+    redistribute_rows = QUICK_REDISTRIBUTE_ROWS if quick else REDISTRIBUTE_ROWS
+    batch_rows = QUICK_BATCH_ROWS if quick else BATCH_ROWS
+    clinic_patients = QUICK_CLINIC_PATIENTS if quick else CLINIC_PATIENTS
+
+    # optimal_billing_strategy, one benchmark per code path
+    for code in HSC_CODES:
+        durations = range(0, max_minutes(code) + 1)
+        _bench(results, "optimal_billing_strategy",
+               lambda: [optimal_billing_strategy(code, m, False, "EV") for m in durations],
+               len(durations), code=code)
+
+    addon = FEE_SCHEDULE.addons["03.08I"]
+    calls = [(units, virtual) for virtual in (False, True) for units in range(1, addon.max_units + 1)] * 100
+    _bench(results, "prolonged_consult_addon_03_08I",
+           lambda: [prolonged_consult_addon_03_08I(units, virtual) for units, virtual in calls], len(calls))
+
+    for n in redistribute_rows:
+        rows, available = synthetic_breakdown_rows(n, seed=n)
+        breakdown = _rows_to_breakdown(rows)
+        repeat = 3 if n >= 10_000 else 5
+        # The row version edits its rows in place, so each run gets fresh copies
+        _bench(results, "redistribute_unbilled_units",
+               lambda: redistribute_unbilled_units([dict(row) for row in rows], available), n, repeat, rows=n)
+        _bench(results, "redistribute_units (columnar)",
+               lambda: redistribute_units(breakdown, available), n, repeat, rows=n)
+        records = records_from_rows(rows)
+        _bench(results, "redistribute_records",
+               lambda: redistribute_records(records, available), n, repeat, rows=n)
+
+    for n in batch_rows:
+        encounters = synthetic_encounters(n, seed=n)
+        _bench(results, "price_encounters", lambda: price_encounters(encounters), n, 3, rows=n)
+
+    for patients in clinic_patients:
+        new, repeat_consults = patients // 4, patients // 4
+        follow = patients - new - repeat_consults
+        hours = (new * 2 + repeat_consults + follow) // 4 + 2
+        clinic = (hours, new, repeat_consults, follow)
+        _bench(results, "plan_clinic (even split)", lambda: plan_clinic(*clinic, apply_rrnp=True), patients,
+               patients=patients, hours=hours)
+        # optimize_clinic caches solved clinics, so time a fresh solve with varying SURC each run
+        surcs = iter(SURC_CODES * 10)
+        _bench(results, "optimize_clinic (knapsack)",
+               lambda: optimize_clinic(*clinic, apply_rrnp=True, time_of_day=next(surcs)), patients,
+               patients=patients, hours=hours)
+
+    return results
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous: dict, current: dict):
+    """Print each benchmark's best time against a previous run."""
+    before = {(r["name"], json.dumps(r["params"], sort_keys=True)): r["best_s"] for r in previous["benchmarks"]}
+    print(f"\nCompared with {previous.get('commit') or 'previous run'}:")
+    for result in current["benchmarks"]:
+        old = before.get((result["name"], json.dumps(result["params"], sort_keys=True)))
+        if old:
+            print(f"{result['name']:<34} {json.dumps(result['params']):<42} {result['best_s'] / old:6.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="JSON file for the results")
+    parser.add_argument("--quick", action="store_true", help="Small scales only")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    parser.add_argument("--write-golden", action="store_true", help="Record today's fees as the golden snapshot")
+    args = parser.parse_args(argv)
+
+    if args.write_golden:
+        with open(GOLDEN_PATH, "w") as file:
+            json.dump(fee_snapshot(), file)
+        print(f"Wrote {GOLDEN_PATH}")
+        return 0
+
+    with open(GOLDEN_PATH) as file:
+        golden = json.load(file)
+    equivalence = check_equivalence(golden, QUICK_REDISTRIBUTE_ROWS if args.quick else REDISTRIBUTE_ROWS)
+    for check in equivalence:
+        print(f"{'ok  ' if check['ok'] else 'FAIL'} {check['check']:<44} {check['mismatches']}/{check['cases']} mismatched")
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "quick": args.quick,
+        "equivalence": equivalence,
+        "benchmarks": run_benchmarks(args.quick),
+    }
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), report)
+
+    return 0 if all(check["ok"] for check in equivalence) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
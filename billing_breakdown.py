@@ -0,0 +1,219 @@
+"""
+Columnar clinic billing breakdown.
+
+A breakdown is a pandas DataFrame with one row per patient and typed
+columns: visit_type (categorical), hsc_code, complexity, minutes,
+base_units, addon_units and fee_cents (integer cents). Redistribution and summaries
+are plain column operations; display strings are only built by
+`format_breakdown` at render time.
+"""
+
+import numpy as np
+import pandas as pd
+
+from billing_batch import optimal_billing_strategy_batch
+from billing_metrics import instrument
+from fee_schedule import FEE_SCHEDULE
+
+VISIT_TYPES = ("New Consult", "Repeat Consult", "Follow-up")
+
+# 15-minute units each visit type bills before any add-on
+BASE_UNITS = {"New Consult": 2, "Repeat Consult": 1, "Follow-up": 1}
+
+# Visit types that can take redistributed 03.08I units
+ADDON_ELIGIBLE = ("New Consult", "Repeat Consult")
+
+ADDON_CODE = "03.08I"
+
+_VISIT_DTYPE = pd.CategoricalDtype(VISIT_TYPES)
+
+
+def to_cents(fees) -> np.ndarray:
+    """Dollar amounts (already rounded to the cent) as int64 cents."""
+    return np.rint(np.asarray(fees, dtype=float) * 100).astype(np.int64)
+
+
+def rrnp_cents(fees) -> np.ndarray:
+    """RRNP-uplifted fees as int64 cents, rounded exactly like the scalar path."""
+    # Few distinct fees per clinic, so apply the scalar rounding rule per value
+    fees = np.asarray(fees, dtype=float)
+    unique, inverse = np.unique(fees, return_inverse=True)
+    uplifted = np.array([FEE_SCHEDULE.rrnp_fee(float(fee)) for fee in unique])
+    return to_cents(uplifted)[inverse]
+
+
+@instrument("build_breakdown")
+def build_breakdown(visit_types, hsc_codes, duration_minutes, virtual=False, time_of_day=None,
+                    apply_rrnp: bool = False) -> pd.DataFrame:
+    """
+    Price patients and lay the result out as a breakdown table.
+
+    Parameters:
+        visit_types (array-like of str): One of VISIT_TYPES per patient.
+        hsc_codes (array-like of str): HSC code per patient.
+        duration_minutes (int or array-like of int): Minutes per patient.
+        virtual (bool or array-like of bool): Virtual flag.
+        time_of_day (str or array-like of str): SURC code, only used by 03.07B.
+        apply_rrnp (bool): Apply the RRNP uplift to each fee.
+
+    Returns:
+        DataFrame: breakdown table.
+    """
+    visit_types = pd.Categorical(visit_types, dtype=_VISIT_DTYPE)
+    minutes = np.broadcast_to(np.asarray(duration_minutes, dtype=np.int64), (len(visit_types),))
+    priced = optimal_billing_strategy_batch(hsc_codes, duration_minutes, virtual=virtual, time_of_day=time_of_day)
+    fees = priced["total_fee"]
+
+    return pd.DataFrame({
+        "visit_type": visit_types,
+        "hsc_code": np.asarray(hsc_codes, dtype=object),
+        "complexity": priced["complexity"],
+        "minutes": minutes,
+        "base_units": pd.Series(visit_types).map(BASE_UNITS).to_numpy(dtype=np.int64),
+        "addon_units": priced["addon_units"],
+        "fee_cents": rrnp_cents(fees) if apply_rrnp else to_cents(fees),
+    })
+
+
+def spread_units(current_units, extra_units: int, cap: int) -> np.ndarray:
+    """
+    Vectorized `billing_functions.spread_units`: hand `extra_units` out
+    round-robin in row order to rows still under `cap`.
+
+    Parameters:
+        current_units (array-like of int): Units already on each row.
+        extra_units (int): Units to hand out.
+        cap (int): Maximum units per row.
+
+    Returns:
+        ndarray of int: Units on each row after the spread.
+    """
+    current = np.asarray(current_units, dtype=np.int64)
+    if extra_units <= 0 or current.size == 0:
+        return current.copy()
+
+    is_open = current < cap
+    open_rows = np.bincount(current[is_open], minlength=cap)
+    passes = np.arange(cap + 1)
+    # handed_out[p]: units given after p full passes (non-decreasing in p)
+    handed_out = (open_rows * np.minimum(passes[:, None], cap - np.arange(cap))).sum(axis=1)
+    full_passes = int(np.searchsorted(handed_out, extra_units, side="right")) - 1
+    leftover = extra_units - int(handed_out[full_passes])
+
+    final = np.where(is_open, np.minimum(current + full_passes, cap), current)
+    still_open = final < cap
+    return final + (still_open & (np.cumsum(still_open) <= leftover))
+
+
+@instrument("redistribute_units", code="03.08I")
+def redistribute_units(breakdown: pd.DataFrame, available_units: int) -> pd.DataFrame:
+    """
+    Columnar `redistribute_unbilled_units`: spread unbilled 15-minute units
+    as 03.08I add-ons across new and repeat consults.
+
+    Parameters:
+        breakdown (DataFrame): Breakdown table.
+        available_units (int): 15-minute units in the clinic.
+
+    Returns:
+        DataFrame: a new breakdown with addon_units and fee_cents updated.
+    """
+    addon = FEE_SCHEDULE.addons[ADDON_CODE]
+    unbilled = available_units - int(breakdown["base_units"].sum()) - int(breakdown["addon_units"].sum())
+
+    eligible = breakdown["visit_type"].isin(ADDON_ELIGIBLE).to_numpy()
+    current = breakdown["addon_units"].to_numpy()[eligible]
+    added = spread_units(current, unbilled, addon.max_units) - current
+
+    result = breakdown.copy()
+    result.loc[eligible, "addon_units"] = current + added
+    result.loc[eligible, "minutes"] = breakdown["minutes"].to_numpy()[eligible] + added * addon.unit_minutes
+    result.loc[eligible, "fee_cents"] = breakdown["fee_cents"].to_numpy()[eligible] + added * to_cents(addon.unit_fee)
+    return result
+
+
+def summarize_breakdown(breakdown: pd.DataFrame, available_units: int) -> dict:
+    """
+    Revenue and unit totals for a breakdown.
+
+    Returns:
+        dict with total_cents, cents_by_visit_type, base_units, addon_units,
+        billed_units, unbilled_units and efficiency_pct.
+    """
+    base_units = int(breakdown["base_units"].sum())
+    addon_units = int(breakdown["addon_units"].sum())
+    billed_units = base_units + addon_units
+    by_type = breakdown.groupby("visit_type", observed=False)["fee_cents"].sum()
+    return {
+        "total_cents": int(breakdown["fee_cents"].sum()),
+        "cents_by_visit_type": {visit: int(by_type.get(visit, 0)) for visit in VISIT_TYPES},
+        "base_units": base_units,
+        "addon_units": addon_units,
+        "billed_units": billed_units,
+        "unbilled_units": available_units - billed_units,
+        "efficiency_pct": billed_units / available_units * 100 if available_units else 0.0,
+    }
+
+
+def format_breakdown(breakdown: pd.DataFrame) -> pd.DataFrame:
+    """Display table with the app's column names and add-on strings."""
+    units = breakdown["addon_units"]
+    add_ons = np.where(
+        units > 0,
+        ADDON_CODE + " (" + units.astype(str) + np.where(units > 1, " units)", " unit)"),
+        "-",
+    )
+    return pd.DataFrame({
+        "Visit Type": breakdown["visit_type"].astype(str),
+        "HSC Code": breakdown["hsc_code"],
+        "Minutes": breakdown["minutes"],
+        "Modifiers": breakdown["complexity"].fillna("-"),
+        "Add-ons": add_ons,
+        "Fee ($)": breakdown["fee_cents"] / 100,
+    })
+
+
+@instrument("plan_clinic")
+def plan_clinic(clinic_hours: int, new_consults: int, repeat_consults: int, follow_ups: int,
+                virtual: bool = False, apply_rrnp: bool = False, time_of_day: str = None):
+    """
+    Even-split clinic plan: every patient gets the clinic's average time,
+    then unbilled units are redistributed as 03.08I add-ons.
+
+    Parameters:
+        clinic_hours (float): Clinic length in hours, counted in whole minutes.
+        new_consults, repeat_consults, follow_ups (int): Patient counts.
+        virtual (bool): All visits virtual.
+        apply_rrnp (bool): Apply the RRNP uplift.
+        time_of_day (str): SURC code for repeat consults.
+
+    Returns:
+        (DataFrame, dict): breakdown and its summary, which also carries
+        avg_time and available_units.
+    """
+    total_patients = new_consults + repeat_consults + follow_ups
+    if total_patients <= 0:
+        raise ValueError("Total patient count must be greater than 0.")
+
+    total_minutes = int(round(clinic_hours * 60))
+    avg_time = total_minutes // total_patients
+    available_units = total_minutes // 15
+
+    new_code = "03.08CV" if virtual else "03.08A"
+    follow_code = "03.03FV" if virtual else "03.03F"
+    visit_types = (
+        ["New Consult"] * new_consults +
+        ["Repeat Consult"] * repeat_consults +
+        ["Follow-up"] * follow_ups
+    )
+    codes = [new_code] * new_consults + ["03.07B"] * repeat_consults + [follow_code] * follow_ups
+    surc = [None] * new_consults + [time_of_day] * repeat_consults + [None] * follow_ups
+
+    breakdown = build_breakdown(visit_types, codes, avg_time, virtual=virtual, time_of_day=surc,
+                                apply_rrnp=apply_rrnp)
+    breakdown = redistribute_units(breakdown, available_units)
+
+    summary = summarize_breakdown(breakdown, available_units)
+    summary["avg_time"] = avg_time
+    summary["available_units"] = available_units
+    return breakdown, summary
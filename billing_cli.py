@@ -0,0 +1,113 @@
+"""
+Command-line pricing without Streamlit.
+
+Usage:
+    python billing_cli.py price 03.08A 45 [--virtual] [--time-of-day EV] [--json]
+    python billing_cli.py clinic 8 5 5 10 [--virtual] [--rrnp] [--time-of-day EV] [--even-split] [--json]
+    python billing_cli.py batch encounters.csv priced.csv [--chunksize 100000]
+    python billing_cli.py clinic 8 5 5 10 --export clinic.parquet
+
+Single encounters only need billing_functions and the compiled fee tables.
+NumPy and pandas are imported inside the clinic and batch commands, so
+`price` starts fast enough to be called per encounter from EMR export
+scripts and cron jobs. Exit status is 2 for input the fee schedule rejects.
+"""
+
+import argparse
+import json
+import sys
+
+from billing_functions import optimal_billing_strategy
+
+TIME_OF_DAY_CODES = ("EV", "WK", "NTAM", "NTPM")
+
+
+def price(args) -> dict:
+    result = optimal_billing_strategy(args.hsc_code, args.minutes, virtual=args.virtual, time_of_day=args.time_of_day)
+    if not args.json:
+        print(f"{result['base_code']} {args.minutes} min: ${result['total_fee']:.2f}")
+        for item in result["modifiers_applied"] + result["add_on_codes"]:
+            print(f"  {item}")
+    return result
+
+
+def clinic(args) -> dict:
+    from billing_breakdown import format_breakdown, plan_clinic
+    from clinic_optimizer import optimize_clinic
+
+    plan = plan_clinic if args.even_split else optimize_clinic
+    breakdown, summary = plan(args.hours, args.new, args.repeat, args.follow,
+                              virtual=args.virtual, apply_rrnp=args.rrnp, time_of_day=args.time_of_day)
+    table = format_breakdown(breakdown)
+    if args.export:
+        from claim_export import open_claim_writer
+
+        with open_claim_writer(args.export) as writer:
+            writer.write(breakdown.assign(time_of_day=args.time_of_day, virtual=args.virtual))
+    if not args.json:
+        print(table.to_string(index=False))
+        print(f"Total ${summary['total_cents'] / 100:.2f}, {summary['billed_units']}/{summary['available_units']} "
+              f"units billed ({summary['efficiency_pct']:.1f}%)")
+    return {"summary": summary, "breakdown": table.to_dict(orient="records")}
+
+
+def batch(args) -> dict:
+    from billing_pipeline import price_file
+
+    stats = price_file(args.input, args.output, args.chunksize)
+    if not args.json:
+        print(f"Priced {stats['rows']:,} rows in {stats['seconds']:.2f}s, total ${stats['total_fee']:,.2f}")
+    return stats
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Alberta NEPH billing from the command line.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(command):
+        command.add_argument("--virtual", action="store_true", help="Virtual visit(s)")
+        command.add_argument("--time-of-day", choices=TIME_OF_DAY_CODES, help="SURC modifier (03.07B only)")
+        command.add_argument("--json", action="store_true", help="Print the result as JSON")
+
+    command = commands.add_parser("price", help="Price one encounter")
+    command.add_argument("hsc_code")
+    command.add_argument("minutes", type=int, help="Minutes spent with the patient")
+    add_common(command)
+    command.set_defaults(handler=price)
+
+    command = commands.add_parser("clinic", help="Plan a whole clinic")
+    command.add_argument("hours", type=float, help="Clinic length in hours")
+    command.add_argument("new", type=int, help="New consults")
+    command.add_argument("repeat", type=int, help="Repeat consults")
+    command.add_argument("follow", type=int, help="Follow-ups")
+    command.add_argument("--rrnp", action="store_true", help="Apply the RRNP uplift")
+    command.add_argument("--even-split", action="store_true",
+                         help="Give every patient the average time instead of optimizing")
+    command.add_argument("--export", metavar="PATH",
+                         help="Also write the breakdown (.csv, .jsonl, .txt fixed-width, .parquet or .arrow)")
+    add_common(command)
+    command.set_defaults(handler=clinic)
+
+    command = commands.add_parser("batch", help="Price an encounter file (.csv or .jsonl)")
+    command.add_argument("input")
+    command.add_argument("output", help="Priced claims (.csv, .jsonl, .txt fixed-width, .parquet or .arrow)")
+    command.add_argument("--chunksize", type=int, default=100_000, help="Rows per chunk")
+    command.add_argument("--json", action="store_true", help="Print the run statistics as JSON")
+    command.set_defaults(handler=batch)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        result = args.handler(args)
+    except (KeyError, ValueError) as exc:
+        print(f"error: {exc}", file=sys.stderr)
+        return 2
+    if args.json:
+        print(json.dumps(result, default=str))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,8 @@
+from billing_metrics import instrument
+from fee_schedule import FEE_SCHEDULE
+
+
+@instrument("consult_03_08A", code="03.08A")
 def consult_03_08A(complexity: str = None) -> float:
     """
     Health Service Code: 03.08A
@@ -18,11 +23,9 @@ def consult_03_08A(complexity: str = None) -> float:
     Returns:
         float: Total billable amount.
     """
-    base_fee = 211.62
-    if complexity == "CMXC30":
-        return base_fee + 31.59
-    return base_fee
+    return FEE_SCHEDULE.visit_fee("03.08A", complexity)
 
+@instrument("consult_03_08CV", code="03.08CV")
 def consult_03_08CV(complexity: str = None) -> float:
     """
     Health Service Code: 03.08CV
@@ -45,11 +48,9 @@ def consult_03_08CV(complexity: str = None) -> float:
     Returns:
         float: Total billable amount.
     """
-    base_fee = 211.62
-    if complexity == "CMXC30":
-        return base_fee + 31.59
-    return base_fee
+    return FEE_SCHEDULE.visit_fee("03.08CV", complexity)
 
+@instrument("repeat_visit_03_03F", code="03.03F")
 def repeat_visit_03_03F(complexity: str = None, virtual: bool = False) -> float:
     """
     Health Service Code: 03.03F
@@ -69,18 +70,9 @@ def repeat_visit_03_03F(complexity: str = None, virtual: bool = False) -> float:
     Returns:
         float: Total billable amount
     """
-    base_fee = 87.88
-
-    if virtual:
-        base_fee *= 1.2  # TELES modifier: 120%
-
-    if complexity == "CMXV15":
-        base_fee += 15.78
-    elif complexity == "CMXV30":
-        base_fee += 31.59
-
-    return round(base_fee, 2)
+    return FEE_SCHEDULE.visit_fee("03.03F", complexity, virtual)
 
+@instrument("repeat_consultation_03_07B", code="03.07B")
 def repeat_consultation_03_07B(complexity: str = None, virtual: bool = False, time_of_day: str = None) -> float:
     """
     Health Service Code: 03.07B
@@ -104,23 +96,9 @@ def repeat_consultation_03_07B(complexity: str = None, virtual: bool = False, ti
     Returns:
         float: Total billable amount
     """
-    base_fee = 141.08
-
-    if virtual:
-        base_fee *= 1.2  # TELES
-
-    if complexity == "CMXV15":
-        base_fee += 15.78
-    elif complexity == "CMXV30":
-        base_fee += 31.59
-
-    if time_of_day == "EV" or time_of_day == "WK":
-        base_fee += 48.94
-    elif time_of_day == "NTAM" or time_of_day == "NTPM":
-        base_fee += 117.41
-
-    return round(base_fee, 2)
+    return FEE_SCHEDULE.visit_fee("03.07B", complexity, virtual, time_of_day)
 
+@instrument("followup_virtual_visit_03_03FV", code="03.03FV")
 def followup_virtual_visit_03_03FV(complexity: str = None, duration_minutes: int = 15) -> float:
     """
     HSC: 03.03FV – Follow-up Virtual Visit (Telephone or Secure Video)
@@ -133,15 +111,12 @@ def followup_virtual_visit_03_03FV(complexity: str = None, duration_minutes: int
         - TELE modifier is already built in (03.03FV is virtual)
     Returns total payable amount in dollars.
     """
-    base_fee = 82.00
-
-    if complexity == "CMXV15" and duration_minutes >= 15:
-        base_fee += 15.78
-    elif complexity == "CMXV30" and duration_minutes >= 30:
-        base_fee += 31.59
-
-    return round(base_fee, 2)
+    # Complexity only counts once the visit has lasted long enough for it
+    if duration_minutes < FEE_SCHEDULE.complexity_minutes.get(complexity, 0):
+        complexity = None
+    return FEE_SCHEDULE.visit_fee("03.03FV", complexity)
 
+@instrument("prolonged_consult_addon_03_08I", code="03.08I")
 def prolonged_consult_addon_03_08I(calls: int = 1, virtual: bool = False) -> float:
     """
     HSC: 03.08I – Prolonged In-Office Consultation (per 15 mins or majority portion)
@@ -157,16 +132,7 @@ def prolonged_consult_addon_03_08I(calls: int = 1, virtual: bool = False) -> flo
     Returns:
         float: Total fee for prolonged time addon
     """
-    if not 1 <= calls <= 6:
-        raise ValueError("Calls must be between 1 and 6")
-
-    base_unit = 54.81
-    total = base_unit * calls
-
-    if virtual:
-        total *= 1.2  # TELE modifier
-
-    return round(total, 2)
+    return FEE_SCHEDULE.addon_fee("03.08I", calls, virtual)
 
 def hsc_0303a():
     """
@@ -201,23 +167,19 @@ def hsc_0303a():
 
     """
 
+    service = FEE_SCHEDULE.codes["03.03A"]
+    modifiers = {name: FEE_SCHEDULE.complexity_fees[name] for name in service.complexity}
+    if service.teles:
+        modifiers["TELE"] = f"{FEE_SCHEDULE.teles_multiplier:.0%} base multiplier"
+    modifiers.update(service.info.get("extra_modifiers", {}))
+
     return {
-        "code": "03.03A",
-        "description": "Limited assessment (in office)",
-        "base_rate": 82.22,
-        "modifiers": {
-            "CMXV15": 15.78,
-            "CMXV30": 31.59,
-            "TELE": "120% base multiplier",
-            "CMPX_CMGP": 19.54,
-            "AGE_G75GP": "120% base multiplier"
-        },
-        "notes": [
-            "Includes focused H&P and orders",
-            "Not to be billed with 03.05JB",
-            "Part of 'in-office' service group"
-        ],
-        "category": "V Visit",
+        "code": service.code,
+        "description": service.description,
+        "base_rate": service.base_fee,
+        "modifiers": modifiers,
+        "notes": list(service.info.get("notes", [])),
+        "category": service.info.get("category"),
         "specialty_modifier": "NEPH"
     }
 
@@ -239,20 +201,18 @@ def hsc_13_99OA():
         - Not tied to specific visit encounters.
         - Supports chronic disease management billing workflows.
     """
+    service = FEE_SCHEDULE.codes["13.99OA"]
     return {
-        "code": "13.99OA",
-        "description": "Weekly management of chronic dialysis (hemodialysis or peritoneal dialysis)",
-        "category": "M Management",
+        "code": service.code,
+        "description": service.description,
+        "category": service.info.get("category"),
         "skill_modifier": "NEPH",
-        "base_rate_neph": 50.84,
-        "frequency": "Once per patient per 7-day period",
-        "additional_notes": [
-            "Includes all indirect care and coordination.",
-            "Can be claimed alongside consultations or visits if applicable.",
-            "Useful for bundling into weekly revenue forecasting per dialysis patient."
-        ]
+        "base_rate_neph": service.base_fee,
+        "frequency": service.info.get("frequency"),
+        "additional_notes": list(service.info.get("notes", []))
     }
 
+@instrument("optimal_billing_strategy", code_arg="hsc_code")
 def optimal_billing_strategy(hsc_code: str, duration_minutes: int, virtual: bool = False, time_of_day: str = None) -> dict:
     """
     Returns the optimized billing for the given HSC code, time spent, and context.
@@ -266,58 +226,99 @@ def optimal_billing_strategy(hsc_code: str, duration_minutes: int, virtual: bool
     Returns:
         dict with base_code, modifiers_applied, add_on_codes, total_fee
     """
-    base_fee = 0
+    total_fee = 0
     modifiers = []
     add_ons = []
 
-    # NEW CONSULTS
-    if hsc_code in ["03.08A", "03.08CV"]:
-        complexity = "CMXC30" if duration_minutes >= 30 else None
-        base_fee = consult_03_08A(complexity) if hsc_code == "03.08A" else consult_03_08CV(complexity)
+    # Codes with a strategy in the fee schedule: complexity modifier at its
+    # threshold, then one add-on unit per full 15 minutes past it
+    service = FEE_SCHEDULE.codes.get(hsc_code)
+    if service is not None and service.strategy_complexity:
+        threshold = service.strategy_minutes
+        complexity = service.strategy_complexity if duration_minutes >= threshold else None
         if complexity:
             modifiers.append(complexity)
 
-        if duration_minutes > 30:
-            extra_minutes = duration_minutes - 30
-            i_units = extra_minutes // 15
+        i_units = 0
+        if service.addon and duration_minutes > threshold:
+            extra_minutes = duration_minutes - threshold
+            i_units = extra_minutes // FEE_SCHEDULE.addons[service.addon].unit_minutes
             if i_units > 0:
-                addon_fee = prolonged_consult_addon_03_08I(i_units, virtual)
-                base_fee += addon_fee
-                add_ons.append(f"03.08I ({i_units} unit{'s' if i_units > 1 else ''})")
+                add_ons.append(f"{service.addon} ({i_units} unit{'s' if i_units > 1 else ''})")
 
-    # REPEAT CONSULTS & FOLLOW-UPS
-    elif hsc_code in ["03.07B", "03.03F", "03.03FV"]:
-        complexity = "CMXV15" if duration_minutes >= 15 else None
-
-        if hsc_code == "03.07B":
-            base_fee = repeat_consultation_03_07B(complexity, virtual, time_of_day)
-        elif hsc_code == "03.03F":
-            base_fee = repeat_visit_03_03F(complexity, virtual)
-        elif hsc_code == "03.03FV":
-            base_fee = followup_virtual_visit_03_03FV(complexity, duration_minutes)
-
-        if complexity:
-            modifiers.append(complexity)
-
-        if duration_minutes > 15:
-            extra_minutes = duration_minutes - 15
-            i_units = extra_minutes // 15
-            if i_units > 0:
-                addon_fee = prolonged_consult_addon_03_08I(i_units, virtual)
-                base_fee += addon_fee
-                add_ons.append(f"03.08I ({i_units} unit{'s' if i_units > 1 else ''})")
+        total_fee = FEE_SCHEDULE.lookup(hsc_code, complexity, virtual, time_of_day, i_units)
 
     return {
         "base_code": hsc_code,
         "modifiers_applied": modifiers,
         "add_on_codes": add_ons,
-        "total_fee": round(base_fee, 2)
+        "total_fee": round(total_fee, 2)
     }
 
+def _addon_unit_count(add_ons: str) -> int:
+    """
+    Number of 03.08I units in an "Add-ons" display string such as
+    "03.08I (3 units)". Returns 0 when there is no 03.08I add-on.
+    """
+    if "03.08I" not in add_ons:
+        return 0
+    return int(add_ons.split("(")[1].split()[0])
+
+def spread_units(current_units: list, extra_units: int, cap: int) -> list:
+    """
+    Final per-row unit counts after handing out `extra_units` one at a time,
+    round-robin in row order, to rows still under `cap`.
+
+    Every full pass raises each open row by one, so after p passes a row holds
+    min(current + p, cap). The number of full passes is found from a histogram
+    of starting counts, and the leftover units go to the first open rows in
+    order. Runs in O(rows + cap²) regardless of how many units are spread.
+
+    Parameters:
+        current_units (list of int): Units already on each row.
+        extra_units (int): Units to hand out.
+        cap (int): Maximum units per row.
+
+    Returns:
+        list of int: Units on each row after the spread.
+    """
+    if extra_units <= 0:
+        return list(current_units)
+
+    # open_rows[c]: rows starting at c units (below the cap)
+    open_rows = [0] * cap
+    for units in current_units:
+        if units < cap:
+            open_rows[units] += 1
+
+    def handed_out(passes):
+        return sum(count * min(passes, cap - c) for c, count in enumerate(open_rows))
+
+    passes = 0
+    while passes < cap and handed_out(passes + 1) <= extra_units:
+        passes += 1
+    leftover = extra_units - handed_out(passes)
+
+    final_units = []
+    for units in current_units:
+        if units < cap:
+            units = min(units + passes, cap)
+            if leftover > 0 and units < cap:
+                units += 1
+                leftover -= 1
+        final_units.append(units)
+    return final_units
+
+@instrument("redistribute_unbilled_units", code="03.08I")
 def redistribute_unbilled_units(breakdown, available_units):
     """
     Distribute unused 15-min units as 03.08I add-ons fairly across eligible patients.
+
+    Fees are updated in integer cents: a row that gains units has its
+    "Fee ($)" rounded to the cent before the add-on cents are added, so any
+    sub-cent precision in an incoming fee is dropped.
     """
+    max_units = FEE_SCHEDULE.addons["03.08I"].max_units
 
     # Count already billed base units (2 per new consult, 1 for repeat/follow-up)
     base_units = (
@@ -328,11 +329,10 @@ def redistribute_unbilled_units(breakdown, available_units):
     # Count existing add-on units
     addon_units = 0
     for row in breakdown:
-        if "03.08I" in row["Add-ons"]:
-            try:
-                addon_units += int(row["Add-ons"].split("(")[1].split()[0])
-            except:
-                pass  # If there's any parsing issue, skip
+        try:
+            addon_units += _addon_unit_count(row["Add-ons"])
+        except (IndexError, ValueError):
+            pass  # If there's any parsing issue, skip
 
     used_units = base_units + addon_units
     unbilled_units = available_units - used_units
@@ -343,37 +343,19 @@ def redistribute_unbilled_units(breakdown, available_units):
         if row["Visit Type"] in ["New Consult", "Repeat Consult"]
     ]
 
-    # Track current 03.08I counts per row
-    for row in eligible_rows:
-        if "03.08I" in row["Add-ons"]:
-            current_units = int(row["Add-ons"].split("(")[1].split()[0])
-        else:
-            current_units = 0
-        row["_current_addon_units"] = current_units  # temp key
-
-    # Distribute 1 unit at a time across rows in round-robin fashion
-    while unbilled_units > 0:
-        updated = False
-        for row in eligible_rows:
-            if row["_current_addon_units"] < 6 and unbilled_units > 0:
-                row["_current_addon_units"] += 1
-                fee_incr = prolonged_consult_addon_03_08I(1, virtual=False)
-                row["Fee ($)"] += fee_incr
-                unbilled_units -= 1
-                updated = True
-        if not updated:
-            break  # No one left to assign units to
-
-    # Update Add-ons column to reflect redistributed units
-    for row in eligible_rows:
-        units = row["_current_addon_units"]
+    current_units = [_addon_unit_count(row["Add-ons"]) for row in eligible_rows]
+    final_units = spread_units(current_units, unbilled_units, max_units)
+
+    unit_cents = round(prolonged_consult_addon_03_08I(1, virtual=False) * 100)
+    for row, before, units in zip(eligible_rows, current_units, final_units):
+        # Add the units in integer cents, so the fee stays exact however many are added
+        if units > before:
+            row["Fee ($)"] = (round(row["Fee ($)"] * 100) + (units - before) * unit_cents) / 100
+
+        # Update Add-ons column to reflect redistributed units
         if units > 0:
             row["Add-ons"] = f"03.08I ({units} unit{'s' if units > 1 else ''})"
         else:
             row["Add-ons"] = "-"
 
-        # Clean up temporary field
-        del row["_current_addon_units"]
-
     return breakdown
-
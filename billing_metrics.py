@@ -0,0 +1,155 @@
+"""
+Optional latency instrumentation for the pricing hot paths.
+
+Set NEPHBILL_METRICS=1 before starting the app (or any script) to record call
+counts and latency per function and HSC code. The switch is read once, at
+import: when it is off, `instrument` hands back the undecorated function, so
+the decorators can stay in production code at no cost.
+
+Collected series can be read with `snapshot()` (the app's hidden diagnostics
+panel) or rendered in the Prometheus text exposition format with
+`prometheus_text()` / `write_prometheus()`. When NEPHBILL_METRICS_FILE is set,
+the exposition file is also written at interpreter exit.
+"""
+
+import atexit
+import functools
+import os
+import threading
+import time
+from collections import deque
+
+ENABLED = os.environ.get("NEPHBILL_METRICS", "").strip().lower() in {"1", "true", "yes", "on"}
+METRICS_FILE = os.environ.get("NEPHBILL_METRICS_FILE")
+
+# Latest samples kept per series for the quantiles
+RESERVOIR_SIZE = 4096
+QUANTILES = (0.5, 0.9, 0.99)
+
+_lock = threading.Lock()
+_series = {}    # (function, hsc_code) -> _Series
+
+
+class _Series:
+    __slots__ = ("count", "total", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=RESERVOIR_SIZE)
+
+
+def record(function: str, hsc_code: str, seconds: float):
+    """Add one timed call to a series."""
+    key = (function, hsc_code or "")
+    with _lock:
+        series = _series.get(key)
+        if series is None:
+            series = _series[key] = _Series()
+        series.count += 1
+        series.total += seconds
+        series.samples.append(seconds)
+
+
+def instrument(function: str, code: str = None, code_arg: str = None):
+    """
+    Time every call of the decorated function when metrics are enabled.
+
+    Parameters:
+        function (str): Series name.
+        code (str): Fixed HSC code label (for per-code fee functions).
+        code_arg (str): Name of the argument holding the HSC code, read per call.
+    """
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        position = fn.__code__.co_varnames[:fn.__code__.co_argcount].index(code_arg) if code_arg else None
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if position is None:
+                    label = code
+                else:
+                    label = args[position] if len(args) > position else kwargs.get(code_arg)
+                record(function, label if isinstance(label, str) else code, time.perf_counter() - start)
+
+        return timed
+
+    return decorate
+
+
+def reset():
+    """Drop every collected series."""
+    with _lock:
+        _series.clear()
+
+
+def _collect() -> list:
+    """((function, hsc_code), calls, total seconds, quantile seconds) per series, sorted."""
+    import numpy as np
+
+    with _lock:
+        items = [(key, series.count, series.total, np.array(series.samples)) for key, series in _series.items()]
+    return sorted(((key, count, total, np.quantile(samples, QUANTILES)) for key, count, total, samples in items),
+                  key=lambda item: item[0])
+
+
+def snapshot():
+    """
+    One row per (function, hsc_code) series with calls, total_ms, mean_us and
+    p50_us / p90_us / p99_us over the latest RESERVOIR_SIZE calls.
+
+    Returns:
+        DataFrame
+    """
+    import pandas as pd
+
+    quantile_columns = [f"p{int(q * 100)}_us" for q in QUANTILES]
+    rows = []
+    for (function, hsc_code), count, total, quantiles in _collect():
+        row = {"function": function, "hsc_code": hsc_code, "calls": count, "total_ms": total * 1e3,
+               "mean_us": total / count * 1e6}
+        row.update(zip(quantile_columns, quantiles * 1e6))
+        rows.append(row)
+    return pd.DataFrame(rows, columns=["function", "hsc_code", "calls", "total_ms", "mean_us"] + quantile_columns)
+
+
+def prometheus_text() -> str:
+    """All series as a Prometheus summary, nephbill_call_duration_seconds."""
+    name = "nephbill_call_duration_seconds"
+    lines = [
+        f"# HELP {name} Latency of instrumented billing calls.",
+        f"# TYPE {name} summary",
+    ]
+    for (function, hsc_code), count, total, quantiles in _collect():
+        labels = f'function="{function}",hsc_code="{hsc_code}"'
+        for q, value in zip(QUANTILES, quantiles):
+            lines.append(f'{name}{{{labels},quantile="{q}"}} {value:.9f}')
+        lines.append(f"{name}_sum{{{labels}}} {total:.9f}")
+        lines.append(f"{name}_count{{{labels}}} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str = None) -> str:
+    """
+    Write the exposition atomically (temp file + rename), as the node_exporter
+    textfile collector expects.
+
+    Returns:
+        str: the path written.
+    """
+    path = path or METRICS_FILE
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as file:
+        file.write(prometheus_text())
+    os.replace(temp_path, path)
+    return path
+
+
+if ENABLED and METRICS_FILE:
+    atexit.register(write_prometheus, METRICS_FILE)
@@ -0,0 +1,131 @@
+"""
+Headless streaming pricing pipeline for encounter exports.
+
+Reads CSV or JSONL encounter files in chunks, prices each chunk with the
+vectorized batch engine and streams the priced claims to an output file
+(CSV, JSONL, fixed-width claim records, Parquet or Arrow; see claim_export),
+so memory stays flat no matter how many rows the export has.
+
+Usage:
+    python billing_pipeline.py encounters.csv priced.csv --chunksize 100000
+    python billing_pipeline.py encounters.csv claims.parquet
+    python billing_pipeline.py encounters.csv submission.txt
+
+Input columns: hsc_code, duration_minutes, and optionally virtual and
+time_of_day (EV/WK/NTAM/NTPM). Any other columns are carried through.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+from billing_batch import price_encounters
+from billing_breakdown import to_cents
+from claim_export import open_claim_writer
+
+DEFAULT_CHUNKSIZE = 100_000
+
+_TRUE_STRINGS = {"true", "t", "1", "yes", "y"}
+
+
+def _format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".jsonl", ".ndjson", ".json"):
+        return "jsonl"
+    if ext == ".csv":
+        return "csv"
+    raise ValueError(f"Unsupported file type: {path} (expected .csv or .jsonl)")
+
+
+def read_encounters(path: str, chunksize: int = DEFAULT_CHUNKSIZE):
+    """
+    Yield DataFrame chunks of an encounter export.
+
+    Parameters:
+        path (str): CSV or JSONL file.
+        chunksize (int): Rows per chunk.
+    """
+    if _format(path) == "csv":
+        reader = pd.read_csv(path, chunksize=chunksize, dtype={"hsc_code": str, "time_of_day": str})
+    else:
+        reader = pd.read_json(path, lines=True, chunksize=chunksize, dtype={"hsc_code": str, "time_of_day": str})
+    with reader:
+        yield from reader
+
+
+def _normalize(chunk: pd.DataFrame) -> pd.DataFrame:
+    # Exports disagree on how they spell booleans
+    if "virtual" in chunk and chunk["virtual"].dtype != bool:
+        chunk["virtual"] = chunk["virtual"].astype(str).str.strip().str.lower().isin(_TRUE_STRINGS)
+    return chunk
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process, in MB, or None where it is not reported (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def price_file(input_path: str, output_path: str, chunksize: int = DEFAULT_CHUNKSIZE) -> dict:
+    """
+    Price an encounter export chunk by chunk and stream the priced claims out.
+
+    Parameters:
+        input_path (str): CSV or JSONL encounter file.
+        output_path (str): Destination, overwritten if present; its extension
+            picks the format (claim_export.EXPORT_FORMATS).
+        chunksize (int): Rows held in memory at a time.
+
+    Returns:
+        dict with rows, seconds, rows_per_sec, total_fee and peak_rss_mb
+        (None where the platform does not report it).
+    """
+    rows = 0
+    total_cents = 0
+    start = time.perf_counter()
+
+    with open_claim_writer(output_path) as writer:
+        for chunk in read_encounters(input_path, chunksize):
+            try:
+                priced = price_encounters(_normalize(chunk))
+            except ValueError as exc:
+                raise ValueError(f"Chunk starting at row {rows}: {exc}") from None
+
+            writer.write(priced)
+            rows += len(priced)
+            total_cents += int(to_cents(priced["total_fee"]).sum())
+
+    seconds = time.perf_counter() - start
+    peak = peak_rss_mb()
+    return {
+        "rows": rows,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(rows / seconds) if seconds > 0 else 0,
+        "total_fee": total_cents / 100,
+        "peak_rss_mb": round(peak, 1) if peak is not None else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Price an encounter export in constant memory.")
+    parser.add_argument("input", help="Encounter file (.csv or .jsonl)")
+    parser.add_argument("output", help="Priced claims file (.csv, .jsonl, .txt fixed-width, .parquet or .arrow)")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="Rows per chunk")
+    args = parser.parse_args(argv)
+
+    stats = price_file(args.input, args.output, args.chunksize)
+    peak = f", peak RSS {stats['peak_rss_mb']:.1f} MB" if stats["peak_rss_mb"] is not None else ""
+    print(f"Priced {stats['rows']:,} rows in {stats['seconds']:.2f}s "
+          f"({stats['rows_per_sec']:,} rows/sec), total ${stats['total_fee']:,.2f}{peak}")
+
+
+if __name__ == "__main__":
+    main()
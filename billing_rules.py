@@ -0,0 +1,178 @@
+"""
+Billing rules from billing_rules.yaml and the same-encounter conflict engine.
+
+Conflict rules are data: each names the codes or modifiers that clash within
+one encounter. At load time every code and modifier the rules mention gets a
+bit, so an encounter becomes one uint64 mask and each rule is a couple of
+bitwise tests, either for one encounter or for a whole claim file at once.
+"""
+
+import os
+import time
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from fee_schedule import FEE_SCHEDULE
+
+BILLING_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "billing_rules.yaml")
+
+
+def load_billing_rules(path: str = BILLING_RULES_PATH) -> dict:
+    """Parsed billing-rules YAML file."""
+    with open(path) as file:
+        return yaml.safe_load(file)
+
+
+BILLING_RULES = load_billing_rules()
+
+
+class ConflictRule(NamedTuple):
+    name: str
+    description: str
+    trigger: int    # bits that make the rule apply (any of them)
+    excludes: int   # conflict if any of these bits is also present
+    requires: int   # conflict if none of these bits is present (0: no requirement)
+
+
+class ConflictRules(NamedTuple):
+    tokens: dict    # code or modifier -> bit
+    rules: tuple
+
+    def mask(self, tokens) -> int:
+        """Bitmask of the codes and modifiers in one encounter."""
+        mask = 0
+        for token in tokens:
+            mask |= self.tokens.get(token, 0)
+        return mask
+
+    def check_encounter(self, codes, modifiers=()) -> list:
+        """
+        Names of the rules one encounter breaks.
+
+        Parameters:
+            codes (iterable of str): HSC codes billed in the encounter.
+            modifiers (iterable of str): Modifiers billed with them (SURC codes, ...).
+        """
+        mask = self.mask(list(codes) + list(modifiers))
+        return [rule.name for rule in self.rules if _breaks(rule, mask)]
+
+    def validate_claims(self, claims: pd.DataFrame) -> tuple:
+        """
+        Flag conflicting code combinations across a claim file in one pass.
+
+        Parameters:
+            claims (DataFrame): One row per claim line with encounter_id,
+                hsc_code and optionally modifiers (comma- or space-separated).
+
+        Returns:
+            (DataFrame, dict): one row per broken rule (encounter_id, rule,
+            description) and the seconds spent on each rule.
+        """
+        claims = claims.reset_index(drop=True)
+        line_bits = claims["hsc_code"].astype(str).map(self.tokens).fillna(0).to_numpy(dtype=np.uint64)
+        if "modifiers" in claims:
+            exploded = claims["modifiers"].fillna("").astype(str).str.replace(",", " ").str.split().explode()
+            line_bits |= _or_by_group(exploded.index.to_numpy(),
+                                      exploded.map(self.tokens).fillna(0).to_numpy(dtype=np.uint64),
+                                      len(claims))
+
+        encounter_ids, encounter_codes = pd.factorize(claims["encounter_id"])
+        masks = _or_by_group(encounter_ids, line_bits, len(encounter_codes))
+
+        frames = []
+        timings = {}
+        for rule in self.rules:
+            start = time.perf_counter()
+            broken = np.flatnonzero(_breaks(rule, masks))
+            timings[rule.name] = time.perf_counter() - start
+            frames.append(pd.DataFrame({
+                "encounter_id": encounter_codes[broken],
+                "rule": rule.name,
+                "description": rule.description,
+            }))
+
+        violations = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+            columns=["encounter_id", "rule", "description"])
+        return violations, timings
+
+
+def _or_by_group(group_ids: np.ndarray, bits: np.ndarray, groups: int) -> np.ndarray:
+    """Bitwise OR of `bits` within each group id (0 .. groups - 1)."""
+    result = np.zeros(groups, dtype=np.uint64)
+    if len(bits) == 0:
+        return result
+    order = np.argsort(group_ids, kind="stable")
+    sorted_ids = group_ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    result[sorted_ids[starts]] = np.bitwise_or.reduceat(bits[order], starts)
+    return result
+
+
+def _breaks(rule: ConflictRule, mask):
+    """Whether a mask (int or uint64 array) breaks the rule."""
+    if isinstance(mask, np.ndarray):
+        trigger, excludes, requires = (np.uint64(bits) for bits in (rule.trigger, rule.excludes, rule.requires))
+        zero = np.uint64(0)
+    else:
+        trigger, excludes, requires, zero = rule.trigger, rule.excludes, rule.requires, 0
+
+    applies = (mask & trigger) != zero
+    conflict = (mask & excludes) != zero
+    if rule.requires:
+        conflict = conflict | ((mask & requires) == zero)
+    return applies & conflict
+
+
+def compile_conflict_rules(rules: dict = None) -> ConflictRules:
+    """
+    Compile the encounter_conflicts section of the billing rules into bitmasks.
+
+    Each rule has `code` (or a list under `codes`) that triggers it, and any of
+    `excludes` (codes, modifiers or code_groups names that may not appear with
+    it), `requires_any` (one of them must appear) or `addon` (requires one of
+    the fee schedule's applies_to base codes for that add-on).
+    """
+    rules = rules or BILLING_RULES
+    groups = rules.get("code_groups", {})
+
+    def expand(names):
+        tokens = []
+        for name in names or ():
+            tokens.extend(groups.get(name, [name]))
+        return tokens
+
+    compiled = []
+    tokens = {}
+
+    def bits(names):
+        mask = 0
+        for token in expand(names):
+            if token not in tokens:
+                if len(tokens) == 64:
+                    raise ValueError("Conflict rules mention more than 64 codes and modifiers")
+                tokens[token] = 1 << len(tokens)
+            mask |= tokens[token]
+        return mask
+
+    for name, entry in rules.get("encounter_conflicts", {}).items():
+        if entry.get("addon"):
+            trigger = [entry["addon"]]
+            requires = list(FEE_SCHEDULE.addons[entry["addon"]].applies_to)
+        else:
+            trigger = entry.get("codes") or [entry["code"]]
+            requires = entry.get("requires_any", [])
+        compiled.append(ConflictRule(
+            name=name,
+            description=entry.get("description", name),
+            trigger=bits(trigger),
+            excludes=bits(entry.get("excludes", [])),
+            requires=bits(requires),
+        ))
+
+    return ConflictRules(tokens=tokens, rules=tuple(compiled))
+
+
+CONFLICT_RULES = compile_conflict_rules()
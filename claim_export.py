@@ -0,0 +1,340 @@
+"""
+Streaming exporters for priced claims.
+
+Clinic breakdowns and batch pricing output can be written as CSV, JSONL, a
+fixed-width claim-submission file, Parquet or Arrow IPC. Every writer takes
+DataFrame chunks and holds at most `buffer_rows` rows at a time, either as
+formatted text or as a pending Parquet row group / Arrow record batch, so an
+export of any size streams through in bounded memory. pyarrow is only
+imported by the Parquet and Arrow writers.
+
+CSV, JSONL, Parquet and Arrow keep the priced columns as they are. The
+fixed-width file has one claim record per line, laid out by
+FIXED_WIDTH_LAYOUT, with the fee in integer cents.
+"""
+
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from billing_breakdown import ADDON_CODE, to_cents
+from fee_schedule import FEE_SCHEDULE
+
+EXPORT_FORMATS = {
+    ".csv": "csv",
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+    ".json": "jsonl",
+    ".txt": "fixed",
+    ".dat": "fixed",
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+}
+
+DEFAULT_BUFFER_ROWS = 65_536
+
+# Claim-submission record: (field, width, numeric). Numeric fields are
+# right-aligned and zero-padded, text fields left-aligned and space-padded;
+# both are cut to their width.
+FIXED_WIDTH_LAYOUT = (
+    ("record_type", 2, False),     # "CL"
+    ("claim_number", 9, True),     # running number within the file
+    ("physician_id", 10, False),
+    ("patient_id", 12, False),
+    ("service_date", 8, False),    # YYYYMMDD, blank when unknown
+    ("hsc_code", 8, False),
+    ("modifier_1", 6, False),      # complexity modifier (CMXC30, CMXV15, ...)
+    ("modifier_2", 6, False),      # SURC time of day, for codes that take it
+    ("modifier_3", 6, False),      # TELES when the fee carries the virtual multiplier
+    ("addon_code", 8, False),
+    ("addon_units", 2, True),
+    ("minutes", 4, True),
+    ("fee_cents", 10, True),
+)
+FIXED_WIDTH_RECORD_LENGTH = sum(width for _, width, _ in FIXED_WIDTH_LAYOUT)
+
+_SURCHARGE_CODES = [code for code, service in FEE_SCHEDULE.codes.items() if service.surcharge]
+_TELES_CODES = [code for code, service in FEE_SCHEDULE.codes.items() if service.teles]
+_TELES_ADDON_CODES = [code for code, service in FEE_SCHEDULE.codes.items()
+                      if service.addon and FEE_SCHEDULE.addons[service.addon].teles]
+_TRUE_STRINGS = {"true", "t", "1", "yes", "y"}
+
+
+def export_format(path: str) -> str:
+    """Export format for a file name, from its extension."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export file type: {path} (expected one of {', '.join(EXPORT_FORMATS)})")
+    return EXPORT_FORMATS[ext]
+
+
+def _id_text(values: pd.Series) -> pd.Series:
+    # IDs read as floats (a column with gaps) print as 123, and missing ones blank
+    def text(value):
+        if pd.isna(value):
+            return ""
+        if isinstance(value, (float, np.floating)) and float(value).is_integer():
+            return str(int(value))
+        return str(value)
+
+    return values.map(text)
+
+
+def claim_records(priced: pd.DataFrame, first_claim: int = 1) -> pd.DataFrame:
+    """
+    FIXED_WIDTH_LAYOUT fields for priced claims.
+
+    Parameters:
+        priced (DataFrame): A breakdown (fee_cents, minutes) or batch pricing
+            output (total_fee, duration_minutes), with hsc_code, complexity
+            and addon_units. physician_id, patient_id, service_date,
+            time_of_day and virtual are used when present.
+        first_claim (int): Claim number of the first row.
+
+    Returns:
+        DataFrame: one column per layout field.
+    """
+    n = len(priced)
+
+    def column(name, default=""):
+        return priced[name] if name in priced else pd.Series(default, index=priced.index)
+
+    fee_cents = priced["fee_cents"] if "fee_cents" in priced else to_cents(priced["total_fee"])
+    minutes = priced["minutes"] if "minutes" in priced else priced["duration_minutes"]
+    service_date = column("service_date", None)
+    surc = column("time_of_day", None).where(priced["hsc_code"].isin(_SURCHARGE_CODES), None)
+    virtual = column("virtual", False)
+    if virtual.dtype != bool:
+        virtual = virtual.astype(str).str.strip().str.lower().isin(_TRUE_STRINGS)
+    # A virtual visit is billed at the TELES rate on a teles code, or on its add-on units
+    teles = virtual & (priced["hsc_code"].isin(_TELES_CODES)
+                       | (priced["hsc_code"].isin(_TELES_ADDON_CODES) & (priced["addon_units"] > 0)))
+
+    return pd.DataFrame({
+        "record_type": "CL",
+        "claim_number": np.arange(first_claim, first_claim + n),
+        "physician_id": _id_text(column("physician_id")),
+        "patient_id": _id_text(column("patient_id")),
+        "service_date": pd.to_datetime(service_date).dt.strftime("%Y%m%d").fillna(""),
+        "hsc_code": priced["hsc_code"],
+        "modifier_1": column("complexity", None).fillna(""),
+        "modifier_2": surc.fillna(""),
+        "modifier_3": np.where(teles.to_numpy(), "TELES", ""),
+        "addon_code": np.where(priced["addon_units"].to_numpy() > 0, ADDON_CODE, ""),
+        "addon_units": priced["addon_units"].to_numpy(),
+        "minutes": np.asarray(minutes),
+        "fee_cents": np.asarray(fee_cents),
+    }, index=priced.index)
+
+
+def fixed_width_lines(records: pd.DataFrame) -> str:
+    """
+    claim_records laid out as fixed-width lines, each ending in a newline.
+
+    The lines are assembled as one byte matrix, a column slice per field, so
+    no Python string is built per claim. Text fields must be ASCII and are
+    cut to their width; numeric fields must fit theirs.
+    """
+    n = len(records)
+    lines = np.empty((n, FIXED_WIDTH_RECORD_LENGTH + 1), dtype=np.uint8)
+    lines[:, -1] = ord("\n")
+    position = 0
+    for field, width, numeric in FIXED_WIDTH_LAYOUT:
+        columns = lines[:, position:position + width]
+        if numeric:
+            values = records[field].to_numpy(dtype=np.int64)
+            if n and (values.min() < 0 or values.max() >= 10 ** width):
+                raise ValueError(f"{field} does not fit in {width} digits")
+            for digit in range(width - 1, -1, -1):
+                columns[:, digit] = ord("0") + values % 10
+                values = values // 10
+        else:
+            try:
+                text = np.array(records[field].to_numpy(dtype=object), dtype=f"S{width}")
+            except UnicodeEncodeError:
+                raise ValueError(f"{field} must be ASCII in a fixed-width claim file") from None
+            text = text.view(np.uint8).reshape(n, width)
+            columns[:] = np.where(text == 0, ord(" "), text)
+        position += width
+    return lines.tobytes().decode("ascii")
+
+
+class ClaimWriter:
+    """
+    Base streaming writer. `write` takes DataFrame chunks of any size and
+    hands them on at most `buffer_rows` rows at a time.
+
+    Parameters:
+        target (str or binary file): Path (overwritten) or open binary file.
+        buffer_rows (int): Rows formatted or buffered at a time.
+    """
+
+    def __init__(self, target, buffer_rows: int = DEFAULT_BUFFER_ROWS):
+        self.target = target
+        self.buffer_rows = buffer_rows
+        self.rows = 0
+
+    def write(self, priced: pd.DataFrame):
+        for start in range(0, len(priced), self.buffer_rows):
+            part = priced.iloc[start:start + self.buffer_rows]
+            self._write(part)
+            self.rows += len(part)
+
+    def _write(self, priced: pd.DataFrame):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _TextClaimWriter(ClaimWriter):
+    def __init__(self, target, buffer_rows: int = DEFAULT_BUFFER_ROWS):
+        super().__init__(target, buffer_rows)
+        if isinstance(target, (str, os.PathLike)):
+            self.file = open(target, "w", newline="", encoding="utf-8")
+        else:
+            self.file = io.TextIOWrapper(target, encoding="utf-8", newline="")
+
+    def close(self):
+        if isinstance(self.target, (str, os.PathLike)):
+            self.file.close()
+        else:
+            # Leave the caller's file open
+            self.file.flush()
+            self.file.detach()
+
+
+class CsvClaimWriter(_TextClaimWriter):
+    """Priced columns as CSV, with one header line."""
+
+    def _write(self, priced: pd.DataFrame):
+        priced.to_csv(self.file, header=self.rows == 0, index=False)
+
+
+class JsonlClaimWriter(_TextClaimWriter):
+    """Priced columns as one JSON object per line."""
+
+    def _write(self, priced: pd.DataFrame):
+        text = priced.to_json(orient="records", lines=True)
+        self.file.write(text if text.endswith("\n") else text + "\n")
+
+
+class FixedWidthClaimWriter(_TextClaimWriter):
+    """Claim-submission records laid out by FIXED_WIDTH_LAYOUT."""
+
+    def _write(self, priced: pd.DataFrame):
+        self.file.write(fixed_width_lines(claim_records(priced, first_claim=self.rows + 1)))
+
+
+class _ArrowClaimWriter(ClaimWriter):
+    """
+    Buffers chunks until buffer_rows rows are pending, then writes them as one
+    Parquet row group or Arrow record batch. The schema comes from the first
+    chunk, with all-null columns typed as strings; an export with no rows is
+    still written, as a file with an empty schema.
+    """
+
+    def __init__(self, target, buffer_rows: int = DEFAULT_BUFFER_ROWS):
+        super().__init__(target, buffer_rows)
+        self.pending = []
+        self.pending_rows = 0
+        self.schema = None
+        self.writer = None
+
+    def _write(self, priced: pd.DataFrame):
+        self.pending.append(priced)
+        self.pending_rows += len(priced)
+        if self.pending_rows >= self.buffer_rows:
+            self._flush()
+
+    def _flush(self):
+        import pyarrow as pa
+
+        if not self.pending:
+            return
+        frame = pd.concat(self.pending, ignore_index=True)
+        self.pending, self.pending_rows = [], 0
+        if self.schema is None:
+            schema = pa.Schema.from_pandas(frame, preserve_index=False)
+            self.schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                                     for field in schema])
+            self.writer = self._open(self.schema)
+        self._write_table(pa.Table.from_pandas(frame, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        import pyarrow as pa
+
+        self._flush()
+        if self.writer is None:
+            self.schema = pa.schema([])
+            self.writer = self._open(self.schema)
+        self.writer.close()
+
+
+class ParquetClaimWriter(_ArrowClaimWriter):
+    """Priced columns as Parquet, one row group per buffer_rows rows."""
+
+    def _open(self, schema):
+        import pyarrow.parquet as pq
+
+        return pq.ParquetWriter(self.target, schema)
+
+    def _write_table(self, table):
+        self.writer.write_table(table, row_group_size=self.buffer_rows)
+
+
+class ArrowClaimWriter(_ArrowClaimWriter):
+    """Priced columns as an Arrow IPC (Feather v2) file."""
+
+    def _open(self, schema):
+        import pyarrow as pa
+
+        return pa.ipc.new_file(self.target, schema)
+
+    def _write_table(self, table):
+        self.writer.write_table(table, max_chunksize=self.buffer_rows)
+
+
+_WRITERS = {
+    "csv": CsvClaimWriter,
+    "jsonl": JsonlClaimWriter,
+    "fixed": FixedWidthClaimWriter,
+    "parquet": ParquetClaimWriter,
+    "arrow": ArrowClaimWriter,
+}
+
+
+def open_claim_writer(target, format: str = None, buffer_rows: int = DEFAULT_BUFFER_ROWS) -> ClaimWriter:
+    """
+    Streaming writer for priced claims.
+
+    Parameters:
+        target (str or binary file): Path, or open binary file (then format is required).
+        format (str): csv, jsonl, fixed, parquet or arrow; defaults to the path's extension.
+        buffer_rows (int): Rows formatted or buffered at a time.
+
+    Returns:
+        ClaimWriter: use as a context manager; `write` takes DataFrame chunks.
+    """
+    if format is None:
+        format = export_format(target)
+    if format not in _WRITERS:
+        raise ValueError(f"Unknown export format {format!r}, expected one of {', '.join(_WRITERS)}")
+    return _WRITERS[format](target, buffer_rows)
+
+
+def export_bytes(priced: pd.DataFrame, format: str) -> bytes:
+    """A whole (small) table in an export format, e.g. for a download button."""
+    buffer = io.BytesIO()
+    with open_claim_writer(buffer, format) as writer:
+        writer.write(priced)
+    return buffer.getvalue()
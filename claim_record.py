@@ -0,0 +1,221 @@
+"""
+Compact claim records for large in-memory batches.
+
+A priced claim as an app row (a dict of display strings such as
+"Visit Type", "Modifiers", "Add-ons" and a float "Fee ($)") costs a few
+hundred bytes, and a priced batch row with string columns around 60. A claim
+record is one element of a NumPy structured array of CLAIM_DTYPE: 14 bytes.
+HSC code, visit type, complexity modifier and SURC code are one-byte codes
+into the tuples below. Minutes and units are small integers and the fee
+is integer cents, so batch totals are exact integer sums.
+
+Records are priced with the same rules as `optimal_billing_strategy`, and
+convert to and from the breakdown table the app renders and the app-style
+rows `redistribute_unbilled_units` takes, so they can replace either in
+memory and be expanded only for display.
+"""
+
+import numpy as np
+import pandas as pd
+
+from billing_batch import optimal_billing_strategy_batch
+from billing_breakdown import ADDON_CODE, ADDON_ELIGIBLE, BASE_UNITS, VISIT_TYPES, rrnp_cents, spread_units, to_cents
+from billing_functions import _addon_unit_count, optimal_billing_strategy
+from fee_schedule import FEE_SCHEDULE, FEE_SCHEDULES
+
+# Field codes: position in these tuples. 0 is "none" for the optional fields.
+RECORD_HSC_CODES = tuple(dict.fromkeys(code for schedule in FEE_SCHEDULES.schedules for code in schedule.codes))
+RECORD_VISIT_TYPES = (None,) + VISIT_TYPES
+RECORD_MODIFIERS = (None,) + tuple(FEE_SCHEDULE.complexity_fees)
+RECORD_SURCHARGES = (None,) + tuple(FEE_SCHEDULE.surcharges)
+
+# Codes that take a SURC time of day; records of other codes store none
+_SURCHARGE_CODES = [code for code, service in FEE_SCHEDULE.codes.items() if service.surcharge]
+
+CLAIM_DTYPE = np.dtype([
+    ("fee_cents", "<i4"),
+    ("minutes", "<u2"),
+    ("hsc_code", "u1"),         # RECORD_HSC_CODES
+    ("visit_type", "u1"),       # RECORD_VISIT_TYPES
+    ("complexity", "u1"),       # RECORD_MODIFIERS
+    ("time_of_day", "u1"),      # RECORD_SURCHARGES
+    ("base_units", "u1"),
+    ("addon_units", "u1"),
+    ("virtual", "?"),
+    ("apply_rrnp", "?"),
+])
+
+_FIELD_CODES = {
+    "hsc_code": RECORD_HSC_CODES,
+    "visit_type": RECORD_VISIT_TYPES,
+    "complexity": RECORD_MODIFIERS,
+    "time_of_day": RECORD_SURCHARGES,
+}
+
+
+def encode(field: str, values, n: int = None) -> np.ndarray:
+    """
+    Codes of an enum field for values (scalar or array-like, None/NaN/""
+    for none), broadcast to n rows when given.
+
+    Raises:
+        ValueError: for values the field has no code for.
+    """
+    choices = _FIELD_CODES[field]
+    values = pd.Series(np.asarray(values, dtype=object).reshape(-1)).fillna("")
+    codes = pd.Index(["" if choice is None else choice for choice in choices]).get_indexer(values)
+    if (codes < 0).any():
+        raise ValueError(f"Unknown {field} {sorted(set(values[codes < 0]))[:10]}, expected one of {choices}")
+    codes = codes.astype(np.uint8)
+    return codes if n is None else np.broadcast_to(codes, (n,))
+
+
+def decode(records: np.ndarray, field: str) -> np.ndarray:
+    """Values of an enum field as an object array (None for none)."""
+    return np.array(_FIELD_CODES[field], dtype=object)[records[field]]
+
+
+def total_cents(records: np.ndarray) -> int:
+    """Exact fee total of a batch."""
+    return int(records["fee_cents"].sum(dtype=np.int64))
+
+
+def price_records(hsc_codes, durations, virtual=False, time_of_day=None, apply_rrnp: bool = False,
+                  visit_types=None) -> np.ndarray:
+    """
+    Price encounters straight into claim records.
+
+    Parameters:
+        hsc_codes (array-like of str): HSC code per encounter.
+        durations (array-like of int): Minutes spent per encounter.
+        virtual (bool or array-like of bool): Virtual flag.
+        time_of_day (str or array-like of str): SURC code; only priced, and
+            only stored, on codes that take it (03.07B).
+        apply_rrnp (bool): Apply the RRNP uplift.
+        visit_types (array-like of str): Optional visit type per encounter;
+            base units are BASE_UNITS for it, 0 without.
+
+    Returns:
+        ndarray of CLAIM_DTYPE.
+
+    Raises:
+        ValueError: as optimal_billing_strategy_batch, or for codes with no record code.
+    """
+    codes = np.asarray(hsc_codes, dtype=object).reshape(-1)
+    n = len(codes)
+    minutes = np.broadcast_to(np.asarray(durations, dtype=np.int64), (n,))
+    priced = optimal_billing_strategy_batch(codes, minutes, virtual=virtual, time_of_day=time_of_day)
+
+    records = np.zeros(n, dtype=CLAIM_DTYPE)
+    records["fee_cents"] = rrnp_cents(priced["total_fee"]) if apply_rrnp else to_cents(priced["total_fee"])
+    records["minutes"] = minutes
+    records["hsc_code"] = encode("hsc_code", codes)
+    records["complexity"] = encode("complexity", priced["complexity"])
+    records["time_of_day"] = np.where(np.isin(codes, _SURCHARGE_CODES), encode("time_of_day", time_of_day, n), 0)
+    records["addon_units"] = priced["addon_units"]
+    records["virtual"] = virtual
+    records["apply_rrnp"] = apply_rrnp
+    if visit_types is not None:
+        records["visit_type"] = encode("visit_type", visit_types, n)
+        records["base_units"] = pd.Series(decode(records, "visit_type")).map(BASE_UNITS).fillna(0).to_numpy()
+    return records
+
+
+def claim_record(hsc_code: str, duration_minutes: int, virtual: bool = False, time_of_day: str = None,
+                 apply_rrnp: bool = False, visit_type: str = None) -> np.void:
+    """One encounter priced by `optimal_billing_strategy`, as a claim record."""
+    record = np.zeros((), dtype=CLAIM_DTYPE)
+    record["hsc_code"] = encode("hsc_code", hsc_code)[0]
+    record["visit_type"] = encode("visit_type", visit_type)[0]
+    record["time_of_day"] = encode("time_of_day", time_of_day)[0] if hsc_code in _SURCHARGE_CODES else 0
+
+    priced = optimal_billing_strategy(hsc_code, duration_minutes, virtual=virtual, time_of_day=time_of_day)
+    fee = FEE_SCHEDULE.rrnp_fee(priced["total_fee"]) if apply_rrnp else priced["total_fee"]
+    record["fee_cents"] = round(fee * 100)
+    record["minutes"] = duration_minutes
+    record["complexity"] = encode("complexity", (priced["modifiers_applied"] or [None])[0])[0]
+    record["base_units"] = BASE_UNITS.get(visit_type, 0)
+    record["addon_units"] = sum(_addon_unit_count(add_on) for add_on in priced["add_on_codes"])
+    record["virtual"] = virtual
+    record["apply_rrnp"] = apply_rrnp
+    return record[()]
+
+
+def records_from_breakdown(breakdown: pd.DataFrame, virtual: bool = False, time_of_day: str = None,
+                           apply_rrnp: bool = False) -> np.ndarray:
+    """
+    Claim records for a breakdown table.
+
+    Parameters:
+        breakdown (DataFrame): Breakdown table (billing_breakdown).
+        virtual, time_of_day, apply_rrnp: The settings it was priced with;
+            SURC is kept on repeat consults only.
+    """
+    n = len(breakdown)
+    visit_types = breakdown["visit_type"].astype(object).to_numpy()
+    records = np.zeros(n, dtype=CLAIM_DTYPE)
+    for field in ("fee_cents", "minutes", "base_units", "addon_units"):
+        records[field] = breakdown[field].to_numpy()
+    records["hsc_code"] = encode("hsc_code", breakdown["hsc_code"])
+    records["visit_type"] = encode("visit_type", visit_types)
+    records["complexity"] = encode("complexity", breakdown["complexity"])
+    records["time_of_day"] = np.where(visit_types == "Repeat Consult", encode("time_of_day", time_of_day), 0)
+    records["virtual"] = virtual
+    records["apply_rrnp"] = apply_rrnp
+    return records
+
+
+def records_to_breakdown(records: np.ndarray) -> pd.DataFrame:
+    """Breakdown table for claim records with visit types, e.g. for `format_breakdown`."""
+    return pd.DataFrame({
+        "visit_type": pd.Categorical(decode(records, "visit_type"), categories=VISIT_TYPES),
+        "hsc_code": decode(records, "hsc_code"),
+        "complexity": decode(records, "complexity"),
+        "minutes": records["minutes"].astype(np.int64),
+        "base_units": records["base_units"].astype(np.int64),
+        "addon_units": records["addon_units"].astype(np.int64),
+        "fee_cents": records["fee_cents"].astype(np.int64),
+    })
+
+
+def records_from_rows(rows: list, virtual: bool = False) -> np.ndarray:
+    """
+    Claim records for app-style rows ("Visit Type", "HSC Code", "Modifiers",
+    "Add-ons", "Fee ($)" and optionally "Minutes").
+    """
+    records = np.zeros(len(rows), dtype=CLAIM_DTYPE)
+    visit_types = [row["Visit Type"] for row in rows]
+    records["fee_cents"] = to_cents([row["Fee ($)"] for row in rows])
+    records["minutes"] = [row.get("Minutes", 0) for row in rows]
+    records["hsc_code"] = encode("hsc_code", [row["HSC Code"] for row in rows])
+    records["visit_type"] = encode("visit_type", visit_types)
+    records["complexity"] = encode("complexity", [None if row["Modifiers"] == "-" else row["Modifiers"]
+                                                  for row in rows])
+    records["base_units"] = [BASE_UNITS[visit_type] for visit_type in visit_types]
+    records["addon_units"] = [_addon_unit_count(row["Add-ons"]) for row in rows]
+    records["virtual"] = virtual
+    return records
+
+
+def redistribute_records(records: np.ndarray, available_units: int) -> np.ndarray:
+    """
+    Claim-record `redistribute_unbilled_units`: spread unbilled 15-minute
+    units as 03.08I add-ons across new and repeat consults.
+
+    Returns:
+        ndarray: new records with addon_units, minutes and fee_cents updated.
+    """
+    addon = FEE_SCHEDULE.addons[ADDON_CODE]
+    unbilled = (available_units - int(records["base_units"].sum(dtype=np.int64))
+                - int(records["addon_units"].sum(dtype=np.int64)))
+
+    eligible_codes = [RECORD_VISIT_TYPES.index(visit_type) for visit_type in ADDON_ELIGIBLE]
+    eligible = np.isin(records["visit_type"], eligible_codes)
+    current = records["addon_units"][eligible].astype(np.int64)
+    added = spread_units(current, unbilled, addon.max_units) - current
+
+    result = records.copy()
+    result["addon_units"][eligible] = current + added
+    result["minutes"][eligible] += (added * addon.unit_minutes).astype(np.uint16)
+    result["fee_cents"][eligible] += (added * to_cents(addon.unit_fee)).astype(np.int32)
+    return result
@@ -0,0 +1,225 @@
+"""
+Per-patient claims-history index for frequency-limit eligibility checks.
+
+Enforces the rules in billing_rules.yaml against a history of submitted
+claims: 03.08A/03.08CV once per 365 days per patient per physician, 13.99OA
+once per 7-day period, and no 03.08CV on a day the patient has another
+virtual claim. Each rule keeps its history as one sorted int64 array of
+(patient key, service day) composites, so a single check is a binary search
+and a whole batch is one vectorized `searchsorted`.
+"""
+
+import numpy as np
+import pandas as pd
+
+from billing_rules import BILLING_RULES
+
+# Composite layout: key code in the high bits, offset day number in the low 32
+_DAY_BITS = 32
+_DAY_OFFSET = 1 << 31
+_DAY_MASK = (1 << _DAY_BITS) - 1
+_EPOCH = pd.Timestamp("1970-01-01")
+
+
+def day_numbers(dates) -> np.ndarray:
+    """Dates (strings, datetime or datetime64) as int64 days since 1970-01-01."""
+    return pd.to_datetime(np.asarray(dates)).values.astype("datetime64[D]").astype(np.int64)
+
+
+def _normalize(claims: pd.DataFrame, virtual_codes) -> pd.DataFrame:
+    frame = pd.DataFrame({
+        "physician_id": claims["physician_id"].to_numpy(),
+        "patient_id": claims["patient_id"].to_numpy(),
+        "day": day_numbers(claims["service_date"]),
+        "hsc_code": claims["hsc_code"].astype(str).to_numpy(),
+    })
+    flagged = claims["virtual"].fillna(False).to_numpy(dtype=bool) if "virtual" in claims else False
+    frame["virtual"] = frame["hsc_code"].isin(virtual_codes).to_numpy() | flagged
+    return frame
+
+
+def _keys(frame: pd.DataFrame, per_physician: bool):
+    if per_physician:
+        return pd.MultiIndex.from_arrays([frame["physician_id"], frame["patient_id"]])
+    return pd.Index(frame["patient_id"])
+
+
+def _composite(key_codes: np.ndarray, days: np.ndarray) -> np.ndarray:
+    return (key_codes.astype(np.int64) << _DAY_BITS) | (days + _DAY_OFFSET)
+
+
+class _SortedHistory:
+    """Sorted (key, day) composites for one rule, with the key lookup."""
+
+    def __init__(self, keys, days: np.ndarray):
+        codes, self.uniques = pd.factorize(keys)
+        self.composite = np.sort(_composite(codes, days))
+
+    def codes(self, keys) -> np.ndarray:
+        return self.uniques.get_indexer(keys) if len(self.uniques) else np.full(len(keys), -1)
+
+    def code(self, key) -> int:
+        try:
+            return int(self.uniques.get_loc(key))
+        except KeyError:
+            return -1
+
+    def nearest_within(self, key_codes: np.ndarray, days: np.ndarray, window: int):
+        """
+        For each query, whether a history claim with the same key lies less than
+        `window` days away (either side), and that claim's day.
+        """
+        hit = np.zeros(len(key_codes), dtype=bool)
+        hit_day = np.zeros(len(key_codes), dtype=np.int64)
+        n = len(self.composite)
+        if n == 0:
+            return hit, hit_day
+
+        query = _composite(np.maximum(key_codes, 0), days)
+        i = np.searchsorted(self.composite, query, side="right")
+        before = self.composite[np.maximum(i - 1, 0)]
+        after = self.composite[np.minimum(i, n - 1)]
+        known = key_codes >= 0
+        before_hit = known & (i > 0) & (before >> _DAY_BITS == key_codes) & (query - before < window)
+        after_hit = known & (i < n) & (after >> _DAY_BITS == key_codes) & (after - query < window)
+
+        hit = before_hit | after_hit
+        hit_day = (np.where(before_hit, before, after) & _DAY_MASK) - _DAY_OFFSET
+        return hit, hit_day
+
+    def count_on(self, key_codes: np.ndarray, days: np.ndarray) -> np.ndarray:
+        """History claims with the same key on exactly the same day."""
+        if len(self.composite) == 0:
+            return np.zeros(len(key_codes), dtype=np.int64)
+        query = _composite(np.maximum(key_codes, 0), days)
+        count = np.searchsorted(self.composite, query, side="right") - np.searchsorted(self.composite, query)
+        return np.where(key_codes >= 0, count, 0)
+
+
+class ClaimsHistory:
+    """
+    In-memory index of historical claims answering "is this claim eligible
+    on this date?" in O(log n), and validating whole batches in one pass.
+
+    Parameters:
+        claims (DataFrame): Columns physician_id, patient_id, service_date,
+            hsc_code and optionally virtual (TELES-billed).
+        rules (dict): Parsed billing rules, defaults to billing_rules.yaml.
+    """
+
+    def __init__(self, claims: pd.DataFrame = None, rules: dict = None):
+        self.rules = rules or BILLING_RULES
+        self.virtual_codes = tuple(self.rules.get("virtual_codes", ()))
+        self._claims = pd.DataFrame(columns=["physician_id", "patient_id", "day", "hsc_code", "virtual"])
+        self._build()
+        if claims is not None:
+            self.add(claims)
+
+    def __len__(self):
+        return len(self._claims)
+
+    def add(self, claims: pd.DataFrame):
+        """Add claims to the history and rebuild the sorted indexes (O(n log n))."""
+        frame = _normalize(claims, self.virtual_codes)
+        self._claims = frame if self._claims.empty else pd.concat([self._claims, frame], ignore_index=True)
+        self._build()
+
+    def _build(self):
+        claims = self._claims
+        self._frequency = {}
+        for name, limit in self.rules.get("frequency_limits", {}).items():
+            rows = claims[claims["hsc_code"].isin(limit["codes"])]
+            self._frequency[name] = _SortedHistory(_keys(rows, limit.get("per_physician", False)),
+                                                   rows["day"].to_numpy(dtype=np.int64))
+        virtual = claims[claims["virtual"].astype(bool)]
+        self._virtual = _SortedHistory(_keys(virtual, False), virtual["day"].to_numpy(dtype=np.int64))
+
+    def is_eligible(self, physician_id, patient_id, service_date, hsc_code: str) -> tuple:
+        """
+        Check one claim against the history, without building a batch.
+
+        Returns:
+            (bool, str): eligibility and the reason it is not eligible (None if it is).
+        """
+        day = np.array([(pd.Timestamp(service_date).normalize() - _EPOCH).days], dtype=np.int64)
+
+        for name, limit in self.rules.get("frequency_limits", {}).items():
+            if hsc_code not in limit["codes"]:
+                continue
+            history = self._frequency[name]
+            key = (physician_id, patient_id) if limit.get("per_physician", False) else patient_id
+            hit, hit_day = history.nearest_within(np.array([history.code(key)]), day, int(limit["days"]))
+            if hit[0]:
+                return False, f"{limit['description']} (conflicts with {np.datetime64(int(hit_day[0]), 'D')})"
+
+        for name, exclusion in self.rules.get("same_day_virtual_exclusions", {}).items():
+            if hsc_code == exclusion["code"] and self._virtual.count_on(np.array([self._virtual.code(patient_id)]), day)[0]:
+                return False, exclusion["description"]
+
+        return True, None
+
+    def validate(self, submissions: pd.DataFrame) -> pd.DataFrame:
+        """
+        Validate a day's or month's submissions against the history and
+        against each other. Within the batch, claims are taken in date order
+        and a claim only blocks later ones if it was itself eligible.
+
+        Parameters:
+            submissions (DataFrame): Same columns as the history.
+
+        Returns:
+            DataFrame: copy of submissions with eligible (bool) and reason columns.
+        """
+        batch = _normalize(submissions, self.virtual_codes)
+        days = batch["day"].to_numpy(dtype=np.int64)
+        eligible = np.ones(len(batch), dtype=bool)
+        reason = np.full(len(batch), None, dtype=object)
+
+        # Exclusions first, so a claim they reject cannot block later ones below
+        for name, exclusion in self.rules.get("same_day_virtual_exclusions", {}).items():
+            rows = np.flatnonzero((batch["hsc_code"] == exclusion["code"]).to_numpy() & eligible)
+            if rows.size == 0:
+                continue
+            patient_keys = pd.Index(batch["patient_id"].iloc[rows])
+            in_history = self._virtual.count_on(self._virtual.codes(patient_keys), days[rows])
+
+            virtual_rows = batch[batch["virtual"]]
+            same_day = virtual_rows.groupby(["patient_id", "day"]).size()
+            in_batch = same_day.reindex(pd.MultiIndex.from_arrays([patient_keys, days[rows]])).fillna(0).to_numpy()
+            # The claim itself is virtual and counted in its own batch group
+            others = in_history + in_batch - batch["virtual"].to_numpy()[rows]
+
+            blocked = rows[others > 0]
+            eligible[blocked] = False
+            reason[blocked] = exclusion["description"]
+
+        for name, limit in self.rules.get("frequency_limits", {}).items():
+            history = self._frequency[name]
+            window = int(limit["days"])
+            rows = np.flatnonzero(batch["hsc_code"].isin(limit["codes"]).to_numpy() & eligible)
+            if rows.size == 0:
+                continue
+            keys = _keys(batch.iloc[rows], limit.get("per_physician", False))
+            hit, hit_day = history.nearest_within(history.codes(keys), days[rows], window)
+
+            # Same key more than once in the batch: accept greedily in date order
+            batch_codes, _ = pd.factorize(keys)
+            repeated = pd.Series(batch_codes).duplicated(keep=False).to_numpy()
+            last_accepted = {}
+            for j in sorted(np.flatnonzero(repeated), key=lambda j: (batch_codes[j], days[rows[j]], j)):
+                previous = last_accepted.get(batch_codes[j])
+                if not hit[j] and previous is not None and days[rows[j]] - previous < window:
+                    hit[j] = True
+                    hit_day[j] = previous
+                if not hit[j]:
+                    last_accepted[batch_codes[j]] = days[rows[j]]
+
+            blocked = rows[hit]
+            eligible[blocked] = False
+            conflict_dates = np.array(hit_day[hit], dtype="datetime64[D]").astype(str)
+            reason[blocked] = [f"{limit['description']} (conflicts with {d})" for d in conflict_dates]
+
+        result = submissions.copy()
+        result["eligible"] = eligible
+        result["reason"] = reason
+        return result
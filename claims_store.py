@@ -0,0 +1,304 @@
+"""
+Embedded SQLite store for optimized clinics and their claims.
+
+Every clinic plan the app produces can be saved with its per-patient claim
+lines, so revenue and utilisation can be reported on later. Claim lines are
+indexed on (physician_id, patient_id, service_date, hsc_code) and on
+service_date, bulk inserts run as batched executemany calls inside one
+transaction, and the reports are fixed parameterized statements that
+sqlite3 keeps compiled in its statement cache.
+
+Amounts are stored as integer cents. uplift_cents is the part of fee_cents
+that comes from the RRNP uplift (0 for claims billed without it).
+"""
+
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+from billing_breakdown import build_breakdown
+
+CLAIMS_DB_PATH = os.environ.get("NEPHBILL_CLAIMS_DB",
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), "claims.db"))
+
+INSERT_BATCH_SIZE = 10_000
+
+CLAIM_COLUMNS = ("clinic_id", "physician_id", "patient_id", "service_date", "hsc_code", "visit_type",
+                 "complexity", "minutes", "base_units", "addon_units", "fee_cents", "uplift_cents")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS clinics (
+    clinic_id       INTEGER PRIMARY KEY,
+    physician_id    TEXT NOT NULL,
+    service_date    TEXT NOT NULL,
+    clinic_hours    REAL NOT NULL,
+    virtual         INTEGER NOT NULL,
+    apply_rrnp      INTEGER NOT NULL,
+    time_of_day     TEXT,
+    available_units INTEGER NOT NULL,
+    billed_units    INTEGER NOT NULL,
+    total_cents     INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS clinics_by_physician_date ON clinics (physician_id, service_date);
+CREATE INDEX IF NOT EXISTS clinics_by_date ON clinics (service_date);
+
+CREATE TABLE IF NOT EXISTS claims (
+    claim_id     INTEGER PRIMARY KEY,
+    clinic_id    INTEGER REFERENCES clinics (clinic_id),
+    physician_id TEXT NOT NULL,
+    patient_id   TEXT,
+    service_date TEXT NOT NULL,
+    hsc_code     TEXT NOT NULL,
+    visit_type   TEXT,
+    complexity   TEXT,
+    minutes      INTEGER NOT NULL,
+    base_units   INTEGER NOT NULL,
+    addon_units  INTEGER NOT NULL,
+    fee_cents    INTEGER NOT NULL,
+    uplift_cents INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS claims_lookup ON claims (physician_id, patient_id, service_date, hsc_code);
+CREATE INDEX IF NOT EXISTS claims_by_date ON claims (service_date);
+
+-- Daily rollup kept in step with claims, so reports group thousands of rows, not millions
+CREATE TABLE IF NOT EXISTS daily_code_totals (
+    physician_id   TEXT NOT NULL,
+    service_date   TEXT NOT NULL,
+    hsc_code       TEXT NOT NULL,
+    claims         INTEGER NOT NULL,
+    revenue_cents  INTEGER NOT NULL,
+    uplift_claims  INTEGER NOT NULL,
+    uplift_cents   INTEGER NOT NULL,
+    PRIMARY KEY (physician_id, service_date, hsc_code)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS daily_code_totals_by_date ON daily_code_totals (service_date);
+"""
+
+_INSERT_CLINIC = """
+INSERT INTO clinics (physician_id, service_date, clinic_hours, virtual, apply_rrnp, time_of_day,
+                     available_units, billed_units, total_cents)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_INSERT_CLAIM = f"""
+INSERT INTO claims ({", ".join(CLAIM_COLUMNS)})
+VALUES ({", ".join("?" for _ in CLAIM_COLUMNS)})
+"""
+
+_UPSERT_TOTALS = """
+INSERT INTO daily_code_totals (physician_id, service_date, hsc_code, claims, revenue_cents, uplift_claims, uplift_cents)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (physician_id, service_date, hsc_code) DO UPDATE SET
+    claims = claims + excluded.claims,
+    revenue_cents = revenue_cents + excluded.revenue_cents,
+    uplift_claims = uplift_claims + excluded.uplift_claims,
+    uplift_cents = uplift_cents + excluded.uplift_cents
+"""
+
+# Reports. Physician and date filters are optional: a NULL parameter matches everything.
+_FILTER = """
+(:physician_id IS NULL OR physician_id = :physician_id)
+AND (:start IS NULL OR service_date >= :start)
+AND (:end IS NULL OR service_date <= :end)
+"""
+
+_REVENUE_BY_CODE_MONTH = f"""
+SELECT substr(service_date, 1, 7) AS month, hsc_code, SUM(claims) AS claims, SUM(revenue_cents) AS revenue_cents
+FROM daily_code_totals
+WHERE {_FILTER}
+GROUP BY month, hsc_code
+ORDER BY month, hsc_code
+"""
+
+_UNBILLED_TREND = f"""
+SELECT substr(service_date, 1, 7) AS month, COUNT(*) AS clinics,
+       SUM(available_units) AS available_units, SUM(billed_units) AS billed_units,
+       SUM(available_units - billed_units) AS unbilled_units
+FROM clinics
+WHERE {_FILTER}
+GROUP BY month
+ORDER BY month
+"""
+
+_RRNP_UPLIFT = f"""
+SELECT substr(service_date, 1, 7) AS month, physician_id,
+       SUM(uplift_claims) AS uplifted_claims, SUM(uplift_cents) AS uplift_cents
+FROM daily_code_totals
+WHERE {_FILTER}
+GROUP BY month, physician_id
+HAVING SUM(uplift_cents) > 0
+ORDER BY month, physician_id
+"""
+
+
+# Claim lines with the clinic settings they were priced under, for repricing.
+# Claims inserted without a clinic count as in-person, daytime, and RRNP when they carry an uplift.
+_CLAIM_LINES = """
+SELECT c.service_date, c.physician_id, c.hsc_code, c.complexity, c.addon_units, c.fee_cents,
+       COALESCE(k.virtual, 0) AS virtual, k.time_of_day, COALESCE(k.apply_rrnp, c.uplift_cents > 0) AS apply_rrnp
+FROM claims AS c LEFT JOIN clinics AS k ON k.clinic_id = c.clinic_id
+WHERE (:physician_id IS NULL OR c.physician_id = :physician_id)
+AND (:start IS NULL OR c.service_date >= :start)
+AND (:end IS NULL OR c.service_date <= :end)
+ORDER BY c.service_date
+"""
+
+def _iso_date(value) -> str:
+    return None if value is None else pd.Timestamp(value).strftime("%Y-%m-%d")
+
+
+def _with_dollars(frame: pd.DataFrame, *cents_columns) -> pd.DataFrame:
+    for column in cents_columns:
+        frame[column.replace("_cents", "")] = frame[column] / 100
+    return frame
+
+
+class ClaimsStore:
+    """
+    SQLite claims database.
+
+    Parameters:
+        path (str): Database file, or ":memory:". Defaults to CLAIMS_DB_PATH.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or CLAIMS_DB_PATH
+        # The app shares one store across its script threads. Transactions
+        # belong to the connection, not the thread, so every use of it holds
+        # the lock; otherwise one session could commit or roll back another's
+        self._lock = threading.RLock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, cached_statements=64)
+        if self.path != ":memory:":
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---- writes ----
+
+    def insert_claims(self, claims: pd.DataFrame, batch_size: int = INSERT_BATCH_SIZE) -> int:
+        """
+        Bulk-insert claim lines in one transaction.
+
+        Parameters:
+            claims (DataFrame): Columns from CLAIM_COLUMNS; physician_id,
+                service_date, hsc_code, minutes, base_units, addon_units and
+                fee_cents are required, the rest default to NULL (uplift_cents to 0).
+            batch_size (int): Rows per executemany call.
+
+        Returns:
+            int: rows inserted.
+        """
+        with self._lock, self.connection:
+            return self._insert_claims(claims, batch_size)
+
+    def _insert_claims(self, claims: pd.DataFrame, batch_size: int = INSERT_BATCH_SIZE) -> int:
+        frame = pd.DataFrame({column: claims[column] if column in claims else None for column in CLAIM_COLUMNS},
+                             index=claims.index)
+        frame["service_date"] = pd.to_datetime(frame["service_date"]).dt.strftime("%Y-%m-%d")
+        frame["uplift_cents"] = frame["uplift_cents"].fillna(0)
+        # Object columns hold plain Python values, which is what sqlite3 binds
+        frame = frame.astype(object).where(frame.notna(), None)
+
+        for start in range(0, len(frame), batch_size):
+            rows = frame.iloc[start:start + batch_size].itertuples(index=False, name=None)
+            self.connection.executemany(_INSERT_CLAIM, rows)
+
+        totals = claims.assign(service_date=frame["service_date"], uplift_cents=frame["uplift_cents"])
+        totals = totals.assign(uplifted=totals["uplift_cents"] > 0).groupby(
+            ["physician_id", "service_date", "hsc_code"], as_index=False).agg(
+            claims=("fee_cents", "size"), revenue_cents=("fee_cents", "sum"),
+            uplift_claims=("uplifted", "sum"), uplift_cents=("uplift_cents", "sum"))
+        self.connection.executemany(_UPSERT_TOTALS, totals.astype(object).itertuples(index=False, name=None))
+        return len(frame)
+
+    def save_clinic(self, physician_id: str, service_date, breakdown: pd.DataFrame, summary: dict,
+                    clinic_hours: float, virtual: bool = False, apply_rrnp: bool = False,
+                    time_of_day: str = None, patient_ids=None) -> int:
+        """
+        Store an optimized clinic and one claim line per patient.
+
+        Parameters:
+            physician_id (str): Billing physician.
+            service_date (date-like): Clinic date.
+            breakdown, summary: Result of optimize_clinic or plan_clinic.
+            clinic_hours (float), virtual (bool), apply_rrnp (bool), time_of_day (str):
+                The settings the clinic was planned with.
+            patient_ids (list): Optional patient id per breakdown row.
+
+        Returns:
+            int: the new clinic_id.
+        """
+        uplift = np.zeros(len(breakdown), dtype=np.int64)
+        if apply_rrnp:
+            surc = np.where(breakdown["visit_type"].astype(str) == "Repeat Consult", time_of_day, None)
+            plain = build_breakdown(breakdown["visit_type"], breakdown["hsc_code"], breakdown["minutes"],
+                                    virtual=virtual, time_of_day=surc)
+            uplift = breakdown["fee_cents"].to_numpy() - plain["fee_cents"].to_numpy()
+
+        with self._lock, self.connection:
+            cursor = self.connection.execute(_INSERT_CLINIC, (
+                physician_id, _iso_date(service_date), float(clinic_hours), int(virtual), int(apply_rrnp),
+                time_of_day, int(summary["available_units"]), int(summary["billed_units"]),
+                int(summary["total_cents"]),
+            ))
+            clinic_id = cursor.lastrowid
+            self._insert_claims(pd.DataFrame({
+                "clinic_id": clinic_id,
+                "physician_id": physician_id,
+                "patient_id": None if patient_ids is None else [str(p) for p in patient_ids],
+                "service_date": _iso_date(service_date),
+                "hsc_code": breakdown["hsc_code"].to_numpy(),
+                "visit_type": breakdown["visit_type"].astype(str).to_numpy(),
+                "complexity": breakdown["complexity"].to_numpy(),
+                "minutes": breakdown["minutes"].to_numpy(),
+                "base_units": breakdown["base_units"].to_numpy(),
+                "addon_units": breakdown["addon_units"].to_numpy(),
+                "fee_cents": breakdown["fee_cents"].to_numpy(),
+                "uplift_cents": uplift,
+            }))
+        return clinic_id
+
+    # ---- reports ----
+
+    def _report(self, sql: str, physician_id=None, start=None, end=None) -> pd.DataFrame:
+        params = {"physician_id": physician_id, "start": _iso_date(start), "end": _iso_date(end)}
+        with self._lock:
+            cursor = self.connection.execute(sql, params)
+            return pd.DataFrame(cursor.fetchall(), columns=[column[0] for column in cursor.description])
+
+    def revenue_by_code_month(self, physician_id: str = None, start=None, end=None) -> pd.DataFrame:
+        """Claims and revenue per month (YYYY-MM) and HSC code."""
+        return _with_dollars(self._report(_REVENUE_BY_CODE_MONTH, physician_id, start, end), "revenue_cents")
+
+    def unbilled_trend(self, physician_id: str = None, start=None, end=None) -> pd.DataFrame:
+        """Available, billed and unbilled 15-minute units per month, with efficiency_pct."""
+        trend = self._report(_UNBILLED_TREND, physician_id, start, end)
+        trend["efficiency_pct"] = trend["billed_units"] / trend["available_units"] * 100
+        return trend
+
+    def rrnp_uplift(self, physician_id: str = None, start=None, end=None) -> pd.DataFrame:
+        """RRNP uplift totals per month and physician."""
+        return _with_dollars(self._report(_RRNP_UPLIFT, physician_id, start, end), "uplift_cents")
+
+    def claim_lines(self, physician_id: str = None, start=None, end=None) -> pd.DataFrame:
+        """
+        Stored claim lines with the virtual, time_of_day and apply_rrnp
+        settings of their clinic, in service-date order.
+        """
+        lines = self._report(_CLAIM_LINES, physician_id, start, end)
+        lines["virtual"] = lines["virtual"].astype(bool)
+        lines["apply_rrnp"] = lines["apply_rrnp"].astype(bool)
+        return lines
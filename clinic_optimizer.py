@@ -0,0 +1,466 @@
+"""
+Revenue-maximizing clinic time allocation.
+
+Splits a clinic's 15-minute units between patients so total billed revenue
+is as high as possible, instead of giving everyone the average time. Each
+patient's fee as a function of units comes from the compiled fee schedule,
+so the CMXC30/CMXV15 thresholds and the 03.08I cap are all respected. The
+allocation is solved exactly as a multiple-choice knapsack: a dynamic
+program over units, vectorized across clinic capacity with NumPy.
+
+`IncrementalPlanner` keeps a solved clinic and updates it as patients,
+hours or settings change, without solving it again from scratch.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+from billing_batch import optimal_billing_strategy_batch
+from billing_breakdown import (BASE_UNITS, VISIT_TYPES, build_breakdown, plan_clinic, rrnp_cents, summarize_breakdown,
+                               to_cents)
+from billing_metrics import instrument
+from claim_record import price_records, records_from_breakdown, records_to_breakdown
+from fee_schedule import FEE_SCHEDULE
+
+UNIT_MINUTES = 15
+
+_UNREACHABLE = np.iinfo(np.int64).min // 4
+
+
+@lru_cache(maxsize=None)
+def fee_curve(hsc_code: str, min_units: int, virtual: bool = False, time_of_day: str = None,
+              apply_rrnp: bool = False) -> tuple:
+    """
+    Fee in cents for a patient seen for min_units, min_units + 1, ... units,
+    up to the point where the add-on cap stops paying for more time.
+
+    Parameters:
+        hsc_code (str): Code priced by optimal_billing_strategy.
+        min_units (int): Fewest 15-minute units the patient is seen for.
+        virtual (bool): Virtual visit.
+        time_of_day (str): SURC code, only used by 03.07B.
+        apply_rrnp (bool): Apply the RRNP uplift.
+
+    Returns:
+        tuple of int: cents, where index i is min_units + i units.
+    """
+    service = FEE_SCHEDULE.codes[hsc_code]
+    addon = FEE_SCHEDULE.addons.get(service.addon)
+    max_minutes = service.strategy_minutes + (addon.max_units * addon.unit_minutes if addon else 0)
+    max_units = max(min_units, max_minutes // UNIT_MINUTES)
+
+    units = np.arange(min_units, max_units + 1)
+    fees = optimal_billing_strategy_batch([hsc_code] * len(units), units * UNIT_MINUTES,
+                                          virtual=virtual, time_of_day=time_of_day)["total_fee"]
+    cents = rrnp_cents(fees) if apply_rrnp else to_cents(fees)
+    return tuple(int(c) for c in cents)
+
+
+def add_patient(best: np.ndarray, min_units: int, curve: tuple, choices: np.ndarray = None) -> np.ndarray:
+    """
+    One knapsack stage: fold a patient into a revenue-by-units table.
+
+    Parameters:
+        best (ndarray): best[..., c] is the top revenue in cents using exactly c
+            units (or unreachable). Leading axes are independent tables.
+        min_units (int): Fewest units the patient is seen for.
+        curve (tuple of int): Fee cents from fee_curve.
+        choices (ndarray): Optional, same shape as best; receives the winning
+            unit count per capacity for a traceback.
+
+    Returns:
+        ndarray: the table with the patient added.
+    """
+    capacity = best.shape[-1] - 1
+    stage = np.full(best.shape, _UNREACHABLE, dtype=np.int64)
+    for offset, fee in enumerate(curve):
+        units = min_units + offset
+        if units > capacity:
+            break
+        candidate = best[..., :capacity + 1 - units] + fee
+        if choices is None:
+            np.maximum(stage[..., units:], candidate, out=stage[..., units:])
+        else:
+            better = candidate > stage[..., units:]
+            stage[..., units:][better] = candidate[better]
+            choices[..., units:][better] = units
+    return stage
+
+
+def empty_table(capacity: int, shape: tuple = ()) -> np.ndarray:
+    """Revenue-by-units table for no patients: $0 at zero units, nothing else reachable."""
+    best = np.full(shape + (capacity + 1,), _UNREACHABLE, dtype=np.int64)
+    best[..., 0] = 0
+    return best
+
+
+@lru_cache(maxsize=256)
+def _solve(patients: tuple, capacity: int) -> tuple:
+    """
+    Exact max-revenue units per patient.
+
+    patients holds (min_units, fee_curve) per patient. best[c] is the top
+    revenue for the patients so far using exactly c units; each patient adds
+    one max-plus stage over its unit choices, and choices[i, c] records the
+    winning choice for the traceback.
+    """
+    capacity = min(capacity, sum(min_units + len(curve) - 1 for min_units, curve in patients))
+    best = empty_table(capacity)
+    choices = np.zeros((len(patients), capacity + 1), dtype=np.int16)
+    for i, (min_units, curve) in enumerate(patients):
+        best = add_patient(best, min_units, curve, choices[i])
+
+    # Fewest units among the max-revenue plans
+    used = int(np.argmax(best))
+    allocation = [0] * len(patients)
+    for i in range(len(patients) - 1, -1, -1):
+        allocation[i] = int(choices[i, used])
+        used -= allocation[i]
+    return tuple(allocation), int(best.max())
+
+
+def _balance(patients: tuple, allocation: list) -> list:
+    """
+    Even out units between identical patients where it costs no revenue,
+    so ties in the knapsack do not leave one patient with all the time.
+    """
+    groups = {}
+    for i, patient in enumerate(patients):
+        groups.setdefault(patient, []).append(i)
+
+    for (min_units, curve), members in groups.items():
+        def fee(units):
+            return curve[units - min_units]
+
+        while True:
+            most = max(members, key=lambda i: allocation[i])
+            least = min(members, key=lambda i: allocation[i])
+            hi, lo = allocation[most], allocation[least]
+            if hi - lo < 2 or fee(hi - 1) + fee(lo + 1) < fee(hi) + fee(lo):
+                break
+            allocation[most] -= 1
+            allocation[least] += 1
+    return allocation
+
+
+def allocate_units(patients, capacity: int) -> tuple:
+    """
+    Split `capacity` 15-minute units between patients for maximum revenue.
+
+    Parameters:
+        patients (list of (int, tuple)): (min_units, fee_curve) per patient.
+        capacity (int): Units available.
+
+    Returns:
+        (list of int, int): units per patient and total revenue in cents.
+
+    Raises:
+        ValueError: if the patients' minimum units do not fit in the capacity (optimize_clinic
+            checks first and prices such clinics with the even split instead).
+    """
+    patients = tuple(patients)
+    needed = sum(min_units for min_units, _ in patients)
+    if needed > capacity:
+        raise ValueError(f"Clinic is too short: patients need at least {needed} units, only {capacity} available.")
+    allocation, total_cents = _solve(patients, capacity)
+    return _balance(patients, list(allocation)), total_cents
+
+
+@instrument("optimize_clinic")
+def optimize_clinic(clinic_hours: float, new_consults: int, repeat_consults: int, follow_ups: int,
+                    virtual: bool = False, apply_rrnp: bool = False, time_of_day: str = None):
+    """
+    Max-revenue clinic plan. Each patient gets at least their base units
+    (30 minutes for a new consult, 15 for repeat consults and follow-ups)
+    and the rest of the clinic's time goes wherever it bills the most.
+    When the base units do not fit, visits have to run shorter than that and
+    the clinic is priced with the `plan_clinic` even split, as before.
+
+    Parameters:
+        clinic_hours (float): Clinic length in hours; multi-day blocks are the summed hours.
+        new_consults, repeat_consults, follow_ups (int): Patient counts.
+        virtual (bool): All visits virtual.
+        apply_rrnp (bool): Apply the RRNP uplift.
+        time_of_day (str): SURC code for repeat consults.
+
+    Returns:
+        (DataFrame, dict): breakdown and its summary, in the same shape as
+        billing_breakdown.plan_clinic.
+    """
+    total_patients = new_consults + repeat_consults + follow_ups
+    if total_patients <= 0:
+        raise ValueError("Total patient count must be greater than 0.")
+
+    available_units = int(round(clinic_hours * 60)) // UNIT_MINUTES
+    needed = (new_consults * BASE_UNITS["New Consult"] + repeat_consults * BASE_UNITS["Repeat Consult"]
+              + follow_ups * BASE_UNITS["Follow-up"])
+    if needed > available_units:
+        return plan_clinic(clinic_hours, new_consults, repeat_consults, follow_ups, virtual=virtual,
+                           apply_rrnp=apply_rrnp, time_of_day=time_of_day)
+
+    new_code = "03.08CV" if virtual else "03.08A"
+    follow_code = "03.03FV" if virtual else "03.03F"
+    visit_types = (
+        ["New Consult"] * new_consults +
+        ["Repeat Consult"] * repeat_consults +
+        ["Follow-up"] * follow_ups
+    )
+    codes = [new_code] * new_consults + ["03.07B"] * repeat_consults + [follow_code] * follow_ups
+    surc = [None] * new_consults + [time_of_day] * repeat_consults + [None] * follow_ups
+
+    patients = [
+        (BASE_UNITS[visit], fee_curve(code, BASE_UNITS[visit], virtual, tod, apply_rrnp))
+        for visit, code, tod in zip(visit_types, codes, surc)
+    ]
+    allocation, _ = allocate_units(patients, available_units)
+    minutes = np.array(allocation, dtype=np.int64) * UNIT_MINUTES
+
+    breakdown = build_breakdown(visit_types, codes, minutes, virtual=virtual, time_of_day=surc,
+                                apply_rrnp=apply_rrnp)
+    breakdown["base_units"] = np.array(allocation, dtype=np.int64) - breakdown["addon_units"].to_numpy()
+
+    summary = summarize_breakdown(breakdown, available_units)
+    summary["avg_time"] = int(minutes.sum()) // total_patients
+    summary["available_units"] = available_units
+    return breakdown, summary
+
+
+def _visit_code(visit_type: str, virtual: bool) -> str:
+    if visit_type == "New Consult":
+        return "03.08CV" if virtual else "03.08A"
+    if visit_type == "Repeat Consult":
+        return "03.07B"
+    return "03.03FV" if virtual else "03.03F"
+
+
+class _VisitGroup:
+    """
+    The patients of one visit type as a stack of knapsack stages: tables[k]
+    is the top revenue by exactly-used units for k of them, and choices[k]
+    the units the k-th patient gets at each width of tables[k].
+    """
+
+    def __init__(self, visit_type: str):
+        self.visit_type = visit_type
+        self.min_units = BASE_UNITS[visit_type]
+        self.code = self.curve = self.menu = None
+        self.tables = [empty_table(0)]
+        self.choices = [None]
+
+    @property
+    def count(self) -> int:
+        return len(self.tables) - 1
+
+    @property
+    def table(self) -> np.ndarray:
+        return self.tables[-1]
+
+    def reprice(self, virtual: bool, apply_rrnp: bool, time_of_day: str) -> bool:
+        """Switch to the fee curve for these settings; False when it is unchanged."""
+        code = _visit_code(self.visit_type, virtual)
+        surc = time_of_day if self.visit_type == "Repeat Consult" else None
+        curve = fee_curve(code, self.min_units, virtual, surc, apply_rrnp)
+        if (code, curve) == (self.code, self.curve):
+            return False
+
+        self.code, self.curve = code, curve
+        # One priced claim record per unit count the curve covers, for the plan
+        units = np.arange(self.min_units, self.min_units + len(curve))
+        self.menu = price_records([code] * len(units), units * UNIT_MINUTES, virtual=virtual, time_of_day=surc,
+                                  apply_rrnp=apply_rrnp, visit_types=[self.visit_type] * len(units))
+        self.menu["base_units"] = units - self.menu["addon_units"]
+        count = self.count
+        del self.tables[1:], self.choices[1:]
+        self.resize(count)
+        return True
+
+    def resize(self, count: int):
+        """Push or pop stages until `count` patients are in the table."""
+        del self.tables[count + 1:], self.choices[count + 1:]
+        while self.count < count:
+            best = np.concatenate([self.table, np.full(self.min_units + len(self.curve) - 1, _UNREACHABLE)])
+            choices = np.zeros(len(best), dtype=np.int16)
+            self.tables.append(add_patient(best, self.min_units, self.curve, choices))
+            self.choices.append(choices)
+
+    def allocation(self, used: int) -> list:
+        """Units per patient in the best plan using exactly `used` units."""
+        allocation = [0] * self.count
+        for i in range(self.count, 0, -1):
+            allocation[i - 1] = int(self.choices[i][used])
+            used -= allocation[i - 1]
+        return _balance(((self.min_units, self.curve),) * self.count, allocation)
+
+
+class IncrementalPlanner:
+    """
+    Max-revenue clinic plan kept up to date as the clinic is edited.
+
+    optimize_clinic solves each clinic from scratch. Here every visit type
+    keeps its own stack of knapsack stages, one per patient, so seeing one
+    more or one fewer patient of a type pushes or pops a single stage. The
+    three types' tables are then merged in VISIT_TYPES order, each merge a
+    max-plus product over units, and the merges are kept so an edit only
+    redoes those from its visit type on. The final table holds the best
+    revenue for every number of units used, so new clinic hours only re-read
+    it. The virtual, RRNP and SURC settings rebuild the stacks of the visit types
+    whose fees they change. Plans have the same revenue and billed units
+    as optimize_clinic's, including its even-split fallback for clinics too
+    short for everyone's base units. The plan is kept as claim records
+    (`records`) and expanded to a breakdown table for display.
+
+    Parameters:
+        clinic_hours (float): Clinic length in hours.
+        new_consults, repeat_consults, follow_ups (int): Patient counts.
+        virtual (bool): All visits virtual.
+        apply_rrnp (bool): Apply the RRNP uplift.
+        time_of_day (str): SURC code for repeat consults.
+    """
+
+    def __init__(self, clinic_hours: float = 0, new_consults: int = 0, repeat_consults: int = 0,
+                 follow_ups: int = 0, virtual: bool = False, apply_rrnp: bool = False, time_of_day: str = None):
+        self.groups = {visit_type: _VisitGroup(visit_type) for visit_type in VISIT_TYPES}
+        self.clinic_hours = clinic_hours
+        self.virtual = virtual
+        self.apply_rrnp = apply_rrnp
+        self.time_of_day = time_of_day
+        for group in self.groups.values():
+            group.reprice(virtual, apply_rrnp, time_of_day)
+        self._merged = []   # [i]: (table for VISIT_TYPES[:i + 1], units VISIT_TYPES[i] gets per width)
+        self._menus = None
+        self._plan = None
+        self.records = None     # claim records of the last plan
+        self.update(clinic_hours, new_consults, repeat_consults, follow_ups, virtual, apply_rrnp, time_of_day)
+
+    @property
+    def counts(self) -> dict:
+        return {visit_type: group.count for visit_type, group in self.groups.items()}
+
+    @property
+    def available_units(self) -> int:
+        return int(round(self.clinic_hours * 60)) // UNIT_MINUTES
+
+    def set_patients(self, visit_type: str, count: int):
+        """See `count` patients of a visit type."""
+        if count < 0:
+            raise ValueError("Patient counts cannot be negative.")
+        group = self.groups[visit_type]
+        if count != group.count:
+            group.resize(count)
+            self._invalidate(VISIT_TYPES.index(visit_type))
+
+    def add(self, visit_type: str, count: int = 1):
+        self.set_patients(visit_type, self.groups[visit_type].count + count)
+
+    def remove(self, visit_type: str, count: int = 1):
+        self.set_patients(visit_type, self.groups[visit_type].count - count)
+
+    def set_hours(self, clinic_hours: float):
+        if clinic_hours != self.clinic_hours:
+            self.clinic_hours = clinic_hours
+            self._plan = None
+
+    def set_settings(self, virtual: bool, apply_rrnp: bool, time_of_day: str = None):
+        """Change the virtual, RRNP and SURC settings."""
+        self.virtual, self.apply_rrnp, self.time_of_day = virtual, apply_rrnp, time_of_day
+        changed = [i for i, group in enumerate(self.groups.values())
+                   if group.reprice(self.virtual, self.apply_rrnp, self.time_of_day)]
+        if changed:
+            self._invalidate(changed[0])
+            self._menus = None
+        # The breakdown carries the settings even where fees did not move
+        self._plan = None
+
+    def update(self, clinic_hours: float, new_consults: int, repeat_consults: int, follow_ups: int,
+               virtual: bool = False, apply_rrnp: bool = False, time_of_day: str = None):
+        """Bring the plan to these inputs, applying only what differs from the current ones."""
+        if (virtual, apply_rrnp, time_of_day) != (self.virtual, self.apply_rrnp, self.time_of_day):
+            self.set_settings(virtual, apply_rrnp, time_of_day)
+        for visit_type, count in zip(VISIT_TYPES, (new_consults, repeat_consults, follow_ups)):
+            self.set_patients(visit_type, count)
+        self.set_hours(clinic_hours)
+
+    def _invalidate(self, index: int):
+        del self._merged[index:]
+        self._plan = None
+
+    def _merge(self) -> np.ndarray:
+        """Redo the merges dropped since the last plan; revenue by units for all visit types."""
+        groups = list(self.groups.values())
+        if not self._merged:
+            self._merged.append((groups[0].table, None))
+        for group in groups[len(self._merged):]:
+            merged = self._merged[-1][0]
+            # Fewer units than everyone's base units are unreachable: skip them
+            first = group.count * group.min_units
+            best = np.concatenate([merged, np.full(len(group.table) - 1, _UNREACHABLE)])
+            choices = np.zeros(len(best), dtype=np.int32)
+            self._merged.append((add_patient(best, first, tuple(group.table[first:].tolist()), choices), choices))
+        return self._merged[-1][0]
+
+    @instrument("incremental_plan")
+    def plan(self):
+        """
+        The current plan.
+
+        Returns:
+            (DataFrame, dict): breakdown and summary, in the same shape as optimize_clinic.
+
+        Raises:
+            ValueError: without patients.
+        """
+        if self._plan is not None:
+            return self._plan
+
+        counts = self.counts
+        total_patients = sum(counts.values())
+        if total_patients <= 0:
+            raise ValueError("Total patient count must be greater than 0.")
+        available_units = self.available_units
+        needed = sum(group.count * group.min_units for group in self.groups.values())
+        if needed > available_units:
+            self._plan = plan_clinic(self.clinic_hours, *counts.values(), virtual=self.virtual,
+                                     apply_rrnp=self.apply_rrnp, time_of_day=self.time_of_day)
+            self.records = records_from_breakdown(self._plan[0], self.virtual, self.time_of_day, self.apply_rrnp)
+            return self._plan
+
+        merged = self._merge()
+        groups = list(self.groups.values())
+        if self._menus is None:
+            self._menus = np.concatenate([group.menu for group in groups])
+        menus = self._menus
+
+        # Fewest units among the max-revenue plans
+        used = int(np.argmax(merged[:available_units + 1]))
+        group_units = [0] * len(groups)
+        for i in range(len(groups) - 1, 0, -1):
+            group_units[i] = int(self._merged[i][1][used])
+            used -= group_units[i]
+        group_units[0] = used
+
+        # One record of the stacked menus per patient; the totals come straight from them
+        rows, cents_by_visit_type, start = [], {}, 0
+        for group, units in zip(groups, group_units):
+            group_rows = start + np.array(group.allocation(units), dtype=np.int64) - group.min_units
+            rows.append(group_rows)
+            cents_by_visit_type[group.visit_type] = int(menus["fee_cents"][group_rows].sum(dtype=np.int64))
+            start += len(group.menu)
+        self.records = menus[np.concatenate(rows)]
+        addon_units = int(self.records["addon_units"].sum(dtype=np.int64))
+        billed_units = sum(group_units)
+
+        breakdown = records_to_breakdown(self.records)
+        summary = {
+            "total_cents": sum(cents_by_visit_type.values()),
+            "cents_by_visit_type": cents_by_visit_type,
+            "base_units": billed_units - addon_units,
+            "addon_units": addon_units,
+            "billed_units": billed_units,
+            "unbilled_units": available_units - billed_units,
+            "efficiency_pct": billed_units / available_units * 100 if available_units else 0.0,
+            "avg_time": billed_units * UNIT_MINUTES // total_patients,
+            "available_units": available_units,
+        }
+        self._plan = breakdown, summary
+        return self._plan
@@ -0,0 +1,211 @@
+"""
+Monte Carlo simulation of clinic revenue with stochastic visit durations.
+
+The clinic plans assume every patient of a type takes the same time. Here
+each simulated day draws, per booked patient, whether they show up and how
+long the visit runs, from a configurable distribution per visit type, and
+prices the visits with the fee schedule's own rules. Every visit type has a
+single HSC code, so its fee for each whole number of minutes is priced once
+with `optimal_billing_strategy_batch` and the simulated visits are a gather
+from that curve. Days are simulated in fixed-size chunks, each with its own
+child seed, so a run is reproducible for a given seed whether the chunks run
+in this process or across a process pool.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from billing_batch import optimal_billing_strategy_batch
+from billing_breakdown import VISIT_TYPES, rrnp_cents, to_cents
+from clinic_optimizer import _visit_code
+from fee_schedule import FEE_SCHEDULE
+
+# Short column prefixes per visit type in the simulated-days table
+VISIT_KEYS = {"New Consult": "new", "Repeat Consult": "repeat", "Follow-up": "follow"}
+
+DISTRIBUTIONS = ("lognormal", "gamma", "normal", "fixed")
+
+SIMULATION_CHUNK_DAYS = 25_000
+# A chunk takes tens of milliseconds in-process; below this many days a
+# process pool costs more to start than it saves
+PARALLEL_MIN_DAYS = 200_000
+
+REVENUE_PERCENTILES = (5, 10, 25, 50, 75, 90, 95)
+
+
+class VisitModel(NamedTuple):
+    """How long one visit type runs, in minutes, and how often patients do not show."""
+    distribution: str = "lognormal"     # one of DISTRIBUTIONS
+    mean: float = 30.0
+    sd: float = 10.0
+    no_show: float = 0.0                # probability a booked patient does not come
+    minimum: int = 5                    # shortest visit
+
+
+DEFAULT_VISIT_MODELS = {
+    "New Consult": VisitModel(mean=45, sd=15, no_show=0.05),
+    "Repeat Consult": VisitModel(mean=25, sd=10, no_show=0.08),
+    "Follow-up": VisitModel(mean=18, sd=7, no_show=0.10),
+}
+
+
+def visit_codes(virtual: bool = False) -> dict:
+    """HSC code per visit type, as plan_clinic bills them."""
+    return {visit_type: _visit_code(visit_type, virtual) for visit_type in VISIT_TYPES}
+
+
+def max_billable_minutes(code: str) -> int:
+    """Longest visit the code pays for; time past the add-on cap earns nothing more."""
+    service = FEE_SCHEDULE.codes[code]
+    if not service.addon:
+        return service.strategy_minutes
+    addon = FEE_SCHEDULE.addons[service.addon]
+    return service.strategy_minutes + (addon.max_units + 1) * addon.unit_minutes - 1
+
+
+def draw_durations(rng: np.random.Generator, model: VisitModel, size) -> np.ndarray:
+    """
+    Whole-minute visit durations, no shorter than model.minimum.
+
+    Lognormal and gamma draws are parameterized by their mean and standard
+    deviation, so every distribution has the mean and sd the model states
+    (before rounding and the minimum).
+    """
+    if model.distribution == "fixed" or model.sd <= 0:
+        minutes = np.full(size, float(model.mean))
+    elif model.distribution == "lognormal":
+        sigma2 = np.log1p((model.sd / model.mean) ** 2)
+        minutes = rng.lognormal(np.log(model.mean) - sigma2 / 2, np.sqrt(sigma2), size)
+    elif model.distribution == "gamma":
+        minutes = rng.gamma((model.mean / model.sd) ** 2, model.sd ** 2 / model.mean, size)
+    elif model.distribution == "normal":
+        minutes = rng.normal(model.mean, model.sd, size)
+    else:
+        raise ValueError(f"Unknown duration distribution {model.distribution!r}, expected one of {DISTRIBUTIONS}")
+    return np.maximum(np.rint(minutes), model.minimum).astype(np.int64)
+
+
+def _fee_curve(code: str, virtual: bool, apply_rrnp: bool, time_of_day: str):
+    """Fee in cents, and whether the complexity modifier applies, for 0..max_billable_minutes(code) minutes."""
+    minutes = np.arange(max_billable_minutes(code) + 1)
+    priced = optimal_billing_strategy_batch(np.full(len(minutes), code, dtype=object), minutes,
+                                            virtual=virtual, time_of_day=time_of_day)
+    fees = rrnp_cents(priced["total_fee"]) if apply_rrnp else to_cents(priced["total_fee"])
+    return fees, pd.notna(priced["complexity"])
+
+
+def _simulate_chunk(task) -> pd.DataFrame:
+    seed, days, counts, models, virtual, apply_rrnp, time_of_day = task
+    rng = np.random.default_rng(seed)
+    codes = visit_codes(virtual)
+
+    columns = {"revenue_cents": np.zeros(days, dtype=np.int64), "minutes": np.zeros(days, dtype=np.int64)}
+    for visit_type, count in zip(VISIT_TYPES, counts):
+        key = VISIT_KEYS[visit_type]
+        if count == 0:
+            columns[f"{key}_seen"] = columns[f"{key}_modifier"] = np.zeros(days, dtype=np.int64)
+            continue
+
+        model = models[visit_type]
+        code = codes[visit_type]
+        surc = time_of_day if visit_type == "Repeat Consult" else None
+        fees, has_modifier = _fee_curve(code, virtual, apply_rrnp, surc)
+
+        shown = rng.random((days, count)) >= model.no_show
+        minutes = draw_durations(rng, model, (days, count))
+        billed = np.minimum(minutes, len(fees) - 1)
+
+        columns["revenue_cents"] += np.where(shown, fees[billed], 0).sum(axis=1)
+        columns["minutes"] += np.where(shown, minutes, 0).sum(axis=1)
+        columns[f"{key}_seen"] = shown.sum(axis=1)
+        columns[f"{key}_modifier"] = (shown & has_modifier[billed]).sum(axis=1)
+
+    return pd.DataFrame(columns)
+
+
+def simulate_clinics(days: int, new_consults: int, repeat_consults: int, follow_ups: int, models: dict = None,
+                     virtual: bool = False, apply_rrnp: bool = False, time_of_day: str = None,
+                     seed: int = 0, workers: int = None) -> pd.DataFrame:
+    """
+    Simulate clinic days with random visit lengths and no-shows.
+
+    Parameters:
+        days (int): Clinic days to simulate.
+        new_consults, repeat_consults, follow_ups (int): Patients booked per day.
+        models (dict): VisitModel per visit type, defaults to DEFAULT_VISIT_MODELS.
+        virtual (bool): All visits virtual.
+        apply_rrnp (bool): Apply the RRNP uplift.
+        time_of_day (str): SURC code for repeat consults.
+        seed (int): Seed for NumPy's random generator.
+        workers (int): Worker processes, defaults to the CPU count. Runs under
+            PARALLEL_MIN_DAYS days stay in this process.
+
+    Returns:
+        DataFrame: one row per day with revenue_cents, revenue, minutes (time
+        spent with patients who came) and, per visit type key in VISIT_KEYS,
+        {key}_seen and {key}_modifier (visits that reached the complexity
+        modifier's minutes).
+    """
+    counts = (new_consults, repeat_consults, follow_ups)
+    if min(counts) < 0 or sum(counts) <= 0:
+        raise ValueError("Total patient count must be greater than 0.")
+    if days < 1:
+        raise ValueError("Clinic days must be at least 1.")
+    models = {**DEFAULT_VISIT_MODELS, **(models or {})}
+
+    sizes = [min(SIMULATION_CHUNK_DAYS, days - start) for start in range(0, days, SIMULATION_CHUNK_DAYS)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(child, size, counts, models, virtual, apply_rrnp, time_of_day) for child, size in zip(seeds, sizes)]
+
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and days >= PARALLEL_MIN_DAYS:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            chunks = list(pool.map(_simulate_chunk, tasks))
+    else:
+        chunks = [_simulate_chunk(task) for task in tasks]
+
+    simulated = pd.concat(chunks, ignore_index=True)
+    simulated.insert(1, "revenue", simulated["revenue_cents"] / 100)
+    return simulated
+
+
+def summarize_simulation(simulated: pd.DataFrame, clinic_hours: float = None, virtual: bool = False) -> dict:
+    """
+    Revenue distribution and complexity-threshold rates of simulated days.
+
+    Parameters:
+        simulated (DataFrame): Result of simulate_clinics.
+        clinic_hours (float): Clinic length, to report how often patient time overruns it.
+        virtual (bool): Whether the days were simulated as virtual (for the HSC codes shown).
+
+    Returns:
+        dict with mean_revenue, revenue_percentiles ({percentile: dollars}),
+        mean_seen, overrun_probability (None without clinic_hours) and
+        thresholds, a DataFrame with one row per visit type seen: hsc_code,
+        modifier, threshold_minutes, visits and hit_rate (share of visits
+        reaching the modifier).
+    """
+    revenue = simulated["revenue"].to_numpy()
+    rows = []
+    for visit_type, code in visit_codes(virtual).items():
+        key = VISIT_KEYS[visit_type]
+        visits = int(simulated[f"{key}_seen"].sum())
+        if visits:
+            service = FEE_SCHEDULE.codes[code]
+            rows.append({"visit_type": visit_type, "hsc_code": code, "modifier": service.strategy_complexity,
+                         "threshold_minutes": service.strategy_minutes, "visits": visits,
+                         "hit_rate": simulated[f"{key}_modifier"].sum() / visits})
+
+    seen = sum(simulated[f"{key}_seen"] for key in VISIT_KEYS.values())
+    return {
+        "mean_revenue": float(revenue.mean()),
+        "revenue_percentiles": dict(zip(REVENUE_PERCENTILES, np.percentile(revenue, REVENUE_PERCENTILES).tolist())),
+        "mean_seen": float(seen.mean()),
+        "overrun_probability": None if clinic_hours is None else float((simulated["minutes"] > clinic_hours * 60).mean()),
+        "thresholds": pd.DataFrame(rows, columns=["visit_type", "hsc_code", "modifier", "threshold_minutes",
+                                                  "visits", "hit_rate"]),
+    }
@@ -0,0 +1,170 @@
+"""
+Weekly 13.99OA dialysis-management revenue forecasts from a census.
+
+The census is a log of events per patient (admissions, transfers between
+physicians, transfers out, deaths, HD <-> PD modality changes). Each event
+sets the patient's state from its date on; the state is laid out as a
+weeks x patients matrix and forward-filled down the weeks, so a multi-year
+forecast for thousands of patients is a handful of array operations.
+
+13.99OA is claimable once per patient per 7-day period, so each forecast
+week holds at most one claim per patient: a patient on dialysis at any point
+in the week is billed once, by the physician responsible for them last that
+week.
+"""
+
+import numpy as np
+import pandas as pd
+
+from billing_breakdown import rrnp_cents, to_cents
+from fee_schedule import FEE_SCHEDULE
+
+DIALYSIS_CODE = "13.99OA"
+MODALITIES = ("HD", "PD")
+
+# Event -> whether the patient is under the program's care afterwards
+EVENT_TYPES = {
+    "admit": True,
+    "transfer": True,           # to another physician in the program
+    "modality_change": True,
+    "transfer_out": False,      # to another program
+    "discharge": False,
+    "death": False,
+}
+
+
+def _week_starts(start, weeks: int) -> pd.DatetimeIndex:
+    return pd.date_range(pd.Timestamp(start).normalize(), periods=weeks, freq="7D")
+
+
+def _census_states(events: pd.DataFrame):
+    """Events in date order with the full state (active, physician, modality) after each."""
+    unknown = set(events["event"]) - set(EVENT_TYPES)
+    if unknown:
+        raise ValueError(f"Unknown census events: {sorted(unknown)}")
+
+    states = events.assign(date=pd.to_datetime(events["date"]).dt.normalize(), order=np.arange(len(events)))
+    states = states.sort_values(["patient_id", "date", "order"], kind="stable").reset_index(drop=True)
+    states["active"] = states["event"].map(EVENT_TYPES).astype(bool)
+
+    # Transfers keep the modality and modality changes keep the physician
+    by_patient = states.groupby("patient_id", sort=False)
+    states["physician_id"] = by_patient["physician_id"].ffill()
+    states["modality"] = by_patient["modality"].ffill()
+
+    bad_modality = states["active"] & ~states["modality"].isin(MODALITIES)
+    missing_physician = states["active"] & states["physician_id"].isna()
+    if bad_modality.any() or missing_physician.any():
+        raise ValueError("Every active census state needs a physician_id and a modality of HD or PD")
+    return states
+
+
+def _fill_down(cells: np.ndarray, weeks: np.ndarray, patients: np.ndarray, values: np.ndarray,
+               initial) -> np.ndarray:
+    """Place each value at (week, patient) and carry it forward to later weeks."""
+    grid = np.full(cells, initial, dtype=values.dtype)
+    has = np.zeros(cells, dtype=bool)
+    grid[weeks, patients] = values
+    has[weeks, patients] = True
+    source = np.where(has, np.arange(cells[0])[:, None], -1)
+    source = np.maximum.accumulate(source, axis=0)
+    filled = grid[np.maximum(source, 0), np.arange(cells[1])]
+    return np.where(source >= 0, filled, initial)
+
+
+def _last_per_cell(weeks: np.ndarray, patients: np.ndarray) -> np.ndarray:
+    """Mask keeping the last event (in date order) per (week, patient) cell."""
+    return ~pd.DataFrame({"week": weeks, "patient": patients}).duplicated(keep="last").to_numpy()
+
+
+def weekly_census(events: pd.DataFrame, start, weeks: int) -> tuple:
+    """
+    Billing physician and modality for every patient and forecast week.
+
+    Parameters:
+        events (DataFrame): Columns patient_id, date, event (see EVENT_TYPES),
+            physician_id (admit/transfer) and modality (admit/modality_change).
+        start (date-like): First day of the first 7-day period.
+        weeks (int): Number of 7-day periods to forecast.
+
+    Returns:
+        (ndarray, ndarray, Index, Index): weeks x patients int arrays of
+        physician codes (-1 when not billable) and modality codes (index into
+        MODALITIES), then the physician ids and patient ids the codes refer to.
+    """
+    states = _census_states(events)
+    patient_codes, patients = pd.factorize(states["patient_id"])
+    physician_codes, physicians = pd.factorize(states["physician_id"])
+    modality_codes = pd.Categorical(states["modality"], categories=MODALITIES).codes.astype(np.int64)
+    active = states["active"].to_numpy()
+
+    week = (states["date"] - pd.Timestamp(start).normalize()).dt.days.to_numpy() // 7
+    in_range = week < weeks
+    state_physician = np.where(active, physician_codes, -1).astype(np.int64)
+    state_modality = np.where(active, modality_codes, 0)
+
+    # State after each week, carried forward. Row 0 holds the state going into
+    # the forecast (everything dated before start), row w + 1 the end of week w.
+    row_week = np.maximum(week, -1) + 1
+    rows = np.flatnonzero(in_range)
+    rows = rows[_last_per_cell(row_week[rows], patient_codes[rows])]
+    cells = (weeks + 1, len(patients))
+    carried_physician = _fill_down(cells, row_week[rows], patient_codes[rows], state_physician[rows], -1)
+    carried_modality = _fill_down(cells, row_week[rows], patient_codes[rows], state_modality[rows], 0)
+
+    # Last active state within each week, so deaths and transfers out mid-week
+    # still leave that week's claim
+    rows = np.flatnonzero(active & in_range & (week >= 0))
+    rows = rows[_last_per_cell(week[rows], patient_codes[rows])]
+    week_physician = np.full((weeks, len(patients)), -1, dtype=np.int64)
+    week_modality = np.zeros((weeks, len(patients)), dtype=np.int64)
+    week_physician[week[rows], patient_codes[rows]] = physician_codes[rows]
+    week_modality[week[rows], patient_codes[rows]] = modality_codes[rows]
+
+    seen_in_week = week_physician >= 0
+    billing_physician = np.where(seen_in_week, week_physician, carried_physician[:-1])
+    modality = np.where(seen_in_week, week_modality, carried_modality[:-1])
+    return billing_physician, modality, pd.Index(physicians), pd.Index(patients)
+
+
+def forecast_dialysis(events: pd.DataFrame, start, weeks: int = 52, apply_rrnp: bool = False) -> pd.DataFrame:
+    """
+    Weekly 13.99OA claims and revenue per physician.
+
+    Parameters:
+        events (DataFrame): Census events, as for weekly_census.
+        start (date-like): First day of the forecast.
+        weeks (int): Number of 7-day periods.
+        apply_rrnp (bool): Apply the RRNP uplift to the 13.99OA fee.
+
+    Returns:
+        DataFrame: one row per week and physician with billed patients, with
+        week_start, physician_id, hd_patients, pd_patients, claims,
+        revenue_cents and revenue (dollars).
+    """
+    fee = FEE_SCHEDULE.codes[DIALYSIS_CODE].base_fee
+    fee_cents = int(rrnp_cents([fee])[0] if apply_rrnp else to_cents([fee])[0])
+
+    physician, modality, physicians, _ = weekly_census(events, start, weeks)
+    billed = physician >= 0
+    week_index = np.broadcast_to(np.arange(weeks)[:, None], physician.shape)[billed]
+    slots = (week_index * len(physicians) + physician[billed]) * len(MODALITIES) + modality[billed]
+    counts = np.bincount(slots, minlength=weeks * len(physicians) * len(MODALITIES))
+    counts = counts.reshape(weeks, len(physicians), len(MODALITIES))
+
+    grid = pd.MultiIndex.from_product([_week_starts(start, weeks), physicians], names=["week_start", "physician_id"])
+    result = grid.to_frame(index=False)
+    result["hd_patients"] = counts[..., MODALITIES.index("HD")].ravel()
+    result["pd_patients"] = counts[..., MODALITIES.index("PD")].ravel()
+    result["claims"] = result["hd_patients"] + result["pd_patients"]
+    result["revenue_cents"] = result["claims"].astype(np.int64) * fee_cents
+    result["revenue"] = result["revenue_cents"] / 100
+    return result[result["claims"] > 0].reset_index(drop=True)
+
+
+def annual_revenue(weekly: pd.DataFrame) -> pd.DataFrame:
+    """Forecast 13.99OA claims and revenue per physician per calendar year of week start."""
+    annual = weekly.assign(year=weekly["week_start"].dt.year).groupby(["year", "physician_id"], as_index=False)[
+        ["claims", "revenue_cents"]].sum()
+    annual["revenue"] = annual["revenue_cents"] / 100
+    return annual
@@ -0,0 +1,157 @@
+"""
+Historical repricing of stored claims under another fee-schedule version.
+
+Every claim line is priced twice, side by side: under the schedule version in
+effect on its service date and under a target version (the latest by
+default). Both come from the schedules FEE_SCHEDULES compiled at import. Each
+claim's version is found with one binary search over the effective dates for
+the whole batch, and each distinct (version, code, complexity, units,
+virtual, SURC, RRNP) combination is priced once and gathered back onto the
+claims, so a year of claims costs a few hundred fee lookups.
+
+Usage:
+    python fee_repricing.py [--start 2024-01-01] [--end 2024-12-31] [--physician P1]
+                            [--as-of 2025-04-01] [--db claims.db] [--output delta.csv]
+"""
+
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+from billing_breakdown import to_cents
+from fee_schedule import FEE_SCHEDULES, FeeSchedule, ScheduleVersions
+
+_PRICE_KEYS = ["hsc_code", "complexity", "addon_units", "virtual", "time_of_day", "apply_rrnp"]
+
+
+def version_index(service_dates, versions: ScheduleVersions = FEE_SCHEDULES) -> np.ndarray:
+    """Position in `versions` of the schedule in effect on each service date."""
+    # A year of claims has a few hundred distinct dates: parse those, not every row
+    codes, dates = pd.factorize(pd.Series(service_dates))
+    starts = np.array(versions.starts, dtype="datetime64[D]")
+    positions = np.searchsorted(starts, pd.to_datetime(dates).to_numpy().astype("datetime64[D]"), side="right") - 1
+    return positions[codes]
+
+
+def _combinations(claims: pd.DataFrame, index=None):
+    """
+    Distinct (schedule position, *_PRICE_KEYS) combinations, and which one
+    each claim has.
+    """
+    # One integer key per claim from the factorized columns (mixed radix), so
+    # finding the distinct combinations is a single np.unique
+    columns = [pd.Series(np.zeros(len(claims), dtype=np.intp) if index is None else index)]
+    columns += [claims[key] for key in _PRICE_KEYS]
+    key = np.zeros(len(claims), dtype=np.int64)
+    factorized = []
+    for values in columns:
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        key = key * len(uniques) + codes
+        factorized.append((codes, list(uniques)))
+    _, first, combination = np.unique(key, return_index=True, return_inverse=True)
+
+    combinations = []
+    for row in first:
+        schedule, code, complexity, units, virtual, time_of_day, apply_rrnp = (
+            uniques[codes[row]] for codes, uniques in factorized)
+        combinations.append((schedule, code, None if pd.isna(complexity) else complexity, int(units),
+                             bool(virtual), None if pd.isna(time_of_day) else time_of_day, bool(apply_rrnp)))
+    return combinations, combination
+
+
+def _claim_fee(schedule: FeeSchedule, code, complexity, units, virtual, time_of_day, apply_rrnp) -> float:
+    try:
+        fee = schedule.lookup(code, complexity, virtual, time_of_day, units)
+    except (KeyError, ValueError):
+        # Code retired or add-on cap lowered: not payable under this version
+        return 0.0
+    return schedule.rrnp_fee(fee) if apply_rrnp else fee
+
+
+def price_claims(claims: pd.DataFrame, schedules, index=None) -> np.ndarray:
+    """
+    Price claim lines, each under its own schedule.
+
+    Parameters:
+        claims (DataFrame): hsc_code, complexity, addon_units, virtual,
+            time_of_day and apply_rrnp per claim (see ClaimsStore.claim_lines).
+        schedules (sequence of FeeSchedule): Schedules to price with.
+        index (array-like of int): Position in `schedules` per claim, all
+            claims use the first schedule when omitted.
+
+    Returns:
+        ndarray: int64 fee cents per claim.
+    """
+    combinations, combination = _combinations(claims, index)
+    return to_cents([_claim_fee(schedules[schedule], *rest) for schedule, *rest in combinations])[combination]
+
+
+def reprice(claims: pd.DataFrame, target=None, versions: ScheduleVersions = FEE_SCHEDULES) -> pd.DataFrame:
+    """
+    Reprice claims under a target schedule next to the schedule in effect on
+    their service dates, summed per HSC code.
+
+    Parameters:
+        claims (DataFrame): service_date plus the price_claims columns.
+        target (FeeSchedule or date-like): Schedule, or the date whose version
+            to reprice under. Defaults to the latest version.
+        versions (ScheduleVersions): Dated schedules, defaults to FEE_SCHEDULES.
+
+    Returns:
+        DataFrame: hsc_code, claims, old_cents, new_cents, delta_cents,
+            delta_pct and the matching dollar columns.
+    """
+    if target is None:
+        target = versions.latest
+    elif not isinstance(target, FeeSchedule):
+        target = versions.at(target)
+
+    index = version_index(claims["service_date"], versions)
+    if (index < 0).any():
+        raise ValueError("Claims predate the first fee schedule version")
+    combinations, combination = _combinations(claims, index)
+    old = to_cents([_claim_fee(versions.schedules[schedule], *rest) for schedule, *rest in combinations])
+    new = to_cents([_claim_fee(target, *rest) for _, *rest in combinations])
+
+    report = pd.DataFrame({"hsc_code": claims["hsc_code"].to_numpy(), "old_cents": old[combination],
+                           "new_cents": new[combination]})
+    report = report.groupby("hsc_code", as_index=False).agg(
+        claims=("old_cents", "size"), old_cents=("old_cents", "sum"), new_cents=("new_cents", "sum"))
+    report["delta_cents"] = report["new_cents"] - report["old_cents"]
+    report["delta_pct"] = report["delta_cents"] / report["old_cents"].where(report["old_cents"] != 0) * 100
+    for column in ("old_cents", "new_cents", "delta_cents"):
+        report[column.replace("_cents", "")] = report[column] / 100
+    return report
+
+
+def main(argv=None) -> int:
+    from claims_store import ClaimsStore
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--start", help="First service date (YYYY-MM-DD)")
+    parser.add_argument("--end", help="Last service date (YYYY-MM-DD)")
+    parser.add_argument("--physician", help="Only this physician's claims")
+    parser.add_argument("--as-of", help="Reprice under the version in effect on this date (default: latest)")
+    parser.add_argument("--db", help="Claims database, defaults to CLAIMS_DB_PATH")
+    parser.add_argument("--output", help="CSV file for the per-code report")
+    args = parser.parse_args(argv)
+
+    with ClaimsStore(args.db) as store:
+        claims = store.claim_lines(args.physician, args.start, args.end)
+    if claims.empty:
+        print("No claims in range")
+        return 0
+
+    report = reprice(claims, args.as_of)
+    if args.output:
+        report.to_csv(args.output, index=False)
+    print(report[["hsc_code", "claims", "old", "new", "delta", "delta_pct"]].to_string(index=False))
+    print(f"Total: ${report['old'].sum():,.2f} -> ${report['new'].sum():,.2f} "
+          f"({report['delta'].sum():+,.2f}) over {len(claims):,} claims")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""
+Declarative NEPH fee schedule.
+
+`fee_schedule.yaml` holds the codes, base rates, complexity modifiers, TELES
+multiplier, RRNP uplift, SURC amounts and add-on unit caps. It is compiled once at import
+into read-only lookup tables, so pricing a visit is a dictionary lookup on
+(code, complexity, virtual, surc, units).
+
+The file's `versions` list records SOMB changes as dated overrides of the base
+rates. Every version is compiled once at import into FEE_SCHEDULES; the one in
+effect on a service date is found by binary search over the effective dates.
+FEE_SCHEDULE is the version in effect today.
+"""
+
+import os
+from bisect import bisect_right
+from datetime import date
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Optional, Tuple
+
+import yaml
+
+FEE_SCHEDULE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fee_schedule.yaml")
+
+
+class AddonCode(NamedTuple):
+    code: str
+    description: str
+    unit_fee: float
+    unit_minutes: int
+    max_units: int
+    teles: bool
+    applies_to: Tuple[str, ...]
+
+
+class ServiceCode(NamedTuple):
+    code: str
+    description: str
+    base_fee: float
+    complexity: Tuple[str, ...]         # complexity modifiers the code accepts
+    teles: bool                         # TELES multiplier applies to the base when virtual
+    surcharge: bool                     # SURC after-hours amounts apply
+    strategy_complexity: Optional[str]  # modifier optimal_billing_strategy applies
+    strategy_minutes: int               # minutes at which that modifier (and the add-on clock) starts
+    addon: Optional[str]                # prolonged-time add-on billed past strategy_minutes
+    info: Mapping                       # remaining descriptive fields (category, notes, ...)
+
+
+class FeeSchedule(NamedTuple):
+    teles_multiplier: float
+    rrnp_uplift: float
+    complexity_fees: Mapping[str, float]
+    complexity_minutes: Mapping[str, int]
+    surcharges: Mapping[str, float]
+    addons: Mapping[str, AddonCode]
+    codes: Mapping[str, ServiceCode]
+    strategy_codes: Tuple[str, ...]     # codes priced by optimal_billing_strategy, in file order
+    fees: Mapping[tuple, float]         # (code, complexity, virtual, surc, units) -> total fee
+    effective_from: date = date.min     # first service date the rates apply to
+
+    def visit_fee(self, code: str, complexity: str = None, virtual: bool = False, time_of_day: str = None) -> float:
+        """
+        Fee for a visit code without add-ons, rounded to the cent.
+        Complexity modifiers the code does not accept are ignored, as are
+        SURC codes on codes that take no surcharge.
+        """
+        service = self.codes[code]
+        fee = service.base_fee
+        if virtual and service.teles:
+            fee *= self.teles_multiplier
+        if complexity in service.complexity:
+            fee += self.complexity_fees[complexity]
+        if service.surcharge and time_of_day in self.surcharges:
+            fee += self.surcharges[time_of_day]
+        return round(fee, 2)
+
+    def addon_fee(self, code: str, units: int, virtual: bool = False) -> float:
+        """Fee for `units` of a prolonged-time add-on, rounded to the cent."""
+        addon = self.addons[code]
+        if not 1 <= units <= addon.max_units:
+            raise ValueError(f"Calls must be between 1 and {addon.max_units}")
+        total = addon.unit_fee * units
+        if virtual and addon.teles:
+            total *= self.teles_multiplier
+        return round(total, 2)
+
+    def rrnp_fee(self, fee: float) -> float:
+        """Fee with the RRNP uplift applied, rounded to the cent."""
+        return round(fee * self.rrnp_uplift, 2)
+
+    def lookup(self, code: str, complexity: str = None, virtual: bool = False, time_of_day: str = None,
+               units: int = 0) -> float:
+        """Precompiled total fee for a visit plus its add-on units."""
+        service = self.codes[code]
+        surc = time_of_day if service.surcharge and time_of_day in self.surcharges else None
+        if complexity not in service.complexity:
+            complexity = None
+        try:
+            return self.fees[(code, complexity, bool(virtual), surc, units)]
+        except KeyError:
+            addon = self.addons.get(service.addon)
+            max_units = addon.max_units if addon else 0
+            raise ValueError(f"Calls must be between 1 and {max_units}") from None
+
+
+class ScheduleVersions(NamedTuple):
+    starts: Tuple[date, ...]            # effective_from of each version, ascending
+    schedules: Tuple[FeeSchedule, ...]
+
+    def index(self, service_date) -> int:
+        """Position of the version in effect on a service date (date, datetime or ISO string)."""
+        return bisect_right(self.starts, _as_date(service_date)) - 1
+
+    def at(self, service_date) -> FeeSchedule:
+        """Compiled schedule in effect on a service date."""
+        return self.schedules[self.index(service_date)]
+
+    @property
+    def latest(self) -> FeeSchedule:
+        return self.schedules[-1]
+
+
+def _as_date(value) -> date:
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    if hasattr(value, "date"):     # datetime and pandas Timestamp
+        return value.date()
+    return value
+
+
+def _merge(base: dict, overrides: dict) -> dict:
+    """Nested copy of base with overrides applied; a null override removes the key."""
+    merged = dict(base)
+    for key, value in overrides.items():
+        if value is None:
+            merged.pop(key, None)
+        elif isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _compile(raw: dict) -> FeeSchedule:
+    complexity_fees = {name: float(m["fee"]) for name, m in raw["complexity_modifiers"].items()}
+    complexity_minutes = {name: int(m["minutes"]) for name, m in raw["complexity_modifiers"].items()}
+    surcharges = {name: float(fee) for name, fee in raw.get("surcharges", {}).items()}
+
+    addons = {
+        code: AddonCode(
+            code=code,
+            description=entry.get("description", ""),
+            unit_fee=float(entry["unit_fee"]),
+            unit_minutes=int(entry.get("unit_minutes", 15)),
+            max_units=int(entry["max_units"]),
+            teles=bool(entry.get("teles", False)),
+            applies_to=tuple(entry.get("applies_to", ())),
+        )
+        for code, entry in raw.get("addons", {}).items()
+    }
+
+    codes = {}
+    for code, entry in raw["codes"].items():
+        entry = dict(entry)
+        strategy = entry.pop("strategy", None) or {}
+        complexity = tuple(entry.pop("complexity", ()))
+        for name in complexity + ((strategy["complexity"],) if strategy else ()):
+            if name not in complexity_fees:
+                raise ValueError(f"{code}: unknown complexity modifier {name!r}")
+        if strategy.get("addon") and strategy["addon"] not in addons:
+            raise ValueError(f"{code}: unknown add-on code {strategy['addon']!r}")
+        if strategy.get("addon") and code not in addons[strategy["addon"]].applies_to:
+            # The conflict rules take the add-on's base codes from applies_to
+            raise ValueError(f"{code}: add-on {strategy['addon']} does not list it under applies_to")
+        codes[code] = ServiceCode(
+            code=code,
+            description=entry.pop("description", ""),
+            base_fee=float(entry.pop("base_fee")),
+            complexity=complexity,
+            teles=bool(entry.pop("teles", False)),
+            surcharge=bool(entry.pop("surcharge", False)),
+            strategy_complexity=strategy.get("complexity"),
+            strategy_minutes=complexity_minutes[strategy["complexity"]] if strategy else 0,
+            addon=strategy.get("addon"),
+            info=MappingProxyType(entry),
+        )
+
+    schedule = FeeSchedule(
+        teles_multiplier=float(raw["teles_multiplier"]),
+        rrnp_uplift=float(raw.get("rrnp_uplift", 1.0)),
+        complexity_fees=MappingProxyType(complexity_fees),
+        complexity_minutes=MappingProxyType(complexity_minutes),
+        surcharges=MappingProxyType(surcharges),
+        addons=MappingProxyType(addons),
+        codes=MappingProxyType(codes),
+        strategy_codes=tuple(code for code, s in codes.items() if s.strategy_complexity),
+        fees=MappingProxyType({}),
+    )
+
+    # Every reachable combination, so pricing never branches on the rules again
+    fees = {}
+    for service in codes.values():
+        addon = addons.get(service.addon)
+        max_units = addon.max_units if addon else 0
+        for complexity in (None,) + service.complexity:
+            for virtual in (False, True):
+                for surc in (None,) + (tuple(surcharges) if service.surcharge else ()):
+                    visit = schedule.visit_fee(service.code, complexity, virtual, surc)
+                    fees[(service.code, complexity, virtual, surc, 0)] = visit
+                    for units in range(1, max_units + 1):
+                        total = visit + schedule.addon_fee(addon.code, units, virtual)
+                        fees[(service.code, complexity, virtual, surc, units)] = round(total, 2)
+
+    return schedule._replace(fees=MappingProxyType(fees))
+
+
+def load_fee_schedule_versions(path: str = FEE_SCHEDULE_PATH) -> ScheduleVersions:
+    """
+    Load a fee-schedule YAML file and compile every dated version of it.
+
+    The top-level rates apply to all service dates before the first version.
+    Each entry of `versions` holds an `effective_from` date plus overrides of
+    the top-level keys, applied on top of the previous version.
+
+    Parameters:
+        path (str): Fee-schedule file, defaults to fee_schedule.yaml next to this module.
+
+    Returns:
+        ScheduleVersions: compiled schedules in effective-date order.
+    """
+    with open(path) as file:
+        # libyaml's loader parses several times faster, which matters for CLI cold starts
+        raw = yaml.load(file, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+    versions = raw.pop("versions", None) or []
+
+    starts, schedules = [date.min], [_compile(raw)]
+    for version in versions:
+        version = dict(version)
+        effective_from = _as_date(version.pop("effective_from"))
+        if effective_from <= starts[-1]:
+            raise ValueError(f"Fee schedule versions must have increasing effective_from dates ({effective_from})")
+        raw = _merge(raw, version)
+        starts.append(effective_from)
+        schedules.append(_compile(raw)._replace(effective_from=effective_from))
+    return ScheduleVersions(starts=tuple(starts), schedules=tuple(schedules))
+
+
+def load_fee_schedule(path: str = FEE_SCHEDULE_PATH, service_date=None) -> FeeSchedule:
+    """
+    Load and compile a fee-schedule YAML file.
+
+    Parameters:
+        path (str): Fee-schedule file, defaults to fee_schedule.yaml next to this module.
+        service_date (date-like): Return the version in effect on this date, defaults to today.
+
+    Returns:
+        FeeSchedule: immutable compiled schedule.
+    """
+    return load_fee_schedule_versions(path).at(service_date or date.today())
+
+
+FEE_SCHEDULES = load_fee_schedule_versions()
+FEE_SCHEDULE = FEE_SCHEDULES.at(date.today())
@@ -0,0 +1,245 @@
+"""
+Month-end clinic optimization for every physician in the group.
+
+The app plans one clinic for whoever is logged in. Here a table of clinic
+sessions, any number of physicians over a month, each session with its own
+hours, patient mix, virtual flag, SURC window and RRNP eligibility, is
+optimized in one batch with `optimize_clinic`. Identical sessions are solved
+once. The distinct ones are dealt to a process pool in chunks, so each
+worker warms its fee-curve and knapsack caches on a run of clinics instead
+of one clinic per round trip. The per-session results are then merged into
+per-physician and group revenue and efficiency reports.
+
+Usage:
+    python physician_batch.py sessions.csv [--physicians physicians.csv] [--config config.yaml]
+                                           [--workers 4] [--output sessions_out.csv]
+
+Session columns: physician_id, clinic_hours, new_consults, repeat_consults,
+follow_ups, and optionally service_date, virtual, time_of_day and apply_rrnp.
+Physician columns: physician_id and optionally name and apply_rrnp, which is
+used for sessions that do not say.
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from billing_breakdown import VISIT_TYPES
+from clinic_optimizer import UNIT_MINUTES, optimize_clinic
+
+SESSION_KEYS = ["clinic_hours", "new_consults", "repeat_consults", "follow_ups", "virtual", "apply_rrnp",
+                "time_of_day"]
+
+# Distinct clinics per task sent to a worker
+CLINIC_CHUNK = 32
+# optimize_clinic takes a few milliseconds; below this many distinct clinics
+# starting a process pool costs more than it saves
+PARALLEL_MIN_CLINICS = 100
+
+_RESULT_COLUMNS = ["total_cents", "available_units", "billed_units", "base_units", "addon_units",
+                   "new_cents", "repeat_cents", "follow_cents", "error"]
+
+_TRUE_STRINGS = {"true", "t", "1", "yes", "y"}
+
+
+class GroupReport(NamedTuple):
+    sessions: pd.DataFrame      # one row per input session with its optimized totals
+    physicians: pd.DataFrame    # one row per physician
+    group: dict                 # totals over every physician
+
+
+def _flag(values: pd.Series) -> pd.Series:
+    if values.dtype == bool:
+        return values
+    return values.astype(str).str.strip().str.lower().isin(_TRUE_STRINGS)
+
+
+def _read_sessions(sessions: pd.DataFrame, physicians: pd.DataFrame = None) -> pd.DataFrame:
+    sessions = sessions.reset_index(drop=True).copy()
+    for column in ("new_consults", "repeat_consults", "follow_ups"):
+        sessions[column] = sessions[column].fillna(0).astype(np.int64)
+    sessions["clinic_hours"] = sessions["clinic_hours"].astype(float)
+    sessions["virtual"] = _flag(sessions["virtual"]) if "virtual" in sessions else False
+
+    # A session's own RRNP flag wins over its physician's eligibility
+    rrnp = sessions["apply_rrnp"] if "apply_rrnp" in sessions else pd.Series(None, index=sessions.index)
+    if physicians is not None and "apply_rrnp" in physicians:
+        eligible = _flag(physicians.set_index("physician_id")["apply_rrnp"])
+        rrnp = rrnp.astype(object).where(rrnp.notna(), sessions["physician_id"].map(eligible))
+    sessions["apply_rrnp"] = _flag(rrnp.astype(object).where(rrnp.notna(), False))
+
+    time_of_day = sessions["time_of_day"] if "time_of_day" in sessions else pd.Series(None, index=sessions.index)
+    sessions["time_of_day"] = time_of_day.astype(object).where(time_of_day.notna() & (time_of_day != ""), None)
+    return sessions
+
+
+def _optimize(clinic: tuple) -> tuple:
+    hours, new, repeat, follow, virtual, apply_rrnp, time_of_day = clinic
+    if hours is None or not np.isfinite(hours):
+        return (0, 0, 0, 0, 0, 0, 0, 0, "Missing clinic hours")
+    try:
+        _, summary = optimize_clinic(hours, new, repeat, follow, virtual=virtual, apply_rrnp=apply_rrnp,
+                                     time_of_day=time_of_day)
+    except ValueError as exc:
+        # Too many patients for the hours, or none at all: report it on the session
+        return (0, int(round(hours * 60)) // UNIT_MINUTES, 0, 0, 0, 0, 0, 0, str(exc))
+    by_type = summary["cents_by_visit_type"]
+    return (summary["total_cents"], summary["available_units"], summary["billed_units"], summary["base_units"],
+            summary["addon_units"], *(by_type[visit_type] for visit_type in VISIT_TYPES), None)
+
+
+def _optimize_chunk(clinics: list) -> list:
+    return [_optimize(clinic) for clinic in clinics]
+
+
+def optimize_sessions(sessions: pd.DataFrame, physicians: pd.DataFrame = None, workers: int = None) -> pd.DataFrame:
+    """
+    Optimize every clinic session.
+
+    Parameters:
+        sessions (DataFrame): One row per session (see the module docstring).
+        physicians (DataFrame): Optional physician_id and apply_rrnp eligibility.
+        workers (int): Worker processes, defaults to the CPU count. Batches
+            under PARALLEL_MIN_CLINICS distinct clinics stay in this process.
+
+    Returns:
+        DataFrame: the sessions with total_cents, revenue, available_units,
+        billed_units, base_units, addon_units, efficiency_pct, cents per
+        visit type (new_cents, repeat_cents, follow_cents) and error (why a
+        session could not be planned, else None).
+    """
+    sessions = _read_sessions(sessions, physicians)
+    keys = sessions[SESSION_KEYS].astype(object).where(sessions[SESSION_KEYS].notna(), None)
+    clinics = list(dict.fromkeys(keys.itertuples(index=False, name=None)))
+
+    chunks = [clinics[start:start + CLINIC_CHUNK] for start in range(0, len(clinics), CLINIC_CHUNK)]
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(clinics) >= PARALLEL_MIN_CLINICS:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            solved = [result for chunk in pool.map(_optimize_chunk, chunks) for result in chunk]
+    else:
+        solved = [result for chunk in chunks for result in _optimize_chunk(chunk)]
+
+    position = {clinic: i for i, clinic in enumerate(clinics)}
+    rows = [position[key] for key in keys.itertuples(index=False, name=None)]
+    results = pd.DataFrame(solved, columns=_RESULT_COLUMNS).iloc[rows].reset_index(drop=True)
+    optimized = pd.concat([sessions, results], axis=1)
+    optimized["revenue"] = optimized["total_cents"] / 100
+    optimized["efficiency_pct"] = (optimized["billed_units"] / optimized["available_units"].where(
+        optimized["available_units"] > 0) * 100).fillna(0.0)
+    return optimized
+
+
+def _report(optimized: pd.DataFrame, by=None) -> pd.DataFrame:
+    frame = optimized.assign(
+        patients=optimized["new_consults"] + optimized["repeat_consults"] + optimized["follow_ups"],
+        planned=optimized["error"].isna(),
+        planned_hours=optimized["clinic_hours"].where(optimized["error"].isna(), 0.0),
+        planned_units=optimized["available_units"].where(optimized["error"].isna(), 0),
+        virtual_sessions=optimized["virtual"].astype(np.int64),
+        rrnp_sessions=optimized["apply_rrnp"].astype(np.int64),
+    )
+    aggregations = dict(
+        sessions=("clinic_hours", "size"),
+        planned_sessions=("planned", "sum"),
+        virtual_sessions=("virtual_sessions", "sum"),
+        rrnp_sessions=("rrnp_sessions", "sum"),
+        patients=("patients", "sum"),
+        clinic_hours=("clinic_hours", "sum"),
+        available_units=("available_units", "sum"),
+        planned_hours=("planned_hours", "sum"),
+        planned_units=("planned_units", "sum"),
+        billed_units=("billed_units", "sum"),
+        addon_units=("addon_units", "sum"),
+        total_cents=("total_cents", "sum"),
+        new_cents=("new_cents", "sum"),
+        repeat_cents=("repeat_cents", "sum"),
+        follow_cents=("follow_cents", "sum"),
+    )
+    if by is None:
+        report = frame.assign(group="all").groupby("group").agg(**aggregations).reset_index(drop=True)
+    else:
+        report = frame.groupby(by, as_index=False, sort=True).agg(**aggregations)
+    # Sessions that could not be planned bill nothing, so the ratios are over planned sessions only
+    report["unbilled_units"] = report["planned_units"] - report["billed_units"]
+    report["efficiency_pct"] = (report["billed_units"] / report["planned_units"].where(
+        report["planned_units"] > 0) * 100).fillna(0.0)
+    report["revenue"] = report["total_cents"] / 100
+    report["revenue_per_hour"] = report["revenue"] / report["planned_hours"].where(report["planned_hours"] > 0)
+    return report
+
+
+def optimize_group(sessions: pd.DataFrame, physicians: pd.DataFrame = None, workers: int = None) -> GroupReport:
+    """
+    Optimize a month of clinic sessions for the whole group and report revenue
+    and efficiency per physician and for the group.
+
+    Parameters:
+        sessions, physicians, workers: as optimize_sessions. A physician name
+            column is carried into the per-physician report.
+
+    Returns:
+        GroupReport: the optimized sessions, one row per physician (sessions,
+        patients, hours, units, efficiency_pct, total_cents, revenue,
+        revenue_per_hour and revenue per visit type) and the group totals
+        as a dict with the same fields plus physicians. efficiency_pct,
+        unbilled_units and revenue_per_hour cover planned sessions only
+        (planned_sessions, planned_hours, planned_units).
+    """
+    optimized = optimize_sessions(sessions, physicians, workers)
+    by_physician = _report(optimized, "physician_id")
+    if physicians is not None and "name" in physicians:
+        by_physician.insert(1, "name", by_physician["physician_id"].map(
+            physicians.set_index("physician_id")["name"]))
+    group = {"physicians": len(by_physician), **_report(optimized).to_dict("records")[0]}
+    return GroupReport(optimized, by_physician, group)
+
+
+def physicians_from_config(path: str) -> pd.DataFrame:
+    """physician_id and name of every user in the app's config.yaml."""
+    import yaml
+
+    with open(path) as file:
+        users = yaml.safe_load(file)["credentials"]["usernames"]
+    return pd.DataFrame({"physician_id": list(users), "name": [user.get("name") for user in users.values()]})
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sessions", help="Clinic sessions CSV")
+    parser.add_argument("--physicians", help="Physicians CSV (physician_id, name, apply_rrnp)")
+    parser.add_argument("--config", help="Take physician names from the app's config.yaml")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: CPU count)")
+    parser.add_argument("--output", help="CSV file for the optimized sessions")
+    args = parser.parse_args(argv)
+
+    physicians = None
+    if args.physicians:
+        physicians = pd.read_csv(args.physicians, dtype={"physician_id": str})
+    elif args.config:
+        physicians = physicians_from_config(args.config)
+    sessions = pd.read_csv(args.sessions, dtype={"physician_id": str, "time_of_day": str})
+
+    report = optimize_group(sessions, physicians, args.workers)
+    if args.output:
+        report.sessions.to_csv(args.output, index=False)
+
+    columns = ["physician_id", *(["name"] if "name" in report.physicians else []), "sessions", "patients",
+               "clinic_hours", "billed_units", "available_units", "efficiency_pct", "revenue", "revenue_per_hour"]
+    print(report.physicians[columns].to_string(index=False, float_format=lambda value: f"{value:,.2f}"))
+    group = report.group
+    print(f"Group: {group['physicians']} physicians, {group['sessions']} sessions, ${group['revenue']:,.2f} "
+          f"({group['efficiency_pct']:.1f}% of units billed)")
+    failed = report.sessions[report.sessions["error"].notna()]
+    for row in failed.itertuples():
+        print(f"Session {row.Index} ({row.physician_id}): {row.error}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,375 @@
+"""
+Asyncio JSON pricing service for EMR quote requests.
+
+Endpoints (JSON in, JSON out):
+    POST /quote    {"hsc_code", "duration_minutes", "virtual", "time_of_day"}
+    POST /quotes   {"encounters": [<quote request>, ...]}
+    POST /clinic   {"clinic_hours", "new_consults", "repeat_consults", "follow_ups",
+                    "virtual", "apply_rrnp", "time_of_day"}
+    GET  /health
+    GET  /stats    request counts and p50/p99 latency per endpoint
+
+Single quotes that arrive together are micro-batched: the first one opens a
+short window (BATCH_WINDOW_SECONDS), and everything queued by then is priced
+with one `optimal_billing_strategy_batch` call. Quotes are kept in a bounded
+LRU cache keyed by their inputs. Responses have the same shape as
+`optimal_billing_strategy`.
+
+Usage:
+    python pricing_service.py serve --port 8080
+    python pricing_service.py loadtest --requests 20000 --concurrency 64
+    python pricing_service.py loadtest --target 127.0.0.1:8080
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from collections import OrderedDict, defaultdict, deque
+
+from billing_batch import optimal_billing_strategy_batch
+from billing_functions import optimal_billing_strategy
+from fee_schedule import FEE_SCHEDULE
+
+BATCH_WINDOW_SECONDS = 0.002
+MAX_BATCH_SIZE = 1024
+QUOTE_CACHE_SIZE = 10_000
+MAX_BODY_BYTES = 10 * 1024 * 1024
+
+# Latest latencies kept per endpoint for /stats
+LATENCY_SAMPLES = 10_000
+
+# /stats keeps one bucket per route and lumps every other path into "other",
+# so clients cannot grow it with made-up paths or query strings
+ROUTES = ("/quote", "/quotes", "/clinic", "/health", "/stats")
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+def _json_object(request) -> dict:
+    if not isinstance(request, dict):
+        raise ValueError("Expected a JSON object")
+    return request
+
+
+def _quote_key(request: dict) -> tuple:
+    request = _json_object(request)
+    if "hsc_code" not in request or "duration_minutes" not in request:
+        raise ValueError("A quote needs hsc_code and duration_minutes")
+    return (str(request["hsc_code"]), int(request["duration_minutes"]), bool(request.get("virtual", False)),
+            request.get("time_of_day") or None)
+
+
+def _quote_result(code: str, complexity: str, addon_units: int, total_fee: float) -> dict:
+    """A batch result row in the shape `optimal_billing_strategy` returns."""
+    service = FEE_SCHEDULE.codes.get(code)
+    addon = service.addon if service is not None else None
+    return {
+        "base_code": code,
+        "modifiers_applied": [complexity] if complexity else [],
+        "add_on_codes": [f"{addon} ({addon_units} unit{'s' if addon_units > 1 else ''})"] if addon_units else [],
+        "total_fee": round(float(total_fee), 2),
+    }
+
+
+def price_quotes(keys: list) -> list:
+    """
+    Price quote keys in one vectorized call. If the batch is rejected (one
+    encounter past the add-on cap), each key is priced on its own so only the
+    bad ones fail; those come back as ValueError instances.
+    """
+    codes, minutes, virtual, time_of_day = (list(column) for column in zip(*keys))
+    try:
+        priced = optimal_billing_strategy_batch(codes, minutes, virtual, time_of_day)
+    except ValueError:
+        results = []
+        for key in keys:
+            try:
+                results.append(optimal_billing_strategy(*key))
+            except ValueError as exc:
+                results.append(exc)
+        return results
+    return [_quote_result(code, complexity, int(units), fee)
+            for code, complexity, units, fee in zip(codes, priced["complexity"], priced["addon_units"],
+                                                    priced["total_fee"])]
+
+
+class QuoteBatcher:
+    """Collects concurrent single-quote requests and prices them together."""
+
+    def __init__(self, window: float = BATCH_WINDOW_SECONDS, max_batch: int = MAX_BATCH_SIZE,
+                 cache_size: int = QUOTE_CACHE_SIZE):
+        self.window = window
+        self.max_batch = max_batch
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.pending = []
+        self.batches = 0
+        self.cache_hits = 0
+        self._flush_handle = None
+
+    def _cached(self, key):
+        result = self.cache.get(key)
+        if result is not None:
+            self.cache.move_to_end(key)
+            self.cache_hits += 1
+        return result
+
+    def _store(self, key, result: dict):
+        self.cache[key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    async def quote(self, key: tuple) -> dict:
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((key, future))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.window, self.flush)
+        return await future
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+
+        self.batches += 1
+        unique = list(dict.fromkeys(key for key, _ in batch))
+        results = dict(zip(unique, price_quotes(unique)))
+        for key, future in batch:
+            result = results[key]
+            if not isinstance(result, Exception):
+                self._store(key, result)
+            if future.done():  # the client went away
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def quote_many(self, keys: list) -> list:
+        """Bulk quotes, priced directly (they are a batch already) and cached."""
+        results = {}
+        for key in keys:
+            if key not in results:
+                results[key] = self._cached(key)
+        missing = [key for key, result in results.items() if result is None]
+        for key, result in zip(missing, price_quotes(missing) if missing else []):
+            if isinstance(result, Exception):
+                raise ValueError(f"{key[0]} {key[1]} min: {result}")
+            self._store(key, result)
+            results[key] = result
+        return [results[key] for key in keys]
+
+
+def _clinic_plan(request: dict) -> dict:
+    from billing_breakdown import format_breakdown
+    from clinic_optimizer import optimize_clinic
+
+    breakdown, summary = optimize_clinic(
+        float(request["clinic_hours"]), int(request.get("new_consults", 0)), int(request.get("repeat_consults", 0)),
+        int(request.get("follow_ups", 0)), virtual=bool(request.get("virtual", False)),
+        apply_rrnp=bool(request.get("apply_rrnp", False)), time_of_day=request.get("time_of_day") or None,
+    )
+    return {"summary": summary, "breakdown": format_breakdown(breakdown).to_dict(orient="records")}
+
+
+class PricingService:
+    """HTTP/1.1 front end (keep-alive, JSON bodies) over a QuoteBatcher."""
+
+    def __init__(self, batcher: QuoteBatcher = None):
+        self.batcher = batcher or QuoteBatcher()
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCY_SAMPLES))
+        self.requests = defaultdict(int)
+        self.server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080):
+        self.server = await asyncio.start_server(self._connection, host, port, limit=MAX_BODY_BYTES)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def _route(self, method: str, path: str, body: bytes):
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+        if method == "GET" and path == "/stats":
+            return 200, self.stats()
+        if method != "POST" or path not in ("/quote", "/quotes", "/clinic"):
+            return 404, {"error": f"No route for {method} {path}"}
+
+        request = _json_object(json.loads(body or b"{}"))
+        if path == "/quote":
+            return 200, await self.batcher.quote(_quote_key(request))
+        if path == "/quotes":
+            keys = [_quote_key(item) for item in request.get("encounters", [])]
+            return 200, {"quotes": self.batcher.quote_many(keys)}
+        # The optimizer is CPU-bound for large clinics; keep the loop serving quotes meanwhile
+        return 200, await asyncio.to_thread(_clinic_plan, request)
+
+    async def _connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                start = time.perf_counter()
+                route, headers = None, {}
+                try:
+                    lines = head.decode("latin-1").split("\r\n")
+                    method, path, _ = lines[0].split(" ", 2)
+                    route = path.split("?", 1)[0]
+                    headers = {k.strip().lower(): v.strip()
+                               for k, _, v in (line.partition(":") for line in lines[1:] if line)}
+                    length = int(headers.get("content-length", 0))
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    # Where the next request starts is unknown, so answer and hang up
+                    route, status, payload = None, 400, {"error": "Malformed request"}
+                else:
+                    if length > MAX_BODY_BYTES:
+                        status, payload = 413, {"error": "Request body too large"}
+                    else:
+                        body = await reader.readexactly(length) if length else b""
+                        try:
+                            status, payload = await self._route(method, route, body)
+                        except (KeyError, TypeError, ValueError) as exc:
+                            status, payload = 400, {"error": str(exc)}
+                        except Exception as exc:  # keep serving other requests
+                            status, payload = 500, {"error": repr(exc)}
+
+                data = json.dumps(payload, default=str).encode()
+                keep_alive = route is not None and headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {_REASONS[status]}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                    .encode() + data
+                )
+                await writer.drain()
+                endpoint = route if route in ROUTES else "other"
+                self.requests[endpoint] += 1
+                self.latencies[endpoint].append(time.perf_counter() - start)
+                if not keep_alive or status == 413:
+                    break
+        finally:
+            writer.close()
+
+    def stats(self) -> dict:
+        endpoints = {}
+        for path, samples in self.latencies.items():
+            ordered = sorted(samples)
+            endpoints[path] = {
+                "requests": self.requests[path],
+                "p50_ms": ordered[len(ordered) // 2] * 1e3,
+                "p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1e3,
+            }
+        return {"endpoints": endpoints, "batches": self.batcher.batches, "cache_hits": self.batcher.cache_hits,
+                "cache_size": len(self.batcher.cache)}
+
+
+# ---- load test ----
+
+def _random_quote(rng: random.Random) -> dict:
+    code = rng.choice(FEE_SCHEDULE.strategy_codes)
+    service = FEE_SCHEDULE.codes[code]
+    addon = FEE_SCHEDULE.addons.get(service.addon)
+    longest = service.strategy_minutes + (addon.max_units * addon.unit_minutes if addon else 0)
+    return {"hsc_code": code, "duration_minutes": rng.randint(0, longest), "virtual": rng.random() < 0.3,
+            "time_of_day": rng.choice([None, None, "EV", "WK", "NTAM", "NTPM"])}
+
+
+async def _client(host: str, port: int, bodies: list, latencies: list):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for body in bodies:
+            start = time.perf_counter()
+            writer.write(f"POST /quote HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = int(head.lower().split(b"content-length:")[1].split(b"\r\n")[0])
+            response = await reader.readexactly(length)
+            if not head.startswith(b"HTTP/1.1 200"):
+                raise RuntimeError(f"Quote failed: {response.decode()}")
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def load_test(requests: int = 20_000, concurrency: int = 64, target: str = None, seed: int = 0) -> dict:
+    """
+    Fire `requests` single quotes over `concurrency` keep-alive connections.
+    Without a target, a service is started in this event loop.
+
+    Returns:
+        dict with requests, seconds, requests_per_sec, p50_ms, p99_ms and,
+        for an in-process service, its batch and cache counters.
+    """
+    service = None
+    if target:
+        host, port = target.rsplit(":", 1)
+        port = int(port)
+    else:
+        service = PricingService()
+        host, port = await service.start("127.0.0.1", 0)
+
+    rng = random.Random(seed)
+    bodies = [json.dumps(_random_quote(rng)).encode() for _ in range(requests)]
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, bodies[i::concurrency], latencies) for i in range(concurrency)))
+    seconds = time.perf_counter() - start
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    result = {
+        "requests": len(latencies),
+        "seconds": round(seconds, 3),
+        "requests_per_sec": round(len(latencies) / seconds),
+        "p50_ms": round(quantiles[49] * 1e3, 3),
+        "p99_ms": round(quantiles[98] * 1e3, 3),
+    }
+    if service is not None:
+        result.update(batches=service.batcher.batches, cache_hits=service.batcher.cache_hits)
+        service.server.close()
+        await service.server.wait_closed()
+    return result
+
+
+async def serve(host: str, port: int):
+    service = PricingService()
+    host, port = await service.start(host, port)
+    print(f"Pricing service on http://{host}:{port}")
+    async with service.server:
+        await service.server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Async JSON pricing service.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("serve", help="Run the service")
+    command.add_argument("--host", default="127.0.0.1")
+    command.add_argument("--port", type=int, default=8080)
+
+    command = commands.add_parser("loadtest", help="Measure throughput and latency of /quote")
+    command.add_argument("--requests", type=int, default=20_000)
+    command.add_argument("--concurrency", type=int, default=64)
+    command.add_argument("--target", help="host:port of a running service (default: start one in-process)")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        asyncio.run(serve(args.host, args.port))
+    else:
+        print(json.dumps(asyncio.run(load_test(args.requests, args.concurrency, args.target)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
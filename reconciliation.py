@@ -0,0 +1,300 @@
+"""
+Remittance reconciliation: match AHCIP payments against billed claims.
+
+Each billed claim is split into the lines AHCIP assesses separately, the
+visit code and its 03.08I add-on, with the expected fee of each from the
+batch twin of `billing_functions.optimal_billing_strategy` (kept
+fee-identical by billing_benchmark). Claim identity is (physician_id,
+patient_id, service_date, hsc_code); remittance lines are summed per
+identity, so reassessments and adjustments net out. The two sides are then
+hash-joined on identity and every line is classified:
+
+    paid        paid within tolerance of expected
+    underpaid   paid, but less than expected
+    overpaid    paid more than expected
+    refused     assessed at $0
+    missing     no remittance line yet (missing_addon for 03.08I)
+    unexpected  paid, but not in the billed claims
+
+Files of any size are reconciled as a partitioned (Grace) hash join: both
+sides are streamed in chunks, normalized to claim lines and spread by a hash
+of the identity over partition files, then each partition pair is joined in
+memory. Memory is bounded by the chunk size and the largest partition.
+
+Billed input: physician_id, patient_id, service_date, hsc_code and minutes
+(or duration_minutes); virtual, time_of_day, complexity and apply_rrnp are
+optional. Pipeline output with those id columns carried through works as is.
+Remittance input: physician_id, patient_id, service_date, hsc_code and
+paid_cents (or paid_amount in dollars); explain_code is optional.
+
+Usage:
+    python reconciliation.py billed.csv remittance.csv [--exceptions exceptions.csv] [--partitions 16]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from billing_batch import optimal_billing_strategy_batch
+from billing_breakdown import ADDON_CODE, rrnp_cents, to_cents
+from fee_schedule import FEE_SCHEDULE
+
+CLAIM_KEY = ["physician_id", "patient_id", "service_date", "hsc_code"]
+
+STATUSES = ("paid", "underpaid", "overpaid", "refused", "missing", "missing_addon", "unexpected")
+
+DEFAULT_PARTITIONS = 16
+DEFAULT_CHUNKSIZE = 100_000
+
+_TRUE_STRINGS = {"true", "t", "1", "yes", "y"}
+
+
+def _keys(frame: pd.DataFrame) -> pd.DataFrame:
+    """Claim identity columns as strings, with ISO service dates."""
+    return pd.DataFrame({
+        "physician_id": frame["physician_id"].astype(str),
+        "patient_id": frame["patient_id"].astype(str),
+        "service_date": pd.to_datetime(frame["service_date"]).dt.strftime("%Y-%m-%d"),
+        "hsc_code": frame["hsc_code"].astype(str),
+    }, index=frame.index)
+
+
+def _flag(frame: pd.DataFrame, column: str) -> np.ndarray:
+    if column not in frame:
+        return np.zeros(len(frame), dtype=bool)
+    values = frame[column]
+    if values.dtype == bool:
+        return values.to_numpy()
+    return values.astype(str).str.strip().str.lower().isin(_TRUE_STRINGS).to_numpy()
+
+
+def billed_lines(billed: pd.DataFrame) -> pd.DataFrame:
+    """
+    Expected remittance lines for billed claims: one per visit code, plus
+    one 03.08I line per claim with add-on units.
+
+    Returns:
+        DataFrame: CLAIM_KEY columns, modifier, units and expected_cents.
+    """
+    minutes = (billed["minutes"] if "minutes" in billed else billed["duration_minutes"]).to_numpy(dtype=np.int64)
+    codes = billed["hsc_code"].astype(str).to_numpy(dtype=object)
+    virtual = _flag(billed, "virtual")
+    surc = billed["time_of_day"].astype(object).where(billed["time_of_day"].notna(), None).to_numpy() \
+        if "time_of_day" in billed else None
+    rrnp = _flag(billed, "apply_rrnp")
+
+    # The visit alone is the strategy priced at no more than its threshold minutes
+    threshold = pd.Series(codes).map(
+        {code: service.strategy_minutes for code, service in FEE_SCHEDULE.codes.items()}).fillna(0).to_numpy()
+    total = optimal_billing_strategy_batch(codes, minutes, virtual=virtual, time_of_day=surc)
+    visit = optimal_billing_strategy_batch(codes, np.minimum(minutes, threshold).astype(np.int64),
+                                           virtual=virtual, time_of_day=surc)
+    total_cents = np.where(rrnp, rrnp_cents(total["total_fee"]), to_cents(total["total_fee"]))
+    visit_cents = np.where(rrnp, rrnp_cents(visit["total_fee"]), to_cents(visit["total_fee"]))
+
+    keys = _keys(billed)
+    visits = keys.assign(modifier=pd.Series(total["complexity"], index=keys.index).fillna(""),
+                         units=1, expected_cents=visit_cents)
+    has_addon = total["addon_units"] > 0
+    addons = keys[has_addon].assign(hsc_code=ADDON_CODE, modifier="", units=total["addon_units"][has_addon],
+                                    expected_cents=(total_cents - visit_cents)[has_addon])
+    return pd.concat([visits, addons], ignore_index=True)
+
+
+def remitted_lines(remittance: pd.DataFrame) -> pd.DataFrame:
+    """
+    Remittance lines normalized to CLAIM_KEY, paid_cents and explain_code.
+    """
+    if "paid_cents" in remittance:
+        paid = remittance["paid_cents"].to_numpy(dtype=np.int64)
+    else:
+        paid = to_cents(remittance["paid_amount"])
+    explain = remittance["explain_code"].astype(object).where(remittance["explain_code"].notna(), "") \
+        if "explain_code" in remittance else ""
+    return _keys(remittance).assign(paid_cents=paid, explain_code=explain).reset_index(drop=True)
+
+
+def match_lines(expected: pd.DataFrame, remitted: pd.DataFrame, tolerance_cents: int = 0) -> pd.DataFrame:
+    """
+    Hash-join expected and remitted lines on claim identity and classify them.
+    Lines are summed per identity first; a reassessed claim keeps its first
+    explanation code.
+
+    Parameters:
+        expected (DataFrame): billed_lines output.
+        remitted (DataFrame): remitted_lines output.
+        tolerance_cents (int): Payment difference still counted as paid.
+
+    Returns:
+        DataFrame: one row per claim identity with modifier, units,
+        expected_cents, paid_cents, variance_cents (paid - expected),
+        explain_code and status.
+    """
+    expected = expected.groupby(CLAIM_KEY, as_index=False, sort=False).agg(
+        modifier=("modifier", "first"), units=("units", "sum"), expected_cents=("expected_cents", "sum"))
+    # "first" skips the blanks, and unlike min/max on strings it stays in Cython
+    remitted = remitted.assign(explain_code=remitted["explain_code"].replace("", None))
+    remitted = remitted.groupby(CLAIM_KEY, as_index=False, sort=False).agg(
+        paid_cents=("paid_cents", "sum"), explain_code=("explain_code", "first"))
+
+    lines = expected.merge(remitted, on=CLAIM_KEY, how="outer", indicator=True)
+    billed = lines["_merge"] != "right_only"
+    remitted_any = lines["_merge"] != "left_only"
+    lines = lines.drop(columns="_merge")
+    lines["modifier"] = lines["modifier"].fillna("")
+    lines["units"] = lines["units"].fillna(0).astype(np.int64)
+    lines["expected_cents"] = lines["expected_cents"].fillna(0).astype(np.int64)
+    lines["paid_cents"] = lines["paid_cents"].fillna(0).astype(np.int64)
+    lines["explain_code"] = lines["explain_code"].fillna("")
+    lines["variance_cents"] = lines["paid_cents"] - lines["expected_cents"]
+
+    variance = lines["variance_cents"].to_numpy()
+    paid = lines["paid_cents"].to_numpy()
+    addon = (lines["hsc_code"] == ADDON_CODE).to_numpy()
+    lines["status"] = np.select(
+        [~remitted_any & addon, ~remitted_any, ~billed, paid == 0,
+         variance < -tolerance_cents, variance > tolerance_cents],
+        ["missing_addon", "missing", "unexpected", "refused", "underpaid", "overpaid"],
+        default="paid",
+    )
+    return lines
+
+
+def summarize_lines(lines: pd.DataFrame) -> pd.DataFrame:
+    """
+    Variance per HSC code and modifier: lines, expected_cents, paid_cents,
+    variance_cents and a count per status.
+    """
+    counts = pd.crosstab([lines["hsc_code"], lines["modifier"]], lines["status"]).reindex(
+        columns=list(STATUSES), fill_value=0)
+    totals = lines.groupby(["hsc_code", "modifier"]).agg(
+        lines=("status", "size"), expected_cents=("expected_cents", "sum"), paid_cents=("paid_cents", "sum"),
+        variance_cents=("variance_cents", "sum"))
+    return totals.join(counts).reset_index()
+
+
+def _with_dollars(report: pd.DataFrame) -> pd.DataFrame:
+    # "paid" is already the count of lines paid as expected
+    for column in ("expected_cents", "paid_cents", "variance_cents"):
+        report[column.replace("_cents", "_dollars")] = report[column] / 100
+    return report
+
+
+def reconcile(billed: pd.DataFrame, remittance: pd.DataFrame, tolerance_cents: int = 0):
+    """
+    Reconcile in-memory billed claims against remittance lines.
+
+    Returns:
+        (DataFrame, DataFrame): match_lines output and the
+        summarize_lines report with expected_dollars, paid_dollars and
+        variance_dollars columns.
+    """
+    lines = match_lines(billed_lines(billed), remitted_lines(remittance), tolerance_cents)
+    return lines, _with_dollars(summarize_lines(lines))
+
+
+def _read_chunks(path: str, chunksize: int):
+    if os.path.splitext(path)[1].lower() == ".parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+        return
+    from billing_pipeline import read_encounters
+
+    yield from read_encounters(path, chunksize)
+
+
+def _partition(source: str, normalize, partitions: int, directory: str, side: str, chunksize: int) -> list:
+    """Stream a file into per-partition Parquet files of normalized lines, split by claim identity hash."""
+    from claim_export import ParquetClaimWriter
+
+    paths = [os.path.join(directory, f"{side}-{p}.parquet") for p in range(partitions)]
+    # Each open writer buffers its own rows, so split the chunk budget between them
+    writers = [ParquetClaimWriter(path, buffer_rows=max(1, chunksize // partitions)) for path in paths]
+    try:
+        for chunk in _read_chunks(source, chunksize):
+            lines = normalize(chunk)
+            partition = pd.util.hash_pandas_object(lines[CLAIM_KEY], index=False).to_numpy() % partitions
+            for p, part in lines.groupby(partition, sort=False):
+                writers[p].write(part)
+    finally:
+        for writer in writers:
+            writer.close()
+    return [path if writer.rows else None for path, writer in zip(paths, writers)]
+
+
+def reconcile_files(billed_path: str, remittance_path: str, exceptions_path: str = None,
+                    tolerance_cents: int = 0, partitions: int = DEFAULT_PARTITIONS,
+                    chunksize: int = DEFAULT_CHUNKSIZE) -> pd.DataFrame:
+    """
+    Reconcile a billed-claims file against a remittance file in bounded memory.
+
+    Parameters:
+        billed_path, remittance_path (str): CSV, JSONL or Parquet files.
+        exceptions_path (str): Optional file (any claim_export format) for
+            every line not reconciled as paid.
+        tolerance_cents (int): Payment difference still counted as paid.
+        partitions (int): Hash partitions; raise it when a partition pair
+            does not fit in memory.
+        chunksize (int): Rows read at a time.
+
+    Returns:
+        DataFrame: the per code and modifier report, as from reconcile.
+    """
+    import pyarrow.parquet as pq
+    from claim_export import open_claim_writer
+
+    empty_expected = pd.DataFrame(columns=CLAIM_KEY + ["modifier", "units", "expected_cents"])
+    empty_remitted = pd.DataFrame(columns=CLAIM_KEY + ["paid_cents", "explain_code"])
+    reports = []
+    with tempfile.TemporaryDirectory(prefix="nephbill-reconcile-") as directory:
+        expected_parts = _partition(billed_path, billed_lines, partitions, directory, "billed", chunksize)
+        remitted_parts = _partition(remittance_path, remitted_lines, partitions, directory, "remitted", chunksize)
+
+        exceptions = open_claim_writer(exceptions_path) if exceptions_path else None
+        try:
+            for expected_part, remitted_part in zip(expected_parts, remitted_parts):
+                if expected_part is None and remitted_part is None:
+                    continue
+                expected = pq.read_table(expected_part).to_pandas() if expected_part else empty_expected
+                remitted = pq.read_table(remitted_part).to_pandas() if remitted_part else empty_remitted
+                lines = match_lines(expected, remitted, tolerance_cents)
+                reports.append(summarize_lines(lines))
+                if exceptions is not None:
+                    exceptions.write(lines[lines["status"] != "paid"])
+        finally:
+            if exceptions is not None:
+                exceptions.close()
+
+    if not reports:
+        return _with_dollars(summarize_lines(match_lines(empty_expected, empty_remitted)))
+    report = pd.concat(reports).groupby(["hsc_code", "modifier"], as_index=False).sum()
+    return _with_dollars(report)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("billed", help="Billed claims (.csv, .jsonl or .parquet)")
+    parser.add_argument("remittance", help="Remittance lines (.csv, .jsonl or .parquet)")
+    parser.add_argument("--exceptions", help="Write every line not paid as expected here")
+    parser.add_argument("--tolerance-cents", type=int, default=0, help="Difference still counted as paid")
+    parser.add_argument("--partitions", type=int, default=DEFAULT_PARTITIONS, help="Hash partitions")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="Rows read at a time")
+    args = parser.parse_args(argv)
+
+    report = reconcile_files(args.billed, args.remittance, args.exceptions, args.tolerance_cents,
+                             args.partitions, args.chunksize)
+    print(report[["hsc_code", "modifier", "lines", "expected_dollars", "paid_dollars", "variance_dollars"]
+                 + list(STATUSES)].to_string(index=False))
+    print(f"Total: expected ${report['expected_dollars'].sum():,.2f}, paid ${report['paid_dollars'].sum():,.2f} "
+          f"({report['variance_dollars'].sum():+,.2f})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
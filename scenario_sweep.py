@@ -0,0 +1,163 @@
+"""
+What-if sweeps of the clinic optimizer over patient-mix grids.
+
+Evaluates max revenue and efficiency for every combination of clinic hours,
+new / repeat / follow-up counts, virtual, RRNP and SURC in one go. The
+knapsack tables from clinic_optimizer are built once per flag combination
+and stacked: new consults are folded in first, then repeat consults across
+all new-consult counts at once, then follow-ups across all of those. Every
+clinic length falls out of the same tables, since they already hold the best
+revenue for each number of units. Clinics too short for their patients' base
+units are priced with the even split, as optimize_clinic prices them. Results
+are cached by a hash of the parameters.
+"""
+
+import hashlib
+import itertools
+import json
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from billing_batch import optimal_billing_strategy_batch
+from billing_breakdown import BASE_UNITS, rrnp_cents, to_cents
+from clinic_optimizer import UNIT_MINUTES, _visit_code, add_patient, empty_table, fee_curve
+
+SWEEP_CACHE_SIZE = 32
+
+_sweep_cache = OrderedDict()
+
+
+def sweep_key(**params) -> str:
+    """Stable SHA-256 of the sweep parameters."""
+    canonical = json.dumps({k: list(v) for k, v in sorted(params.items())}, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _fold(tables: np.ndarray, counts, min_units: int, curve: tuple) -> np.ndarray:
+    """
+    Add up to max(counts) identical patients to every table and keep a
+    snapshot at each requested count, as a new axis before capacity.
+    """
+    counts = sorted(set(counts))
+    snapshots = []
+    added = 0
+    for count in counts:
+        while added < count:
+            tables = add_patient(tables, min_units, curve)
+            added += 1
+        snapshots.append(tables)
+    return np.stack(snapshots, axis=-2)
+
+
+def _best_within(tables: np.ndarray, capacities) -> tuple:
+    """
+    Top revenue and units used (fewest among ties) for each capacity limit,
+    from tables indexed by exact units.
+    """
+    running = np.maximum.accumulate(tables, axis=-1)
+    previous = np.concatenate([np.full(running.shape[:-1] + (1,), np.iinfo(np.int64).min), running[..., :-1]], axis=-1)
+    first_reached = np.where(tables > previous, np.arange(tables.shape[-1]), 0)
+    units_used = np.maximum.accumulate(first_reached, axis=-1)
+    return running[..., capacities], units_used[..., capacities]
+
+
+def _even_split(points: pd.DataFrame) -> tuple:
+    """
+    plan_clinic's total_cents and billed_units for grid points whose base
+    units do not fit. Every patient gets the average time, and with no
+    unbilled units left there is nothing to redistribute, so each visit type
+    is one fee times its count.
+    """
+    average = np.round(points["clinic_hours"].to_numpy(dtype=float) * 60).astype(np.int64) // (
+        points[["new_consults", "repeat_consults", "follow_ups"]].sum(axis=1).to_numpy())
+    virtual = points["virtual"].to_numpy(dtype=bool)
+    rrnp = points["apply_rrnp"].to_numpy(dtype=bool)
+    total_cents = np.zeros(len(points), dtype=np.int64)
+    billed_units = np.zeros(len(points), dtype=np.int64)
+    for visit_type, column in (("New Consult", "new_consults"), ("Repeat Consult", "repeat_consults"),
+                               ("Follow-up", "follow_ups")):
+        codes = [_visit_code(visit_type, is_virtual) for is_virtual in virtual]
+        surc = points["time_of_day"].to_numpy(dtype=object) if visit_type == "Repeat Consult" else None
+        priced = optimal_billing_strategy_batch(codes, average, virtual=virtual, time_of_day=surc)
+        cents = np.where(rrnp, rrnp_cents(priced["total_fee"]), to_cents(priced["total_fee"]))
+        count = points[column].to_numpy(dtype=np.int64)
+        total_cents += count * cents
+        billed_units += count * (BASE_UNITS[visit_type] + priced["addon_units"])
+    return total_cents, billed_units
+
+
+def sweep_clinics(clinic_hours, new_consults, repeat_consults, follow_ups,
+                  virtual=(False,), apply_rrnp=(False,), time_of_day=(None,)) -> pd.DataFrame:
+    """
+    Max-revenue clinic plans over a full parameter grid.
+
+    Parameters:
+        clinic_hours (list of int): Clinic lengths in hours.
+        new_consults, repeat_consults, follow_ups (list of int): Patient counts.
+        virtual (list of bool): Virtual flags to try.
+        apply_rrnp (list of bool): RRNP settings to try.
+        time_of_day (list of str): SURC codes for repeat consults (None for none).
+
+    Returns:
+        DataFrame: one row per grid point with revenue (dollars), total_cents,
+        billed_units, available_units, efficiency_pct, feasible and
+        even_split. Points where the patients' base units do not fit have
+        feasible False and are priced by plan_clinic (even_split True).
+    """
+    params = dict(clinic_hours=clinic_hours, new_consults=new_consults, repeat_consults=repeat_consults,
+                  follow_ups=follow_ups, virtual=virtual, apply_rrnp=apply_rrnp, time_of_day=time_of_day)
+    key = sweep_key(**params)
+    if key in _sweep_cache:
+        _sweep_cache.move_to_end(key)
+        return _sweep_cache[key].copy()
+
+    hours = sorted(set(clinic_hours))
+    news, repeats, follows = sorted(set(new_consults)), sorted(set(repeat_consults)), sorted(set(follow_ups))
+    capacities = np.array([int(h * 60) // UNIT_MINUTES for h in hours])
+    max_capacity = int(capacities.max())
+
+    frames = []
+    for is_virtual, rrnp, tod in itertools.product(virtual, apply_rrnp, time_of_day):
+        new_code = "03.08CV" if is_virtual else "03.08A"
+        follow_code = "03.03FV" if is_virtual else "03.03F"
+        new_min, repeat_min, follow_min = BASE_UNITS["New Consult"], BASE_UNITS["Repeat Consult"], BASE_UNITS["Follow-up"]
+
+        tables = _fold(empty_table(max_capacity), news, new_min,
+                       fee_curve(new_code, new_min, is_virtual, None, rrnp))
+        tables = _fold(tables, repeats, repeat_min, fee_curve("03.07B", repeat_min, is_virtual, tod, rrnp))
+        tables = _fold(tables, follows, follow_min, fee_curve(follow_code, follow_min, is_virtual, None, rrnp))
+
+        # Axes: new, repeat, follow-up, clinic hours
+        cents, used = _best_within(tables, capacities)
+        grid = pd.MultiIndex.from_product([news, repeats, follows, hours],
+                                          names=["new_consults", "repeat_consults", "follow_ups", "clinic_hours"])
+        frame = grid.to_frame(index=False)
+        frame["virtual"] = is_virtual
+        frame["apply_rrnp"] = rrnp
+        frame["time_of_day"] = tod
+        frame["total_cents"] = cents.ravel()
+        frame["billed_units"] = used.ravel()
+        frame["available_units"] = np.broadcast_to(capacities, cents.shape).ravel()
+        frames.append(frame)
+
+    result = pd.concat(frames, ignore_index=True)
+    result["feasible"] = result["total_cents"] >= 0
+    result["even_split"] = ~result["feasible"]
+    # optimize_clinic falls back to the even split here, so the sweep does too
+    if result["even_split"].any():
+        short = result["even_split"].to_numpy()
+        total_cents, billed_units = _even_split(result[short])
+        result.loc[short, "total_cents"] = total_cents
+        result.loc[short, "billed_units"] = billed_units
+    result["revenue"] = result["total_cents"] / 100
+    result["efficiency_pct"] = result["billed_units"] / result["available_units"] * 100
+    result = result[["clinic_hours", "new_consults", "repeat_consults", "follow_ups", "virtual", "apply_rrnp",
+                     "time_of_day", "revenue", "total_cents", "billed_units", "available_units",
+                     "efficiency_pct", "feasible", "even_split"]]
+
+    _sweep_cache[key] = result
+    if len(_sweep_cache) > SWEEP_CACHE_SIZE:
+        _sweep_cache.popitem(last=False)
+    return result.copy()
@@ -0,0 +1,258 @@
+"""
+Weekly scheduling of a patient backlog across clinic sessions.
+
+The clinic optimizer prices one clinic with one time of day for every repeat
+consult. Here a week has several sessions, each with its own length, SURC
+window (EV, WK, NTAM, NTPM or none) and virtual flag, and the backlog is
+placed where it bills the most. SURC only applies to 03.07B, so repeat
+consults gravitate to the after-hours sessions and new consults and
+follow-ups fill the rest.
+
+Sessions are valued exactly for a given patient mix: everyone seen at base
+units, then the session's free units go to the best-paying add-on units, as
+the clinic optimizer would split them (its knapsack is used directly when a
+fee curve is not concave past the base units). Placement starts with a
+heap-based greedy: the move that raises the week's revenue most, seeing one
+more backlog patient in some session, is taken until no move pays; only the
+changed session's moves are re-keyed. A local search then moves single
+patients between sessions (or back to the backlog) and swaps patients of
+different types until no move improves revenue. Each session's final mix is
+split with `allocate_units` and priced by the per-encounter rules
+(thresholds, add-on cap, SURC, TELES, RRNP).
+"""
+
+import heapq
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from billing_breakdown import BASE_UNITS, VISIT_TYPES, build_breakdown, summarize_breakdown
+from clinic_optimizer import UNIT_MINUTES, _visit_code, allocate_units, fee_curve
+from fee_schedule import FEE_SCHEDULE
+
+# Local-search passes before giving up on further improvement
+MAX_SEARCH_PASSES = 200
+
+
+def _read_sessions(sessions: pd.DataFrame) -> pd.DataFrame:
+    sessions = sessions.reset_index(drop=True)
+    if "session_id" not in sessions:
+        sessions = sessions.assign(session_id=np.arange(1, len(sessions) + 1))
+    time_of_day = sessions["time_of_day"] if "time_of_day" in sessions else pd.Series(None, index=sessions.index)
+    time_of_day = time_of_day.astype(object).where(time_of_day.notna() & (time_of_day != ""), None)
+    unknown = set(time_of_day.dropna()) - set(FEE_SCHEDULE.surcharges)
+    if unknown:
+        raise ValueError(f"Unknown time of day {sorted(unknown)}, expected one of {list(FEE_SCHEDULE.surcharges)}")
+    return pd.DataFrame({
+        "session_id": sessions["session_id"],
+        "available_units": (np.rint(sessions["hours"].to_numpy(dtype=float) * 60).astype(np.int64)
+                            // UNIT_MINUTES),
+        "time_of_day": time_of_day,
+        "virtual": sessions["virtual"].fillna(False).astype(bool) if "virtual" in sessions else False,
+    })
+
+
+@lru_cache(maxsize=65536)
+def _session_value(capacity: int, counts: tuple, curves: tuple):
+    """
+    Top revenue in cents for counts[i] patients on curves[i] = (min_units,
+    fee_curve) in `capacity` units, or None when their base units do not fit.
+    """
+    needed = sum(count * min_units for count, (min_units, _) in zip(counts, curves))
+    if needed > capacity:
+        return None
+
+    steps = []
+    for count, (min_units, curve) in zip(counts, curves):
+        increments = np.diff(curve)
+        if count and (increments[1:] > increments[:-1]).any():
+            patients = [(min_units, curve) for count, (min_units, curve) in zip(counts, curves) for _ in range(count)]
+            return allocate_units(patients, capacity)[1]
+        steps.extend((int(increment), count) for increment in increments if count and increment > 0)
+
+    # Concave past the base units: free units go to the best increments
+    total = sum(count * curve[0] for count, (_, curve) in zip(counts, curves))
+    free = capacity - needed
+    for increment, count in sorted(steps, reverse=True):
+        units = min(count, free)
+        total += increment * units
+        free -= units
+    return total
+
+
+class _Week:
+    """Patient counts per session and visit type, with the sessions' values."""
+
+    def __init__(self, sessions: pd.DataFrame, waiting: dict, apply_rrnp: bool):
+        self.capacity = sessions["available_units"].tolist()
+        self.curves = []
+        for session in sessions.itertuples():
+            self.curves.append(tuple(
+                (BASE_UNITS[visit_type],
+                 fee_curve(_visit_code(visit_type, session.virtual), BASE_UNITS[visit_type], session.virtual,
+                           session.time_of_day if visit_type == "Repeat Consult" else None, apply_rrnp))
+                for visit_type in VISIT_TYPES
+            ))
+        self.counts = [[0] * len(VISIT_TYPES) for _ in self.capacity]
+        self.waiting = [waiting[visit_type] for visit_type in VISIT_TYPES]
+
+    def value(self, s: int, counts) -> float:
+        value = _session_value(self.capacity[s], tuple(counts), self.curves[s])
+        return -np.inf if value is None else value
+
+    def gain(self, changes) -> float:
+        """Change in the week's value from (session, visit type index, +1/-1) changes."""
+        counts = {}
+        for s, t, change in changes:
+            counts.setdefault(s, list(self.counts[s]))[t] += change
+        return sum(self.value(s, after) - self.value(s, self.counts[s]) for s, after in counts.items())
+
+    def greedy(self):
+        heap = []
+        version = [0] * len(self.capacity)
+        order = 0
+
+        def push(s):
+            nonlocal order
+            for t, waiting in enumerate(self.waiting):
+                gain = self.gain([(s, t, +1)]) if waiting else 0
+                if gain > 0:
+                    heapq.heappush(heap, (-gain, order, s, t, version[s]))
+                    order += 1
+
+        for s in range(len(self.capacity)):
+            push(s)
+        while heap:
+            _, _, s, t, seen = heapq.heappop(heap)
+            # Entries go stale when their session changes (re-keyed below) or
+            # their visit type's backlog runs out
+            if seen != version[s] or not self.waiting[t]:
+                continue
+            self.counts[s][t] += 1
+            self.waiting[t] -= 1
+            version[s] += 1
+            push(s)
+
+    def _moves(self):
+        """
+        Every change of one or two patients that pays: seeing a backlog
+        patient, possibly in place of one or two patients of other types (or
+        two backlog patients in place of one);
+        sending a patient back to the backlog; moving a patient to another
+        session; and swapping patients of different types between sessions.
+        """
+        sessions = range(len(self.capacity))
+        types = range(len(VISIT_TYPES))
+        for a in sessions:
+            for t in types:
+                if not self.waiting[t]:
+                    continue
+                yield ((a, t, +1),)
+                for u in types:
+                    if u != t and self.counts[a][u]:
+                        yield (a, t, +1), (a, u, -1)
+                        for v in types:
+                            if v != t and v >= u and self.counts[a][v] >= 1 + (v == u):
+                                yield (a, t, +1), (a, u, -1), (a, v, -1)
+                            if v != u and v >= t and self.waiting[v] >= 1 + (v == t):
+                                yield (a, t, +1), (a, v, +1), (a, u, -1)
+            for t in types:
+                if not self.counts[a][t]:
+                    continue
+                yield ((a, t, -1),)
+                for b in sessions:
+                    if b == a:
+                        continue
+                    yield (a, t, -1), (b, t, +1)
+                    for u in types:
+                        if u != t and self.counts[b][u]:
+                            yield (a, t, -1), (b, t, +1), (b, u, -1), (a, u, +1)
+
+    def improve(self):
+        for _ in range(MAX_SEARCH_PASSES):
+            improved = False
+            for changes in self._moves():
+                if self.gain(changes) > 0:
+                    for s, t, change in changes:
+                        self.counts[s][t] += change
+                        self.waiting[t] -= change
+                    improved = True
+                    break
+            if not improved:
+                return
+
+
+def schedule_week(sessions: pd.DataFrame, backlog: pd.DataFrame, apply_rrnp: bool = False):
+    """
+    Place a backlog of patients into a week of clinic sessions for maximum revenue.
+
+    Parameters:
+        sessions (DataFrame): One row per session with hours and optionally
+            session_id, time_of_day (SURC code or empty) and virtual.
+        backlog (DataFrame): One row per waiting patient with patient_id and
+            visit_type (one of VISIT_TYPES), longest-waiting first.
+        apply_rrnp (bool): Apply the RRNP uplift.
+
+    Returns:
+        (DataFrame, DataFrame, DataFrame): the schedule, a breakdown table
+        with session_id, time_of_day and patient_id columns in front; one
+        summary row per session (patients, available, billed and unbilled
+        units, total_cents, revenue); and the backlog patients left unscheduled.
+
+    Raises:
+        ValueError: for unknown visit types or SURC codes.
+    """
+    sessions = _read_sessions(sessions)
+    visit_types = backlog["visit_type"].astype(str)
+    unknown = set(visit_types) - set(VISIT_TYPES)
+    if unknown:
+        raise ValueError(f"Unknown visit type {sorted(unknown)}, expected one of {list(VISIT_TYPES)}")
+
+    waiting = {visit_type: int((visit_types == visit_type).sum()) for visit_type in VISIT_TYPES}
+    week = _Week(sessions, waiting, apply_rrnp)
+    week.greedy()
+    week.improve()
+
+    # Longest-waiting patients of each type go to the sessions filled first
+    queues = {visit_type: list(backlog.loc[visit_types == visit_type, "patient_id"]) for visit_type in VISIT_TYPES}
+    scheduled, summaries = [], []
+    for s, session in sessions.iterrows():
+        visit = [visit_type for visit_type, count in zip(VISIT_TYPES, week.counts[s]) for _ in range(count)]
+        if visit:
+            codes = [_visit_code(visit_type, session["virtual"]) for visit_type in visit]
+            surc = [session["time_of_day"] if visit_type == "Repeat Consult" else None for visit_type in visit]
+            curves = [(BASE_UNITS[visit_type], fee_curve(code, BASE_UNITS[visit_type], session["virtual"], tod,
+                                                         apply_rrnp))
+                      for visit_type, code, tod in zip(visit, codes, surc)]
+            allocation, _ = allocate_units(curves, int(session["available_units"]))
+
+            breakdown = build_breakdown(visit, codes, np.array(allocation, dtype=np.int64) * UNIT_MINUTES,
+                                        virtual=session["virtual"], time_of_day=surc, apply_rrnp=apply_rrnp)
+            breakdown["base_units"] = np.array(allocation, dtype=np.int64) - breakdown["addon_units"].to_numpy()
+            breakdown.insert(0, "patient_id", [queues[visit_type].pop(0) for visit_type in visit])
+            breakdown.insert(0, "time_of_day", session["time_of_day"])
+            breakdown.insert(0, "session_id", session["session_id"])
+            scheduled.append(breakdown)
+            summary = summarize_breakdown(breakdown, int(session["available_units"]))
+        else:
+            summary = {"total_cents": 0, "billed_units": 0, "unbilled_units": int(session["available_units"])}
+
+        summaries.append({
+            "session_id": session["session_id"],
+            "time_of_day": session["time_of_day"],
+            "virtual": session["virtual"],
+            "patients": len(visit),
+            "available_units": int(session["available_units"]),
+            "billed_units": summary["billed_units"],
+            "unbilled_units": summary["unbilled_units"],
+            "total_cents": summary["total_cents"],
+        })
+
+    schedule = pd.concat(scheduled, ignore_index=True) if scheduled else pd.DataFrame(
+        columns=["session_id", "time_of_day", "patient_id"])
+    summary = pd.DataFrame(summaries)
+    summary["revenue"] = summary["total_cents"] / 100
+    left = [patient for queue in queues.values() for patient in queue]
+    unscheduled = backlog[backlog["patient_id"].isin(left)]
+    return schedule, summary, unscheduled